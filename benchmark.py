@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmark MovieCleaner against a synthetic library.
+
+  Generates a library of movie directories (on tmpfs when available) with
+  sparse video files just over MIN_VIDEO_MB, valid and invalid NFOs, samples,
+  subs/ folders, srt files and idx/sub pairs (some of them broken). Each
+  MovieCleaner mode is then timed in-process and reported as directories per
+  second along with counts of the filesystem calls it made.
+
+  Only local modes are timed (lists and renames of directories that already
+  have valid NFOs), so no network access is needed. Filesystem calls made in
+  --jobs worker processes are not counted.
+
+  Startup is timed separately by running moviecleaner.py --list against a
+  single directory in a fresh interpreter, which is what a shell loop piping
+  --list -0 into xargs pays on every call. List modes must not load any of
+  the network providers (see providers.py).
+
+  Example: python benchmark.py --dirs 5000 --jobs 4
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import subprocess
+import tempfile
+import __builtin__
+from optparse import OptionParser
+import video
+import providers
+import moviecleaner
+from util import log
+from video import MIN_VIDEO_MB
+
+TMPFS_DIR    = '/dev/shm'          # Preferred location for the synthetic library
+CLEANER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'moviecleaner.py')
+TITLE_WORDS  = ['the', 'last', 'dark', 'city', 'night', 'river', 'king', 'ghost', 'blue', 'road',
+                'star', 'winter', 'house', 'secret', 'iron', 'lost', 'summer', 'glass', 'wolf', 'moon']
+COUNTED      = [(os, 'listdir'), (os, 'stat'), (os, 'lstat'), (os, 'rename'), (os, 'mkdir'), (__builtin__, 'open')]
+LIST_MODES   = sorted(video.LIST_FUNCTIONS.keys())
+
+
+################################
+#  Synthetic Library
+################################
+
+def _write(path, data):
+    handle = open(path, 'w')
+    handle.write(data)
+    handle.close()
+
+
+def _sparse(path, size):
+    """ Create a sparse file of the given size (takes no space on disk). """
+    handle = open(path, 'w')
+    handle.truncate(size)
+    handle.close()
+
+
+def generateLibrary(baseDir, numDirs, allValidNfos=False, seed=1):
+    """ Create numDirs synthetic movie directories in baseDir.
+        @param allValidNfos: Give every directory a valid NFO (needed to time
+                             renames without hitting IMDB)
+    """
+    rand = random.Random(seed)
+    for i in range(numDirs):
+        title = ' '.join(rand.choice(TITLE_WORDS) for w in range(rand.randint(1, 4))).title()
+        year = rand.randint(1950, 2010)
+        tag = rand.choice(['xvid', 'divx', 'dvdrip', 'bdrip', 'r5'])
+        dirPath = "%s/%s %s (%s) [%s]" % (baseDir, title, i, year, tag)
+        os.mkdir(dirPath)
+        prefix = "%s.%s.%s" % (title.lower().replace(' ', '.'), year, tag)
+        parts = 2 if (rand.random() < 0.15) else 1
+        fileNames = []
+        for part in range(parts):
+            fileName = "%s%s.avi" % (prefix, ".cd%s" % (part+1) if (parts > 1) else '')
+            _sparse("%s/%s" % (dirPath, fileName), MIN_VIDEO_MB + rand.randint(1, 900) * 1048576)
+            fileNames.append(fileName)
+        if (rand.random() < 0.3):
+            _sparse("%s/%s.sample.avi" % (dirPath, prefix), 20 * 1048576)
+        # NFOs: valid xml, scene nfo with an IMDB link, or none
+        roll = 0 if (allValidNfos) else rand.random()
+        if (roll < 0.7):
+            _write("%s/%s.nfo" % (dirPath, prefix), "<xml>\n  <movie>\n    <title>%s %s</title>\n"
+                "    <year>%s</year>\n    <country>USA</country>\n  </movie>\n</xml>\n" % (title, i, year))
+        elif (roll < 0.8):
+            _write("%s/%s.nfo" % (dirPath, prefix), "  ** %s **\n\n http://www.imdb.com/title/tt%07d/\n" % (title, i))
+        # Subtitles: srt in the movie dir, subs/ folder or idx/sub pairs
+        roll = rand.random()
+        if (roll < 0.2):
+            for fileName in fileNames:
+                srt = "1\n00:00:01,000 --> 00:00:02,000\nHello\n\n2\n00:00:03,000 --> 00:00:04,000\nWorld\n\n"
+                if (rand.random() < 0.1): srt = srt[0:rand.randint(20, len(srt) - 8)]    # Truncated
+                _write("%s/%s.srt" % (dirPath, fileName[0:-4]), srt)
+        elif (roll < 0.35):
+            os.mkdir("%s/subs" % dirPath)
+            for fileName in fileNames:
+                _write("%s/subs/%s.idx" % (dirPath, fileName[0:-4]), "# VobSub index file, v7\n")
+                if (rand.random() < 0.9):
+                    _sparse("%s/subs/%s.sub" % (dirPath, fileName[0:-4]), 4 * 1048576)
+
+
+################################
+#  Filesystem Call Counting
+################################
+
+class CallCounter:
+    """ Count calls to the filesystem functions in COUNTED while active. """
+
+    def __init__(self):
+        self.counts = {}
+        self._originals = {}
+
+    def __enter__(self):
+        for module, name in COUNTED:
+            original = getattr(module, name)
+            self._originals[(module, name)] = original
+            self.counts[name] = 0
+            setattr(module, name, self._wrap(name, original))
+        return self
+
+    def __exit__(self, *args):
+        for (module, name), original in self._originals.items():
+            setattr(module, name, original)
+
+    def _wrap(self, name, original):
+        def counted(*args, **kwargs):
+            self.counts[name] += 1
+            return original(*args, **kwargs)
+        return counted
+
+
+################################
+#  Benchmark Runner
+################################
+
+class NullOutput:
+    """ Swallows the list output while timing. """
+    encoding = 'utf-8'
+    def write(self, data): pass
+    def flush(self): pass
+    def isatty(self): return False
+
+
+def runMode(baseDir, args):
+    """ Run MovieCleaner with the command line args and every cache disabled, return (seconds, counts). """
+    noCaches = ['--imdbttl', '0', '--nfocache', '', '--fingerprintcache', '', '--probecache', '']
+    options, extra = moviecleaner.buildOptionParser().parse_args(['--basedir', baseDir] + noCaches + args)
+    stdout = sys.stdout
+    sys.stdout = NullOutput()
+    try:
+        with CallCounter() as counter:
+            startTime = time.time()
+            moviecleaner.MovieCleaner(options).run()
+            elapsed = time.time() - startTime
+    finally:
+        sys.stdout = stdout
+    return elapsed, counter.counts
+
+
+def timeStartup(args, runs):
+    """ Run moviecleaner.py with args in a new interpreter runs times, return the median seconds. """
+    times = []
+    devnull = open(os.devnull, 'w')
+    try:
+        for i in range(runs):
+            startTime = time.time()
+            subprocess.check_call([sys.executable, CLEANER_PATH] + args, stdout=devnull)
+            times.append(time.time() - startTime)
+    finally:
+        devnull.close()
+    return sorted(times)[len(times) / 2]
+
+
+def report(name, numDirs, elapsed, counts):
+    """ Print a single result row. """
+    print "%-22s %8.2fs %10.0f %9s %9s %9s %9s" % (name, elapsed, numDirs / max(elapsed, 0.0001),
+        counts['listdir'], counts['stat'] + counts['lstat'], counts['open'], counts['rename'])
+
+
+def main():
+    parser = OptionParser(description=__doc__.strip())
+    parser.add_option("-d", "--dirs",    help="Number of movie directories [%default]", type='int', default=2000)
+    parser.add_option("-j", "--jobs",    help="Also time list modes with this many jobs [%default]", type='int', default=4)
+    parser.add_option("-m", "--modes",   help="Comma separated list modes to time [all]", default=','.join(LIST_MODES))
+    parser.add_option(      "--tmpdir",  help="Where to build the library [%s if it exists]" % TMPFS_DIR)
+    parser.add_option(      "--norename", help="Skip the rename benchmark", action='store_true', default=False)
+    parser.add_option(      "--startup", help="Runs of each startup timing, 0 to skip [%default]", type='int', default=5)
+    opts, args = parser.parse_args()
+    tmpDir = opts.tmpdir or (TMPFS_DIR if (os.path.isdir(TMPFS_DIR)) else None)
+    workDir = tempfile.mkdtemp(prefix='videocleaner-bench-', dir=tmpDir)
+    try:
+        listDir = "%s/list" % workDir
+        os.mkdir(listDir)
+        startTime = time.time()
+        generateLibrary(listDir, opts.dirs)
+        print "Generated %s directories in %.2fs at %s\n" % (opts.dirs, time.time() - startTime, workDir)
+        print "%-22s %9s %10s %9s %9s %9s %9s" % ('mode', 'time', 'dirs/sec', 'listdir', 'stat', 'open', 'rename')
+        for mode in opts.modes.split(','):
+            report("list %s" % mode, opts.dirs, *runMode(listDir, ['--list', mode]))
+            if (opts.jobs > 1):
+                report("list %s -j%s" % (mode, opts.jobs), opts.dirs, *runMode(listDir, ['--list', mode, '-j', str(opts.jobs)]))
+        if (not opts.norename):
+            renameDir = "%s/rename" % workDir
+            os.mkdir(renameDir)
+            generateLibrary(renameDir, opts.dirs, allValidNfos=True)
+            report("renamefiles+renamedir", opts.dirs, *runMode(renameDir, ['--renamefiles', '--renamedir', '--log', 'SEVERE']))
+        print "\nProviders loaded by local modes: %s" % (', '.join(providers.getLoaded()) or 'none')
+        if (opts.startup):
+            startupDir = "%s/startup" % workDir
+            os.mkdir(startupDir)
+            generateLibrary(startupDir, 1)
+            print "\n%-22s %9s" % ('startup', 'median')
+            print "%-22s %8.3fs" % ('--help', timeStartup(['--help'], opts.startup))
+            for mode in opts.modes.split(','):
+                print "%-22s %8.3fs" % ("--list %s" % mode, timeStartup(['-b', startupDir, '--list', mode], opts.startup))
+    finally:
+        shutil.rmtree(workDir)
+
+
+if (__name__ == "__main__"):
+    try:
+        main()
+    except KeyboardInterrupt:
+        log.severe("\nKeyboard Interrupt: quitting.")
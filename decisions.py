@@ -0,0 +1,110 @@
+"""
+Deferred Decision Queue.
+Unattended (--batch) runs record every ambiguous choice here instead of
+prompting. A later --resolve session asks all the questions back to back from
+the recorded labels (no network needed), then processes the directories with
+the answers in bulk. Trailer search choices also keep the ranked candidates,
+so the answered directory doesn't have to search the providers again.
+
+Queue File Format (JSON):
+  [{"dirPath": "...", "kind": "imdb", "choices": [["label", "value"], ...],
+    "candidates": null, "resolved": false, "selection": null}, ...]
+  candidates: [{"url", "title", "year", "length", "provider", "score"}, ...] or null
+"""
+import os
+import json
+import util
+from util import log
+from util import jsonText
+
+QUEUE_PATH = '~/.videocleaner/decisions.json'    # Default queue location
+
+
+def _value(value):
+    """ Return a value read from JSON with strings as the str the scrapers return. """
+    if (isinstance(value, unicode)):
+        return value.encode('utf-8')
+    return value
+
+
+class DecisionQueue:
+    """ Ambiguous choices waiting for the user. """
+
+    def __init__(self, path=QUEUE_PATH, batch=False):
+        self.path    = os.path.expanduser(path)   # JSON file the queue is stored in
+        self.batch   = batch                      # True to queue choices instead of prompting
+        self.entries = []                         # Queued choices (see module docs)
+        if (os.path.exists(self.path)):
+            handle = open(self.path, 'r')
+            self.entries = json.load(handle)
+            handle.close()
+
+    def get(self, dirPath, kind):
+        """ Return the queued entry for the directory and kind of choice, or None. """
+        for entry in self.entries:
+            if (entry['dirPath'] == jsonText(dirPath)) and (entry['kind'] == kind):
+                return entry
+        return None
+
+    def add(self, dirPath, kind, labels, values, candidates=None):
+        """ Queue a choice (replacing any previous one for the same directory and kind).
+            @param candidates: Dicts of strings and numbers the choices were built from
+        """
+        self.entries = [e for e in self.entries if (e['dirPath'], e['kind']) != (jsonText(dirPath), kind)]
+        self.entries.append({
+            'dirPath': jsonText(dirPath),
+            'kind': kind,
+            'choices': [[jsonText(label), jsonText(value)] for label, value in zip(labels, values)],
+            'candidates': [dict((k, jsonText(v)) for k, v in c.iteritems()) for c in candidates] if (candidates) else None,
+            'resolved': False,
+            'selection': None,
+        })
+        self.save()
+
+    def getCandidates(self, dirPath, kind):
+        """ Return the candidates stored with an answered choice, or None. """
+        entry = self.get(dirPath, kind)
+        if (not entry) or (not entry['resolved']) or (not entry.get('candidates')):
+            return None
+        return [dict((_value(k), _value(v)) for k, v in c.iteritems()) for c in entry['candidates']]
+
+    def getDirPaths(self):
+        """ Return the queued directory paths in the order they were queued. """
+        dirPaths = []
+        for entry in self.entries:
+            dirPath = entry['dirPath'].encode('utf-8')
+            if (dirPath not in dirPaths):
+                dirPaths.append(dirPath)
+        return dirPaths
+
+    def isResolved(self, dirPath):
+        """ Return True if every choice queued for the directory has been answered. """
+        return all(e['resolved'] for e in self.entries if (e['dirPath'] == jsonText(dirPath)))
+
+    def remove(self, dirPath):
+        """ Remove every choice queued for the directory. """
+        self.entries = [e for e in self.entries if (e['dirPath'] != jsonText(dirPath))]
+        self.save()
+
+    def resolve(self):
+        """ Ask the user every unanswered choice, saving after each answer. """
+        pending = [e for e in self.entries if (not e['resolved'])]
+        for i in range(len(pending)):
+            entry = pending[i]
+            log.title("Decision %s of %s: %s" % (i+1, len(pending), util.encode(entry['dirPath'])))
+            log.info("  Select the %s match" % entry['kind'])
+            selection = util.promptUser(entry['choices'], lambda c: c[0], maxToShow=len(entry['choices']))
+            entry['selection'] = selection[1] if (selection) else None
+            entry['resolved'] = True
+            self.save()
+
+    def save(self):
+        """ Write the queue to disk (atomically). """
+        dirPath = os.path.dirname(self.path)
+        if (dirPath) and (not os.path.exists(dirPath)):
+            os.makedirs(dirPath)
+        tmpPath = "%s.tmp" % self.path
+        handle = open(tmpPath, 'w')
+        json.dump(self.entries, handle, indent=2)
+        handle.close()
+        os.rename(tmpPath, self.path)
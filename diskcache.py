@@ -0,0 +1,110 @@
+"""
+Persistent Key/Value Cache.
+SQLite backed cache with an optional time to live and least recently used
+eviction bounded by entry count and total size. Values are pickled. Safe to
+share between threads.
+"""
+import os
+import time
+import sqlite3
+import cPickle
+import threading
+from util import log
+
+
+class DiskCache:
+    """ SQLite backed cache with TTL and LRU eviction. """
+
+    def __init__(self, dbPath, ttl=None, maxEntries=None, maxBytes=None):
+        """ @param dbPath:      Path to the SQLite file (':memory:' for a per-run cache)
+            @param ttl:         Seconds until entries expire (None to never expire)
+            @param maxEntries:  Max number of entries to keep (None for no limit)
+            @param maxBytes:    Max total size of the pickled values (None for no limit)
+        """
+        self.dbPath     = os.path.expanduser(dbPath)
+        self.ttl        = ttl
+        self.maxEntries = maxEntries
+        self.maxBytes   = maxBytes
+        self.hits       = 0                 # Number of successful gets
+        self.misses     = 0                 # Number of gets that found nothing (or expired)
+        self.evictions  = 0                 # Number of entries evicted to stay in bounds
+        self._lock      = threading.Lock()
+        dbDir = os.path.dirname(self.dbPath)
+        if (dbDir) and (not os.path.exists(dbDir)):
+            os.makedirs(dbDir)
+        self.conn = sqlite3.connect(self.dbPath, check_same_thread=False)
+        self.conn.text_factory = str
+        self.conn.execute("PRAGMA journal_mode=WAL")       # Readers don't block the writer
+        self.conn.execute("PRAGMA synchronous=NORMAL")     # A cache doesn't need an fsync per write
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY, value BLOB, size INTEGER, created REAL, accessed REAL)""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self.conn.commit()
+        self._entries, self._bytes = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+
+    def __str__(self):
+        return "<DiskCache: %s (%s entries, %s hits, %s misses)>" % (self.dbPath, self._entries, self.hits, self.misses)
+
+    def get(self, key, default=None):
+        """ Return the cached value for key, or default if missing or expired. """
+        with self._lock:
+            row = self.conn.execute("SELECT value, created FROM cache WHERE key=?", (key,)).fetchone()
+            if (row) and (self.ttl is not None) and (row[1] + self.ttl < time.time()):
+                self._delete(key)
+                row = None
+            if (not row):
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.conn.execute("UPDATE cache SET accessed=? WHERE key=?", (time.time(), key))
+            self.conn.commit()
+        return cPickle.loads(str(row[0]))
+
+    def set(self, key, value):
+        """ Store value for key, evicting the least recently used entries if needed. """
+        blob = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self._lock:
+            self._delete(key)
+            self.conn.execute("INSERT INTO cache VALUES (?, ?, ?, ?, ?)", (key, sqlite3.Binary(blob), len(blob), now, now))
+            self._entries += 1
+            self._bytes += len(blob)
+            self._evict()
+            self.conn.commit()
+
+    def delete(self, key):
+        """ Remove key from the cache. """
+        with self._lock:
+            self._delete(key)
+            self.conn.commit()
+
+    def clear(self):
+        """ Remove every entry from the cache. """
+        with self._lock:
+            self.conn.execute("DELETE FROM cache")
+            self.conn.commit()
+            self._entries, self._bytes = 0, 0
+
+    def close(self):
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
+
+    def _delete(self, key):
+        """ Remove key (lock must be held). """
+        row = self.conn.execute("SELECT size FROM cache WHERE key=?", (key,)).fetchone()
+        if (row):
+            self.conn.execute("DELETE FROM cache WHERE key=?", (key,))
+            self._entries -= 1
+            self._bytes -= row[0]
+
+    def _evict(self):
+        """ Drop least recently used entries until within bounds (lock must be held). """
+        while ((self.maxEntries is not None) and (self._entries > self.maxEntries)) or \
+              ((self.maxBytes is not None) and (self._bytes > self.maxBytes) and (self._entries > 1)):
+            key, size = self.conn.execute("SELECT key, size FROM cache ORDER BY accessed LIMIT 1").fetchone()
+            log.finer("  Cache evicting: %s", key)
+            self.conn.execute("DELETE FROM cache WHERE key=?", (key,))
+            self._entries -= 1
+            self._bytes -= size
+            self.evictions += 1
@@ -0,0 +1,150 @@
+"""
+Trailer Download Scheduler.
+Downloads trailers in a pool of background threads so a slow download doesn't
+hold up the library scan. Limits concurrent downloads per host, caps the total
+bandwidth and retries failed downloads with exponential backoff.
+"""
+import time
+import urlparse
+import threading
+from util import log
+from movie import downloadTrailerUrl
+
+DOWNLOAD_WORKERS  = 3          # Default concurrent downloads
+DOWNLOAD_PER_HOST = 1          # Default concurrent downloads per trailer site
+DOWNLOAD_RETRIES  = 3          # Default attempts per trailer
+RETRY_BACKOFF     = 30         # Seconds before the first retry (doubles each time)
+
+
+class RateLimiter:
+    """ Token bucket shared by all download threads. """
+    
+    def __init__(self, bytesPerSec):
+        self.bytesPerSec = bytesPerSec
+        self._next = time.time()          # When the bytes consumed so far are paid off
+        self._lock = threading.Lock()
+        
+    def consume(self, numBytes):
+        """ Sleep long enough to keep the total rate under bytesPerSec. """
+        with self._lock:
+            now = time.time()
+            self._next = max(self._next, now) + numBytes / float(self.bytesPerSec)
+            delay = self._next - now
+        if (delay > 0):
+            time.sleep(delay)
+
+
+class DownloadJob:
+    """ A single trailer to download. """
+    
+    def __init__(self, trailerUrl, trailerPath):
+        self.trailerUrl  = trailerUrl
+        self.trailerPath = trailerPath
+        self.host        = urlparse.urlsplit(trailerUrl).netloc.lower().replace('www.', '')
+        self.attempts    = 0              # Attempts made so far
+        self.notBefore   = 0              # Don't retry before this time
+        
+        
+class DownloadScheduler:
+    """ Bounded pool of trailer download threads. """
+    
+    def __init__(self, workers=DOWNLOAD_WORKERS, perHost=DOWNLOAD_PER_HOST, maxRate=None, retries=DOWNLOAD_RETRIES):
+        """ @param maxRate: Total bytes per second for all downloads (None for no limit) """
+        self.workers   = workers
+        self.perHost   = perHost
+        self.retries   = retries
+        self.limiter   = RateLimiter(maxRate) if (maxRate) else None
+        self.completed = 0                # Successful downloads
+        self.failed    = 0                # Downloads that ran out of retries
+        self._jobs     = []               # Jobs waiting for a worker
+        self._paths    = set()            # Trailer paths queued or running
+        self._active   = {}               # host -> running downloads
+        self._running  = 0
+        self._stopped  = False            # Set by join() once everything is done
+        self._cond     = threading.Condition()
+        self._threads  = []
+        
+    def start(self):
+        """ Start the download threads. """
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name="download-%s" % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+            
+    def add(self, movie):
+        """ Queue the trailer of the movie if it needs downloading. """
+        trailerPath = movie.getTrailerPath()
+        if (not trailerPath):
+            return None
+        with self._cond:
+            if (trailerPath in self._paths):
+                return None
+            log.info("  Queued trailer download: %s" % trailerPath)
+            self._paths.add(trailerPath)
+            self._jobs.append(DownloadJob(movie.trailerUrl, trailerPath))
+            self._cond.notify_all()
+            
+    def join(self):
+        """ Wait until every queued download finished or failed. """
+        with self._cond:
+            if (self._jobs) or (self._running):
+                log.info("Waiting for %s trailer downloads" % (len(self._jobs) + self._running))
+            while (self._jobs) or (self._running):
+                self._cond.wait(1)
+            self._stopped = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        log.info("Trailer downloads: %s completed, %s failed" % (self.completed, self.failed))
+        
+    def _nextJob(self):
+        """ Return the first job that is due and whose host has a free slot (lock held). """
+        now = time.time()
+        for job in self._jobs:
+            if (job.notBefore <= now) and (self._active.get(job.host, 0) < self.perHost):
+                self._jobs.remove(job)
+                self._active[job.host] = self._active.get(job.host, 0) + 1
+                self._running += 1
+                return job
+        return None
+        
+    def _work(self):
+        """ Download thread main loop. """
+        while (True):
+            with self._cond:
+                job = self._nextJob()
+                while (not job):
+                    if (self._stopped): return None
+                    self._cond.wait(1)
+                    job = self._nextJob()
+            success = self._download(job)
+            with self._cond:
+                self._active[job.host] -= 1
+                self._running -= 1
+                if (success):
+                    self.completed += 1
+                    self._paths.discard(job.trailerPath)
+                elif (job.attempts < self.retries):
+                    job.notBefore = time.time() + RETRY_BACKOFF * 2 ** (job.attempts - 1)
+                    self._jobs.append(job)
+                else:
+                    self.failed += 1
+                    self._paths.discard(job.trailerPath)
+                self._cond.notify_all()
+                
+    def _download(self, job):
+        """ Download a single job, return True on success. """
+        job.attempts += 1
+        progress = (lambda done, total, chunk: self.limiter.consume(chunk)) if (self.limiter) else None
+        try:
+            log.info("Downloading trailer (attempt %s): %s" % (job.attempts, job.trailerPath))
+            downloadTrailerUrl(job.trailerUrl, job.trailerPath, progress)
+            return True
+        except ValueError, e:
+            job.attempts = self.retries   # Permanent (ex: unknown provider), don't retry
+            log.warn("Trailer download failed: %s; %s" % (job.trailerPath, e))
+            return False
+        except Exception, e:
+            log.warn("Trailer download failed (attempt %s of %s): %s; %s" % (job.attempts, self.retries, job.trailerPath, e))
+            return False
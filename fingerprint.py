@@ -0,0 +1,92 @@
+"""
+Video File Fingerprints.
+Identifies copies of the same video file under different names and release
+directories. A fingerprint is the file size plus an md5 of its first and last
+FINGERPRINT_BYTES, read through mmap so only those pages are touched however
+large the file is. Fingerprints are cached in a DiskCache keyed by path, mtime
+and size, so repeat runs only hash new or changed files.
+"""
+import os
+import mmap
+import hashlib
+import sqlite3
+import threading
+from util import log
+from diskcache import DiskCache
+from profiler import profiler
+
+FINGERPRINT_CACHE_PATH = '~/.videocleaner/fingerprints.db'    # Default cache location
+FINGERPRINT_CACHE_SIZE = 200000                               # Max fingerprints before LRU eviction
+FINGERPRINT_BYTES      = 65536                                # Bytes hashed at each end of the file
+
+
+def getFingerprint(path, size):
+    """ Return the fingerprint of the file at path: "<size>:<md5 of first and last bytes>". """
+    digest = hashlib.md5()
+    if (size):
+        handle = open(path, 'rb')
+        try:
+            fileMap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                digest.update(fileMap[0:FINGERPRINT_BYTES])
+                digest.update(fileMap[max(FINGERPRINT_BYTES, size - FINGERPRINT_BYTES):size])
+            finally:
+                fileMap.close()
+        finally:
+            handle.close()
+    return "%s:%s" % (size, digest.hexdigest())
+
+
+class Fingerprinter:
+    """ Returns file fingerprints, caching them by path, mtime and size. """
+
+    def __init__(self, cachePath=FINGERPRINT_CACHE_PATH, maxEntries=FINGERPRINT_CACHE_SIZE):
+        self.cachePath  = cachePath          # SQLite file (None disables the cache)
+        self.maxEntries = maxEntries         # Max fingerprints before LRU eviction
+        self._cache     = None               # DiskCache (opened on first use)
+        self._cachePid  = None               # Process the DiskCache was opened in
+        self._lock      = threading.Lock()
+
+    def configure(self, cachePath=FINGERPRINT_CACHE_PATH):
+        """ Change the cache file (before first use). None disables the cache. """
+        self.cachePath = cachePath or None
+
+    def _getCache(self):
+        """ Return the DiskCache, opening it on first use in this process. """
+        with self._lock:
+            if (self.cachePath) and (self._cachePid != os.getpid()):
+                self._cache, self._cachePid = DiskCache(self.cachePath, None, self.maxEntries), os.getpid()
+            return self._cache
+
+    def get(self, path, st=None):
+        """ Return the fingerprint for the file at path, or None if it can't be read.
+            @param st: os.stat result for path if already known
+        """
+        try:
+            st = st or os.stat(path)
+        except OSError, e:
+            log.fine("  Unable to fingerprint %s: %s", path, e)
+            return None
+        key = "%s:%s:%s" % (path, st.st_mtime, st.st_size)
+        try:
+            cache = self._getCache()
+            fingerprint = cache.get(key) if (cache) else None
+        except (sqlite3.Error, EnvironmentError), e:
+            log.finer("  Fingerprint cache unavailable: %s", e)
+            cache, fingerprint = None, None
+        if (fingerprint):
+            profiler.count('fingerprint.cache.hits')
+            return fingerprint
+        try:
+            with profiler.stage('fingerprint'):
+                fingerprint = getFingerprint(path, st.st_size)
+        except (IOError, OSError, ValueError), e:
+            log.fine("  Unable to fingerprint %s: %s", path, e)
+            return None
+        if (cache):
+            try: cache.set(key, fingerprint)
+            except sqlite3.Error, e: log.finer("  Fingerprint cache write failed: %s", e)
+        return fingerprint
+
+# Shared fingerprinter used by Video
+fingerprinter = Fingerprinter()
@@ -0,0 +1,93 @@
+"""
+IMDB Response Cache.
+Drop-in wrapper around an IMDbPY access object that keeps search results and
+movie lookups in a DiskCache, so repeated runs and duplicate titles across
+directories don't go back to the network.
+"""
+import threading
+from util import log
+from diskcache import DiskCache
+from profiler import profiler
+
+CACHE_PATH    = '~/.videocleaner/imdb.db'    # Default cache location
+CACHE_TTL     = 7 * 24 * 60 * 60             # Default time to live (seconds)
+CACHE_ENTRIES = 20000                        # Default max entries before LRU eviction
+
+
+class ImdbCache:
+    """ Caching wrapper around IMDbPY's search_movie, get_movie and update. """
+
+    def __init__(self, imdbAccess, cachePath=CACHE_PATH, ttl=CACHE_TTL, maxEntries=CACHE_ENTRIES):
+        self.imdbAccess = imdbAccess         # Real IMDbPY access object
+        self.cachePath  = cachePath          # SQLite file (None disables the cache)
+        self.ttl        = ttl                # Seconds until entries expire
+        self.maxEntries = maxEntries         # Max entries before LRU eviction
+        self._cache     = None               # DiskCache (opened on first use)
+        self._lock      = threading.Lock()
+
+    def __getattr__(self, name):
+        """ Anything we don't cache goes straight to IMDbPY. """
+        return getattr(self.imdbAccess, name)
+
+    def configure(self, cachePath=CACHE_PATH, ttl=CACHE_TTL, maxEntries=CACHE_ENTRIES):
+        """ Change the cache settings (before first use). A ttl of 0 disables the cache. """
+        self.cachePath = cachePath if (ttl != 0) else None
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+
+    def stats(self):
+        """ Return (hits, misses) for this run. """
+        if (not self._cache): return (0, 0)
+        return (self._cache.hits, self._cache.misses)
+
+    def _getCache(self):
+        """ Return the DiskCache, opening it on first use. """
+        with self._lock:
+            if (not self._cache) and (self.cachePath):
+                self._cache = DiskCache(self.cachePath, self.ttl, self.maxEntries)
+        return self._cache
+
+    def _cached(self, key, fetch):
+        """ Return the cached value for key, calling fetch() and caching the result on a miss. """
+        stage = "imdb.%s" % key.split(':')[0]
+        cache = self._getCache()
+        if (not cache):
+            with profiler.stage(stage):
+                return fetch()
+        value = cache.get(key)
+        if (value is not None):
+            log.finer("  IMDB cache hit: %s", key)
+            profiler.count('imdb.cache.hits')
+            return value
+        profiler.count('imdb.cache.misses')
+        with profiler.stage(stage):
+            value = fetch()
+        if (value is not None):
+            cache.set(key, value)
+        return value
+
+    ####################################
+    #  Cached IMDbPY Functions
+    ####################################
+
+    def search_movie(self, title, results=None):
+        """ Cached IMDbPY search_movie(). """
+        key = "search:%s:%s" % (title.lower().strip(), results)
+        if (results is None):
+            return self._cached(key, lambda: self.imdbAccess.search_movie(title))
+        return self._cached(key, lambda: self.imdbAccess.search_movie(title, results))
+
+    def get_movie(self, movieID):
+        """ Cached IMDbPY get_movie(). """
+        key = "movie:%s" % movieID
+        return self._cached(key, lambda: self.imdbAccess.get_movie(movieID))
+
+    def update(self, movie):
+        """ Cached IMDbPY update(); fills movie in place like the original. """
+        def fetch():
+            self.imdbAccess.update(movie)
+            return (movie.data, movie.current_info)
+        data, currentInfo = self._cached("update:%s" % movie.movieID, fetch)
+        if (data is not movie.data):
+            movie.set_data(data, override=1)
+            movie.current_info = list(currentInfo)
@@ -0,0 +1,144 @@
+"""
+Offline IMDB Dataset.
+Compact SQLite index of IMDB's public TSV dumps (title.basics and title.akas
+from https://datasets.imdbws.com/) so most directories can be matched to a
+movieID without a search_movie round trip. Titles are indexed normalized the
+same way Video._weakMatch() compares them, along with their year. Anything not
+found (or matching more than one movie) falls back to the network.
+
+Index Tables:
+  names (name, year, id)     Normalized primary, original and English titles of
+                             the movies, tv movies and videos in title.basics
+  akas  (id, title)          Best English AKA title for each of them
+"""
+import os
+import gzip
+import time
+import sqlite3
+import threading
+from util import log
+from video import normalizeTitle
+from profiler import profiler
+
+DATA_PATH      = '~/.videocleaner/imdbdata.db'     # Default index location
+BASICS_NAME    = 'title.basics.tsv.gz'             # Dump with titles and years
+AKAS_NAME      = 'title.akas.tsv.gz'               # Dump with alternate titles
+TITLE_TYPES    = ['movie', 'tvMovie', 'video']     # Title types worth indexing
+AKA_REGIONS    = ['US', 'GB']                      # Preferred English AKA regions (in order)
+MMAP_SIZE      = 256 * 1048576                     # Bytes of the index to memory map
+INSERT_BATCH   = 50000                             # Rows per executemany() while ingesting
+NULL           = '\\N'                             # Null value in the dumps
+
+
+def _readTsv(path):
+    """ Yield each row of the (optionally gzipped) TSV file as a list, skipping the header. """
+    handle = gzip.open(path, 'rb') if (path.endswith('.gz')) else open(path, 'rb')
+    try:
+        handle.readline()
+        for line in handle:
+            yield line.rstrip('\n').split('\t')
+    finally:
+        handle.close()
+
+
+def _getId(tconst):
+    """ Return the numeric id of an IMDB tconst (tt0111161 -> 111161). """
+    return int(tconst[2:])
+
+
+def ingest(dumpDir, dbPath=DATA_PATH):
+    """ Build the index at dbPath from the dumps in dumpDir. The index is
+        written to a temporary file and only replaces dbPath when complete.
+    """
+    dbPath = os.path.expanduser(dbPath)
+    tmpPath = "%s.tmp" % dbPath
+    if (os.path.dirname(dbPath)) and (not os.path.exists(os.path.dirname(dbPath))):
+        os.makedirs(os.path.dirname(dbPath))
+    if (os.path.exists(tmpPath)): os.remove(tmpPath)
+    startTime = time.time()
+    conn = sqlite3.connect(tmpPath)
+    conn.text_factory = str
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("CREATE TABLE names (name TEXT, year INTEGER, id INTEGER)")
+    conn.execute("CREATE TABLE akas (id INTEGER PRIMARY KEY, title TEXT)")
+    # Names from title.basics
+    log.info("Reading %s" % BASICS_NAME)
+    years = {}                            # id -> year
+    rows = []
+    for row in _readTsv("%s/%s" % (dumpDir, BASICS_NAME)):
+        if (row[1] not in TITLE_TYPES) or (row[5] == NULL): continue
+        movieId, year = _getId(row[0]), int(row[5])
+        years[movieId] = year
+        for name in set([normalizeTitle(row[2]), normalizeTitle(row[3])]):
+            rows.append((name, year, movieId))
+        if (len(rows) >= INSERT_BATCH):
+            conn.executemany("INSERT INTO names VALUES (?, ?, ?)", rows)
+            rows = []
+    conn.executemany("INSERT INTO names VALUES (?, ?, ?)", rows)
+    # English AKAs from title.akas (ranked by AKA_REGIONS, then any English title)
+    log.info("Reading %s" % AKAS_NAME)
+    akas = {}                             # id -> (rank, title)
+    for row in _readTsv("%s/%s" % (dumpDir, AKAS_NAME)):
+        movieId = _getId(row[0])
+        if (movieId not in years) or ('working' in row[5]): continue
+        if (row[3] in AKA_REGIONS): rank = AKA_REGIONS.index(row[3])
+        elif (row[4] == 'en'): rank = len(AKA_REGIONS)
+        else: continue
+        if (movieId not in akas) or (rank < akas[movieId][0]):
+            akas[movieId] = (rank, row[2])
+    conn.executemany("INSERT INTO akas VALUES (?, ?)", ((i, a[1]) for i, a in akas.iteritems()))
+    conn.executemany("INSERT INTO names VALUES (?, ?, ?)", ((normalizeTitle(a[1]), years[i], i) for i, a in akas.iteritems()))
+    conn.execute("CREATE INDEX names_name ON names (name, year)")
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    os.rename(tmpPath, dbPath)
+    log.info("Indexed %s titles and %s AKAs in %.1fs: %s" % (len(years), len(akas), time.time() - startTime, dbPath))
+
+
+class ImdbData:
+    """ Read only access to the index built by ingest(). """
+
+    def __init__(self, dbPath=None):
+        self.dbPath = dbPath                # Index file (None or missing disables lookups)
+        self.hits   = 0                     # Searches answered locally
+        self.misses = 0                     # Searches left to the network
+        self._conn  = None                  # Connection (opened on first use)
+        self._lock  = threading.Lock()
+
+    def configure(self, dbPath=DATA_PATH):
+        """ Change the index file (before first use). """
+        self.dbPath = dbPath
+
+    def _getConn(self):
+        """ Return the connection, opening it on first use (lock must be held). """
+        if (not self._conn) and (self.dbPath) and (os.path.exists(os.path.expanduser(self.dbPath))):
+            self._conn = sqlite3.connect(os.path.expanduser(self.dbPath), check_same_thread=False)
+            self._conn.text_factory = str
+            self._conn.execute("PRAGMA mmap_size=%s" % MMAP_SIZE)
+            log.fine("Using IMDB dataset: %s", self.dbPath)
+        return self._conn
+
+    def match(self, title, year):
+        """ Return the movieID of the only movie with this title and year, or None. """
+        with self._lock:
+            conn = self._getConn()
+            if (not conn): return None
+            rows = conn.execute("SELECT DISTINCT id FROM names WHERE name=? AND year=? LIMIT 2",
+                (normalizeTitle(title), year)).fetchall()
+            if (len(rows) != 1):
+                self.misses += 1
+                profiler.count('imdbdata.misses')
+                return None
+            self.hits += 1
+            profiler.count('imdbdata.hits')
+            return "%07d" % rows[0][0]
+
+    def getAka(self, movieID):
+        """ Return the English AKA title for the movieID, or None. """
+        with self._lock:
+            conn = self._getConn()
+            if (not conn): return None
+            row = conn.execute("SELECT title FROM akas WHERE id=?", (int(movieID),)).fetchone()
+            return row[0] if (row) else None
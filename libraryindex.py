@@ -0,0 +1,135 @@
+"""
+Persistent Library Index.
+Stores what Video and Movie compute for each directory in SQLite, keyed by the
+directory path and the mtimes of the files the record was built from. Unchanged
+directories are answered from the index with a few stat calls instead of
+listing and parsing their contents.
+
+A directory's signature covers the directory itself, its subtitle directories,
+its NFO files and its video files. Adding, removing or renaming files changes
+the directory mtime, rewriting an NFO in place changes the NFO mtime and a
+video still being copied changes its size.
+"""
+import os
+import time
+import sqlite3
+import cPickle
+import util
+from util import log
+from movie import Movie
+from video import SUBTITLE_DIRS
+from video import VIDEO_EXTENSIONS
+
+INDEX_PATH    = '~/.videocleaner/library.db'     # Default index location
+INDEX_VERSION = 4                                # Bump to invalidate indexes built by older versions
+
+
+def getWatchedNames(snapshot):
+    """ Return the entry names whose stat info makes up the directory signature. """
+    names = ['']
+    for fileName in sorted(snapshot.names):
+        fileNameLCase = fileName.lower()
+        if (fileNameLCase.endswith('.nfo')) or (fileNameLCase.endswith(tuple(VIDEO_EXTENSIONS))):
+            names.append(fileName)
+    names += filter(None, SUBTITLE_DIRS)
+    return names
+
+
+def getSignature(dirPath, names):
+    """ Return the (name, mtime, size) signature for the names in dirPath. """
+    signature = []
+    for name in names:
+        try:
+            st = os.stat("%s/%s" % (dirPath, name) if (name) else dirPath)
+            signature.append((name, st.st_mtime, st.st_size))
+        except OSError:
+            signature.append((name, None, None))
+    return signature
+
+
+def buildRecord(dirPath):
+    """ Scan dirPath and return its index record (runs in the worker pool). """
+    snapshot = util.DirSnapshot(dirPath)
+    names = getWatchedNames(snapshot)
+    signature = getSignature(dirPath, names)   # Taken before scanning so changes during the scan are caught
+    movie = Movie(dirPath, snapshot)
+    if (movie.curNfoName):
+        movie.readNfoInfo()
+    record = movie.getIndexRecord()
+    record['names'] = names
+    record['signature'] = signature
+    return record
+
+
+class LibraryIndex:
+    """ SQLite backed index of movie directories. """
+
+    def __init__(self, dbPath, rebuild=False):
+        self.dbPath = os.path.expanduser(dbPath)
+        dbDir = os.path.dirname(self.dbPath)
+        if (dbDir) and (not os.path.exists(dbDir)):
+            os.makedirs(dbDir)
+        self.conn = sqlite3.connect(self.dbPath)
+        self.conn.text_factory = str
+        self._createTables(rebuild)
+
+    def _createTables(self, rebuild):
+        """ Create the index tables, dropping old ones if rebuilding or outdated. """
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = self.conn.execute("SELECT value FROM meta WHERE key='version'").fetchone()
+        if (rebuild) or (not row) or (int(row[0]) != INDEX_VERSION):
+            log.fine("  Rebuilding library index: %s", self.dbPath)
+            self.conn.execute("DROP TABLE IF EXISTS videos")
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(INDEX_VERSION),))
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS videos (
+            dirPath TEXT PRIMARY KEY, mtime REAL, record BLOB, updated REAL)""")
+        self.conn.commit()
+
+    def lookup(self, dirPaths, pool=None):
+        """ Return {dirPath: record} for every dirPath with a fresh index entry.
+            @param pool: Optional worker pool used to check signatures concurrently
+        """
+        stored = {}
+        for dirPath, record in self.conn.execute("SELECT dirPath, record FROM videos"):
+            stored[dirPath] = cPickle.loads(str(record))
+        candidates = [dirPath for dirPath in dirPaths if (dirPath in stored)]
+        checkArgs = [(dirPath, stored[dirPath]['names']) for dirPath in candidates]
+        mapper = pool.map if (pool) else map
+        signatures = mapper(_getSignature, checkArgs)
+        fresh = {}
+        for dirPath, signature in zip(candidates, signatures):
+            if (signature == stored[dirPath]['signature']):
+                fresh[dirPath] = stored[dirPath]
+        log.fine("  Library index: %s of %s directories fresh", len(fresh), len(dirPaths))
+        return fresh
+
+    def store(self, dirPath, record):
+        """ Store the record for dirPath. """
+        mtime = record['signature'][0][1]
+        blob = sqlite3.Binary(cPickle.dumps(record, cPickle.HIGHEST_PROTOCOL))
+        self.conn.execute("INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?)", (dirPath, mtime, blob, time.time()))
+
+    def discard(self, dirPath):
+        """ Remove dirPath from the index (after it was modified). """
+        self.conn.execute("DELETE FROM videos WHERE dirPath=?", (dirPath,))
+
+    def prune(self, dirPaths):
+        """ Remove every entry that is not in dirPaths. """
+        keep = set(dirPaths)
+        for (dirPath,) in self.conn.execute("SELECT dirPath FROM videos").fetchall():
+            if (dirPath not in keep):
+                self.discard(dirPath)
+
+    def commit(self):
+        """ Write pending changes to disk. """
+        self.conn.commit()
+
+    def close(self):
+        """ Commit and close the index. """
+        self.conn.commit()
+        self.conn.close()
+
+
+def _getSignature(args):
+    """ Pool helper for getSignature(). """
+    return getSignature(*args)
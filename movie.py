@@ -14,34 +14,61 @@ import os
 import re
 import time
 import util
-import imdb
+import difflib
+import providers
+import threading
 import htmlentitydefs
 from elementtree import ElementTree
-from parsers import traileraddict
-from parsers import youtube
+from providers import traileraddict
+from providers import youtube
 from util import log
 from video import Video
-imdbpy = imdb.IMDb()
+from video import normalizeTitle
+from imdbcache import ImdbCache
+from imdbdata import ImdbData
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+imdbpy = ImdbCache(providers.imdb)    # IMDbPY is only loaded on first lookup
+imdbdata = ImdbData()               # Offline IMDB dataset (see moviecleaner --imdbdata)
+updatedMovies = {}                  # movieID -> fully updated IMDB movie (for this run)
+updatedLock = threading.Lock()
 
 # Other Defined Constants
 TRAILER_STRING   = '-trailer.'                             # String to catch samples
 IMDB_REGEX       = r'http://www.imdb.com/title/tt(\d+?)/'  # IMDB Regex to get MovieID
 IMDB_MAX_RESULTS = 10                                      # Max Results to show from IMDB
+IMDB_MAX_THREADS = 5                                       # Max concurrent IMDB lookups per prompt
 NFO_BASE_ATTR    = 'movie'                                 # Base Attr for Movie NFOs
 NFO_REQ_ATTRS    = ['title', 'year', 'country']            # Required Attrs for valid NFO
 
+# Trailer Search (see rankTrailers)
+TRAILER_PROVIDERS   = ['traileraddict', 'youtube']               # Searched concurrently, preferred first
+TRAILER_TIMEOUT     = 20                                         # Seconds to wait for all providers
+TRAILER_AUTO_SCORE  = 0.9                                        # Select without asking at this score
+TRAILER_MAX_RESULTS = 15                                         # Max candidates to show when prompting
+TRAILER_QUEUE_FIELDS = ['url', 'title', 'year', 'length', 'provider', 'score']  # Candidate fields kept in the decision queue
+TRAILER_NO_YEAR     = 0.85                                       # Score factor when the year is unknown
+TRAILER_NEAR_YEAR   = 0.8                                        # Score factor when a year off (below TRAILER_AUTO_SCORE)
+TRAILER_WRONG_YEAR  = 0.5                                        # Score factor for other years
+TRAILER_YEAR_REGEX  = r'\b(19|20)\d\d\b'                         # Year in a result title
+TRAILER_NOISE_REGEX = r'\b(official|theatrical|teaser|trailer|hd|hq|(19|20)\d\d)\b|[^\w\s]'  # Not part of the title
+
 
 class Movie(Video):
     """ Represents a movie on Disk. """
+    INDEX_ATTRS = Video.INDEX_ATTRS + ['curTrailerName', 'imdbUrl', 'imdbUpdate', 'trailerUrl']
     
-    def __init__(self, dirPath):
-        Video.__init__(self, dirPath)                   # Call parent contructor
+    def __init__(self, dirPath, snapshot=None):
+        Video.__init__(self, dirPath, snapshot)         # Call parent contructor
         self.curTrailerName = self._getTrailerFile()    # Current Trailer FileName
         self.imdbUrl        = None                      # URL to IMDB Info
         self.imdbInfo       = None                      # IMDB information
         self.imdbUpdate     = None                      # Date we last searched IMDB
         self.trailerUrl     = None                      # New TrailerAddict URL
         self._newInfoFound  = False                     # Set True when New Info is Found
+        self._prefetched    = {}                        # Network results fetched ahead of time
+        self.decisions      = None                      # DecisionQueue for batch and resolve runs
+        self.deferred       = False                     # Set True when a choice was queued for later
         
     def __str__(self):
         title = self.title or self.curTitle
@@ -50,18 +77,18 @@ class Movie(Video):
         
     def logClassVars(self):
         """ Log class variables to stdout. """
-        attrs = ['dirPath', 'curDirName', 'curFileNames', 'curNfoName', 'videoTags',
+        attrs = ['dirPath', 'curDirName', 'curFileNames', 'curNfoName', 'videoInfo', 'videoTags',
             'subtitles', 'title', 'year', 'country', 'aka', 'trailerUrl', 'newDirName',
             'newFileNames', 'newFilePrefix']
         for attr in attrs:
-            log.verbose("  self.%s = %s" % (attr, getattr(self, attr)))
+            log.verbose("  self.%s = %s", attr, getattr(self, attr))
         
     def logImdbVars(self):
         """ Log IMDB variables to stdout. """
         if (not self.imdbInfo):
             log.info("  No IMDB information.")
         for key in sorted(self.imdbInfo.keys()):
-            log.verbose("  imdb['%s'] = %s" % (key, self.imdbInfo[key]))
+            log.verbose("  imdb['%s'] = %s", key, self.imdbInfo[key])
         
     ####################################
     #  Extract info from local files
@@ -70,9 +97,9 @@ class Movie(Video):
     def _getTrailerFile(self):
         """ Return the trailer file in the movie directory. """
         trailerFile = None
-        for fileName in os.listdir(self.dirPath):
+        for fileName in self.snapshot.names:
             fileNameLCase = fileName.lower()
-            if (TRAILER_STRING in fileNameLCase):
+            if (TRAILER_STRING in fileNameLCase) and (not fileNameLCase.endswith(util.PARTIAL_SUFFIX)):
                 trailerFile = fileName
                 break
         return trailerFile
@@ -84,16 +111,7 @@ class Movie(Video):
     def fetchVideoInfo(self, forceUpdate=False, foreign=False):
         """ Populate the *new* variables with information. """
         # Try populating values from the NFO first
-        self.nfoInfo = self._getNfoInfo()
-        self.imdbUrl = self._getImdbUrlFromNfo()
-        if (self.nfoInfo):
-            self.title = util.encode(self.nfoInfo.findtext("//movie/title"))
-            self.year = self.nfoInfo.findtext("//movie/year")
-            self.country = util.encode(self.nfoInfo.findtext("//movie/country"))
-            self.aka = util.encode(self.nfoInfo.findtext("//movie/aka"))
-            self.imdbUpdate = util.encode(self.nfoInfo.findtext("//movie/imdbupdate"))
-            self.trailerUrl = self.nfoInfo.findtext("//movie/trailerurl")
-            if (self.year): self.year = int(self.year)
+        self.readNfoInfo()
         # If not all required values, get them from IMDB
         if (not self.nfoInfo) or (forceUpdate):
             self.imdbUrl = self.imdbUrl or self._getImdbUrlFromSearch(foreign)
@@ -109,6 +127,46 @@ class Movie(Video):
         self.updateNewDirName(self.aka if foreign else None)
         self.updateNewFilePrefix(self.aka if foreign else None)
         self.updateNewFileNames()
+        
+    def prefetchVideoInfo(self, forceUpdate=False, foreign=False, lookupTrailer=False):
+        """ Run the network lookups fetchVideoInfo() and lookupTrailerUrl() are
+            going to need, without prompting, so the results are ready by the
+            time this movie is processed. Safe to call from a background thread.
+        """
+        self.readNfoInfo()
+        title = self.title
+        if (not self.nfoInfo) or (forceUpdate):
+            imdbUrl = self.imdbUrl or self._getImdbUrlFromData()
+            if (not imdbUrl):
+                results = self._fetch(imdbpy.search_movie, self.curTitle, IMDB_MAX_RESULTS)
+                selection = self._findImdbMatch(results, self.curTitle, self.curYear or "NA")
+                if (selection): imdbUrl = self.getUrl(selection.movieID)
+                elif (foreign): self._getUpdatedMovies(results)
+            imdbInfo = self._getImdbInfoFromUrl(imdbUrl, logIt=False)
+            if (imdbInfo): title = title or util.encode(imdbInfo['title'])
+        if (lookupTrailer) and (not self.trailerUrl):
+            self._searchTrailers(title or self.curTitle)
+        
+    def _fetch(self, func, *args):
+        """ Return func(*args), reusing the result if it was already fetched. """
+        key = (func.__module__, func.__name__, args)
+        if (key not in self._prefetched):
+            self._prefetched[key] = func(*args)
+        return self._prefetched[key]
+        
+    def readNfoInfo(self):
+        """ Populate the *new* variables from the local NFO only (no network). """
+        self.nfoInfo = self._getNfoInfo()
+        self.imdbUrl = self._getImdbUrlFromNfo()
+        if (self.nfoInfo):
+            fields = self.nfoInfo.fields
+            self.title = util.encode(fields['title'])
+            self.year = fields['year']
+            self.country = util.encode(fields['country'])
+            self.aka = util.encode(fields['aka'])
+            self.imdbUpdate = util.encode(fields['imdbupdate'])
+            self.trailerUrl = fields['trailerurl']
+            if (self.year): self.year = int(self.year)
     
     ####################################
     #  Search and Parse IMDB
@@ -117,51 +175,64 @@ class Movie(Video):
     def _getImdbUrlFromNfo(self):
         """ Return the IMDB link from the NFO. """
         if (self.curNfoName):
-            log.finer("  Searching NFO for IMDB link: %s" % self.curNfoName)
-            nfoPath = "%s/%s" % (self.dirPath, self.curNfoName)
-            nfoHandle = open(nfoPath, 'r')
-            nfoData = nfoHandle.read()
-            nfoHandle.close()
-            matches = re.findall(IMDB_REGEX, nfoData)
-            if (matches):
-                return self.getUrl(matches[0])
-            log.finer("  IMDB link not found in NFO: %s" % self.curNfoName)
+            log.finer("  Searching NFO for IMDB link: %s", self.curNfoName)
+            record = self._getNfoRecord(self.curNfoName)
+            if (record.imdbId):
+                return self.getUrl(record.imdbId)
+            log.finer("  IMDB link not found in NFO: %s", self.curNfoName)
+        return None
+        
+    def _getImdbUrlFromData(self):
+        """ Return the IMDB link from the offline dataset if exactly one movie matches. """
+        movieID = imdbdata.match(self.curTitle, self.curYear)
+        if (movieID):
+            log.fine("  Offline IMDB match: %s", self.getUrl(movieID))
+            return self.getUrl(movieID)
         return None
             
     def _getImdbUrlFromSearch(self, foreign=False):
         """ Search IMDB for the specified title. """
+        # Check the offline dataset before searching
+        imdbUrl = self._getImdbUrlFromData()
+        if (imdbUrl): return imdbUrl
         # Search IMDB for potential matches
         title = self.curTitle
         year = self.curYear or "NA"
         log.info("  Searching IMDB for: '%s' (yr: %s)" % (title, year))
-        results = imdbpy.search_movie(title, IMDB_MAX_RESULTS)
-        # Check first 5 Results Title and year matches exactly
-        selection = None
-        for result in results[0:5]:
-            if (self._weakMatch(result['title'], title)) and (int(result['year']) == year):
-                log.fine("  Result match: %s (%s)" % (result['title'], result['year']))
-                selection = result
-                break
+        results = self._fetch(imdbpy.search_movie, title, IMDB_MAX_RESULTS)
+        selection = self._findImdbMatch(results, title, year)
+        if (selection):
+            log.fine("  Result match: %s (%s)", selection['title'], selection['year'])
         # Ask User to Select Correct Result
         if (not selection):
             log.fine("  No exact IMDB match found, prompting user")
             if (not foreign): choiceStr = lambda r: "%s (%s) - %s" % (r['title'], r['year'], self.getUrl(r.movieID))
             else: choiceStr = lambda r: "%s (%s-%s): %s" % (r['title'], self._getCountry(r), r['year'], self._getAka(r))
-            selection = util.promptUser(results, choiceStr)
+            if (foreign): results = self._getUpdatedMovies(results)
+            selection = self._promptUser('imdb', results, choiceStr, lambda r: r.movieID)
         # If still no selection, return none
         if (not selection):
-            log.fine("  IMDB has no entry for: %s (%s)" % (title, year))
+            log.fine("  IMDB has no entry for: %s (%s)", title, year)
             return None
         return self.getUrl(selection.movieID)
             
+    def _findImdbMatch(self, results, title, year):
+        """ Return the first of the top 5 results whose title and year match exactly. """
+        for result in results[0:5]:
+            if (self._weakMatch(result['title'], title)) and (int(result['year']) == year):
+                return result
+        return None
+            
     def _getImdbInfoFromUrl(self, imdbUrl, logIt=True):
         """ Search IMDB For the movieID's info. """
         try:
             if (not imdbUrl): return None
-            if (logIt): log.fine("  Looking up movie: %s" % imdbUrl)
+            if (logIt): log.fine("  Looking up movie: %s", imdbUrl)
             movieID = re.findall(IMDB_REGEX, imdbUrl)[0]
-            return imdbpy.get_movie(movieID)
-        except imdb.IMDbDataAccessError:
+            with updatedLock:
+                if (movieID in updatedMovies): return updatedMovies[movieID]
+            return self._fetch(imdbpy.get_movie, movieID)
+        except providers.imdbpy.IMDbDataAccessError:
             log.warn("  IMDB Data Access Error: %s" % imdbUrl)
             return None
         
@@ -169,9 +240,41 @@ class Movie(Video):
         """ Create an IMDB Url for the specified movieID. """
         return IMDB_REGEX.replace('(\d+?)', movieID)
     
+    def _getUpdatedMovie(self, imdbInfo):
+        """ Return imdbInfo with all its information fetched. Each movieID is only
+            fetched once per run, later calls get the same updated object.
+        """
+        with updatedLock:
+            if (imdbInfo.movieID in updatedMovies):
+                return updatedMovies[imdbInfo.movieID]
+        imdbpy.update(imdbInfo)
+        with updatedLock:
+            return updatedMovies.setdefault(imdbInfo.movieID, imdbInfo)
+            
+    def _getUpdatedMovies(self, results):
+        """ Return the fully updated search results, fetched concurrently. """
+        results = results[0:IMDB_MAX_RESULTS]
+        if (len(results) <= 1):
+            return map(self._getUpdatedMovieSafe, results)
+        pool = ThreadPool(min(IMDB_MAX_THREADS, len(results)))
+        try:
+            return pool.map(self._getUpdatedMovieSafe, results)
+        finally:
+            pool.terminate()
+            
+    def _getUpdatedMovieSafe(self, imdbInfo):
+        """ _getUpdatedMovie() that returns imdbInfo as is if the lookup fails. """
+        try:
+            return self._getUpdatedMovie(imdbInfo)
+        except Exception, e:
+            log.fine("  Unable to update IMDB info for %s: %s", imdbInfo.movieID, e)
+            return imdbInfo
+    
     def _getAka(self, imdbInfo):
         """ Find and return the first English AKA title in the list. """
-        imdbpy.update(imdbInfo)
+        aka = imdbdata.getAka(imdbInfo.movieID)
+        if (aka): return aka
+        imdbInfo = self._getUpdatedMovie(imdbInfo)
         if (imdbInfo.get('akas')):
             # Check for an English aka
             for akaStr in imdbInfo['akas']:
@@ -189,7 +292,7 @@ class Movie(Video):
     def _getCountry(self, imdbInfo):
         """ Get the country from imdbInfo. """
         try:
-            imdbpy.update(imdbInfo)
+            imdbInfo = self._getUpdatedMovie(imdbInfo)
             return imdbInfo['country'][0]
         except:
             return None
@@ -204,67 +307,119 @@ class Movie(Video):
         if (self.trailerUrl):
             log.info("  Trailer URL already exists: %s" % self.trailerUrl)
             return None
-        # Search for the Trailer URL
+        # Search every provider for the Trailer URL
         searchTitle = self.title or self.curTitle
         if (useAka): searchTitle = self.aka or searchTitle
         searchYear = self.year or self.curYear or "NA"
-        trailerUrl = self._searchTrailerAddict(searchTitle, searchYear)
-        trailerUrl = trailerUrl or self._searchYouTube(searchTitle, searchYear)
+        candidates = self.decisions.getCandidates(self.dirPath, 'trailersearch') if (self.decisions) else None
+        if (candidates):
+            log.info("  Using queued trailers for: '%s' (yr: %s)" % (searchTitle, searchYear))
+        else:
+            log.info("  Searching trailers for: '%s' (yr: %s)" % (searchTitle, searchYear))
+            candidates = rankTrailers(self._searchTrailers(searchTitle), searchTitle, searchYear)
+        trailerUrl = self._selectTrailer(candidates)
         if (not trailerUrl):
-            log.fine("  Found no trailer for: '%s' (yr: %s)" % (searchTitle, searchYear))
+            log.fine("  Found no trailer for: '%s' (yr: %s)", searchTitle, searchYear)
             return None
         # We found a new Trailer URL! :)
         self._newInfoFound = True
         self.trailerUrl = trailerUrl
         
-    def _searchTrailerAddict(self, searchTitle, searchYear):
-        """ Search TrailerAddict for a Trailer URL """
-        # Search TrailerAddict for the Movie
-        log.info("  Searching TrailerAddict for: '%s' (yr: %s)" % (searchTitle, searchYear))
-        searchResults = traileraddict.search(searchTitle)
-        if (not searchResults):
-            log.fine("  TrailerAddict has no search results for: '%s' (yr: %s)" % (searchTitle, searchYear))
+    def _searchTrailers(self, searchTitle):
+        """ Search every provider in TRAILER_PROVIDERS concurrently, returning
+            {provider: results}. A provider that fails or is still searching
+            after TRAILER_TIMEOUT seconds gives no results.
+        """
+        pool = ThreadPool(len(TRAILER_PROVIDERS))
+        try:
+            pending = [(name, pool.apply_async(self._fetch, (providers.get(name).search, searchTitle)))
+                for name in TRAILER_PROVIDERS]
+            deadline = time.time() + TRAILER_TIMEOUT
+            searchResults = {}
+            for name, result in pending:
+                try:
+                    searchResults[name] = result.get(max(0, deadline - time.time()))
+                    log.fine("  %s has %s search results", name, len(searchResults[name]))
+                except TimeoutError:
+                    log.warn("  %s search timed out after %ss" % (name, TRAILER_TIMEOUT))
+                except Exception, e:
+                    log.warn("  %s search failed: %s" % (name, e))
+            return searchResults
+        finally:
+            pool.terminate()
+        
+    def _selectTrailer(self, candidates):
+        """ Return the trailer URL for the best ranked candidate, prompting
+            the user unless it scores at least TRAILER_AUTO_SCORE.
+        """
+        if (not candidates):
             return None
-        # Select the correct TrailerAddict Movie
-        firstTitle = searchResults[0]['title']
-        firstYear = searchResults[0]['year']
-        if (firstTitle.lower() == searchTitle.lower()) and (int(firstYear) == searchYear):
-            log.fine("  First result is exact match: %s (%s)" % (searchTitle, searchYear))
-            searchSelection = searchResults[0]
+        selection = candidates[0]
+        if (selection['score'] >= TRAILER_AUTO_SCORE):
+            log.fine("  Best trailer match (%.2f): %s on %s", selection['score'], selection['title'], selection['provider'])
         else:
-            log.fine("  No exact TrailerAddict match found, prompting user")
-            choiceStr = lambda r: "%s (%s) - %s" % (r['title'], r['year'], r['url'])
-            searchSelection = util.promptUser(searchResults, choiceStr)
-        if (not searchSelection):
-            log.fine("  TrailerAddict has no entry for: '%s' (yr: %s)" % (searchTitle, searchYear))
+            log.fine("  No confident trailer match found, prompting user")
+            choiceStr = lambda c: "%s (%s) [%s %.2f] - %s" % (c['title'], c.get('year') or c.get('length'),
+                c['provider'], c['score'], c['url'])
+            choiceRecord = lambda c: dict((k, c[k]) for k in TRAILER_QUEUE_FIELDS if (k in c))
+            selection = self._promptUser('trailersearch', candidates[0:TRAILER_MAX_RESULTS], choiceStr, lambda c: c['url'], choiceRecord)
+        if (not selection):
             return None
-        # Search for the correct Video (Traileraddict has many per movie)
-        trailerUrls = traileraddict.getTrailerUrls(searchSelection['url'])
+        if (selection['provider'] == 'traileraddict'):
+            return self._getTrailerAddictTrailer(selection['url'])
+        return selection['url']
+        
+    def _getTrailerAddictTrailer(self, movieUrl):
+        """ Return the main trailer on the TrailerAddict movie page (TrailerAddict has many per movie). """
+        trailerUrls = traileraddict.getTrailerUrls(movieUrl)
         trailerUrl = traileraddict.getMainTrailer(trailerUrls)
         if (not trailerUrl):
             log.info("  Main trailer not found, prompting user")
             choiceStr = lambda t: t
-            trailerUrl = util.promptUser(trailerUrls, choiceStr)
+            trailerUrl = self._promptUser('trailer', trailerUrls, choiceStr, lambda t: t)
         return trailerUrl
     
-    def _searchYouTube(self, searchTitle, searchYear):
-        """ Search YouTune for a Trailer URL. """
-        log.info("  Searching YouTube for: '%s' (yr: %s)" % (searchTitle, searchYear))
-        searchResults = youtube.search(searchTitle)
-        # Select the correct YouTube Video (always ask user)
-        choiceStr = lambda r: "%s - %s" % (r['title'], r['url'])
-        searchSelection = util.promptUser(searchResults, choiceStr)
-        if (not searchSelection):
-            log.fine("  YouTube has no entry for: '%s' (yr: %s)" % (searchTitle, searchYear))
-            return None
-        return searchSelection['url']
+    ####################################
+    #  Prompting
+    ####################################
     
+    def _promptUser(self, kind, choices, choiceStr, choiceValue, choiceRecord=None):
+        """ Ask the user to select one of the choices. When running in batch
+            mode the choices are queued for a later --resolve session instead,
+            and in that session the answer already given is used.
+            @param kind:         Type of choice ('imdb', 'trailersearch', 'trailer')
+            @param choiceValue:  Function returning the value to remember for a choice
+            @param choiceRecord: Function returning the JSON dict to queue for a choice, so
+                                 the --resolve session can rebuild the choices without a search
+        """
+        if (self.decisions):
+            entry = self.decisions.get(self.dirPath, kind)
+            if (entry) and (entry['resolved']):
+                for choice in choices:
+                    if (util.jsonText(choiceValue(choice)) == entry['selection']):
+                        return choice
+                if (entry['selection']):
+                    log.warn("  Queued %s choice no longer in results: %s" % (kind, entry['selection']))
+                return None
+            if (self.decisions.batch) and (not choices):
+                return None     # Nothing to choose from, so nothing to queue
+            if (self.decisions.batch):
+                labels = [choiceStr(choice) for choice in choices]
+                values = [choiceValue(choice) for choice in choices]
+                candidates = map(choiceRecord, choices) if (choiceRecord) else None
+                self.decisions.add(self.dirPath, kind, labels, values, candidates)
+                log.info("  Queued %s choice for review: %s" % (kind, self.decisions.path))
+                self.deferred = True
+                return None
+        return util.promptUser(choices, choiceStr)
+        
     ####################################
     #  Actions to Perform
     ####################################
     
     def saveNfo(self, foreign=False):
         """ Create the NFO file and store on disk.  Overwrite it if already exists.
+            Returns the path written, or None if there was nothing new to save.
             Format: http://xbmc.org/wiki/?title=Import_-_Export_Library#Video_nfo_Files
         """
         # Check we have new Information from the net
@@ -287,9 +442,12 @@ class Movie(Video):
         handle.write("  </movie>\n")
         handle.write("</xml>\n")
         handle.close()
+        return nfoPath
     
-    def downloadTrailer(self):
-        """ Download the trailer. """
+    def getTrailerPath(self):
+        """ Return the path to download the trailer to, or None if there is
+            nothing to download (trailer exists, no trailerUrl, path taken).
+        """
         # Check we already have a trailer
         if (self.curTrailerName):
             log.info("  Trailer already found: %s/%s" % (self.dirPath, self.curTrailerName))
@@ -305,11 +463,64 @@ class Movie(Video):
         if (os.path.exists(trailerPath)):
             log.warn("  Filepath already exists: %s" % trailerPath)
             return None
-        # All Set, Download It!
-        log.info("  Downloading trailer to: %s" % trailerPath)
-        if ('traileraddict.com' in self.trailerUrl):
-            traileraddict.downloadTrailer(self.trailerUrl, trailerPath)
-        elif ('youtube.com' in self.trailerUrl):
-            youtube.downloadTrailer(self.trailerUrl, trailerPath)
+        return trailerPath
+    
+    def downloadTrailer(self):
+        """ Download the trailer. """
+        trailerPath = self.getTrailerPath()
+        if (trailerPath):
+            log.info("  Downloading trailer to: %s" % trailerPath)
+            downloadTrailerUrl(self.trailerUrl, trailerPath)
             
-            
\ No newline at end of file
+            
+def scoreTrailer(result, title, year):
+    """ Return how well a trailer search result matches the title and year
+        (0 to 1). Results without a year (most YouTube titles) score lower.
+    """
+    resultYear = result.get('year')
+    if (not resultYear):
+        match = re.search(TRAILER_YEAR_REGEX, result['title'])
+        resultYear = match.group(0) if (match) else None
+    resultTitle = re.sub(TRAILER_NOISE_REGEX, ' ', normalizeTitle(result['title']))
+    searchTitle = re.sub(TRAILER_NOISE_REGEX, ' ', normalizeTitle(title))
+    score = difflib.SequenceMatcher(None, ' '.join(resultTitle.split()), ' '.join(searchTitle.split())).ratio()
+    if (not resultYear) or (not str(year).isdigit()):
+        return score * TRAILER_NO_YEAR
+    yearDiff = abs(int(resultYear) - int(year))
+    if (yearDiff == 0): return score
+    if (yearDiff == 1): return score * TRAILER_NEAR_YEAR
+    return score * TRAILER_WRONG_YEAR
+    
+    
+def rankTrailers(searchResults, title, year):
+    """ Merge the {provider: results} from Movie._searchTrailers() into one
+        list of candidates, best match first (ties go to the provider listed
+        first in TRAILER_PROVIDERS). Each candidate is the search result with
+        its 'provider' and 'score' added.
+    """
+    candidates = []
+    for name in TRAILER_PROVIDERS:
+        for result in searchResults.get(name) or []:
+            candidate = dict(result)
+            candidate['provider'] = name
+            candidate['score'] = scoreTrailer(result, title, year)
+            candidates.append(candidate)
+    return sorted(candidates, key=lambda c: (-c['score'], TRAILER_PROVIDERS.index(c['provider'])))
+
+
+def downloadTrailerUrl(trailerUrl, trailerPath, progress=None):
+    """ Download the trailer page trailerUrl to trailerPath using its provider. """
+    if ('traileraddict.com' in trailerUrl):
+        traileraddict.downloadTrailer(trailerUrl, trailerPath, progress)
+    elif ('youtube.com' in trailerUrl):
+        youtube.downloadTrailer(trailerUrl, trailerPath, progress)
+    else:
+        raise ValueError("Unknown trailer provider: %s" % trailerUrl)
+
+
+def setBaseUrl(baseUrl):
+    """ Send IMDB, TrailerAddict and YouTube requests to baseUrl (ex: a local
+        standin.py server) instead of the real sites.
+    """
+    util.http.setBaseUrl(baseUrl)
+    providers.imdb.reset()
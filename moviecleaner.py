@@ -41,13 +41,59 @@ Rename video files to match XBMC, Boxee, Plex formats.
 """
 import os
 import sys
+import Queue
+import itertools
+import collections
+import util
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from util import log
 from util import LOG_LEVELS
+from util import COLOR_RESET
 from movie import Movie
+from movie import imdbpy
+from movie import setBaseUrl
+from movie import imdbdata
+from video import scanDirectory
+from video import LIST_FUNCTIONS
+from video import UNINDEXED_LISTS
+from imdbdata import DATA_PATH
+from nfo import nfoReader
+from profiler import profiler
+from nfo import NFO_CACHE_PATH
+from fingerprint import fingerprinter
+from fingerprint import FINGERPRINT_CACHE_PATH
+from probe import prober
+from probe import PROBE_CACHE_PATH
+from imdbdata import ingest
+from renameplan import RenamePlan
+from libraryindex import INDEX_PATH
+from libraryindex import LibraryIndex
+from libraryindex import buildRecord
+from watcher import POLL_INTERVAL
+from watcher import DirectoryWatcher
+from imdbcache import CACHE_PATH
+from pagecache import PAGE_CACHE_PATH
+from pagecache import PageCache
+from decisions import QUEUE_PATH
+from decisions import DecisionQueue
+from downloads import DOWNLOAD_WORKERS
+from downloads import DOWNLOAD_PER_HOST
+from downloads import DOWNLOAD_RETRIES
+from downloads import DownloadScheduler
 from optparse import OptionGroup
 from optparse import OptionParser
 from optparse import IndentedHelpFormatter
 verbose = LOG_LEVELS['VERBOSE']
+POOL_TIMEOUT = 60 * 60 * 24 * 365         # Wait forever but still allow Ctrl-C on pool results
+SCAN_AHEAD   = 2                         # Directories scanned ahead per job while processing
+
+
+def _listDirectory(args):
+    """ Return the list entries for a single directory (runs in the worker pool). """
+    dirPath, listName = args
+    movie = Movie(dirPath)
+    return getattr(movie, LIST_FUNCTIONS[listName])()
 
 
 #################################
@@ -60,79 +106,356 @@ class MovieCleaner:
     def __init__(self, opts):
         log.level = LOG_LEVELS[opts.log]
         if (opts.verbose): log.level = LOG_LEVELS['FINER']
+        log.buffered = not sys.stdout.isatty()            # Unattended output is written in batches
+        if (opts.logjson):
+            log.sink = util.JsonLogSink(opts.logjson)
+        profiler.enabled = opts.profile or bool(opts.profilejson)
+        self.profileJson     = opts.profilejson           # Write the profile to this JSON file
         # Runtime Settings
         self.baseDir         = opts.basedir.rstrip('/')   # Base directory to search for files
         self.single          = opts.single.rstrip('/')    # DirName when processing Single Dir
         self.startAt         = opts.startat               # Start at the specified Dir
         self.list            = opts.list                  # Display a list
         self.print0          = opts.print0                # Delimit list items by NULL
+        self.watch           = opts.watch                 # Keep running, processing new dirs
+        self.settle          = opts.settle                # Seconds a new dir must be unchanged
+        self.queueSize       = opts.queuesize             # Max settled dirs waiting to be processed
+        self.watcher         = None                       # DirectoryWatcher (--watch only)
+        self.jobs            = max(1, opts.jobs)          # Number of parallel scan workers
+        self.prefetch        = max(0, opts.prefetch)      # Directories to look up ahead of the prompts
+        self.index           = None                       # Persistent LibraryIndex (optional)
+        if (opts.index) or (opts.rebuildindex):
+            self.index = LibraryIndex(opts.index or INDEX_PATH, opts.rebuildindex)
         # Runtime Settings
         self.foreign         = opts.aka                   # Use AKA for DirName and FileName
         self.lookupTrailer   = opts.trailer               # Lookup trailer page
         self.logImdb         = opts.imdbinfo              # Display IMDB Information
+        self.resolve         = opts.resolve               # Answer queued choices, then apply them
+        self.decisions       = None                       # DecisionQueue for batch and resolve runs
+        if (opts.batch) or (opts.resolve):
+            self.decisions = DecisionQueue(opts.queue, batch=opts.batch)
         # Actions to Perform
         self.forceUpdate     = opts.force                 # Force IMDB Update (even if valid NFO exists)
         self.renameDir       = opts.renamedir             # Old Directory Path on Disk
         self.renameFiles     = opts.renamefiles           # Rename files or not
         self.saveNfo         = opts.savenfo               # Create NFO Files
         self.downloadTrailer = opts.download              # Download trailer
+        self.plan            = None                       # RenamePlan collecting renames for review
+        if (opts.plan):
+            self.plan = RenamePlan(opts.plan, load=False)
+        self.applyPlan       = opts.apply                 # Rename plan file to apply
+        self.rollbackPlan    = opts.rollback              # Rename plan file to roll back
+        self.downloads       = None                       # Background DownloadScheduler
+        if (opts.download) and (not opts.list):
+            maxRate = opts.maxrate * 1024 if (opts.maxrate) else None
+            self.downloads = DownloadScheduler(opts.downloadjobs, opts.perhost, maxRate, opts.retries)
+        util.http.timeout = opts.timeout
+        if (opts.baseurl):
+            setBaseUrl(opts.baseurl)
+        # IMDB Response Cache
+        imdbpy.configure(opts.imdbcache, int(opts.imdbttl * 24 * 60 * 60))
+        nfoReader.configure(opts.nfocache)
+        fingerprinter.configure(opts.fingerprintcache)
+        prober.configure(opts.probecache)
+        if (opts.pagecache):
+            util.http.cache = PageCache(util.http, opts.pagecache, int(opts.pagefresh * 60 * 60), opts.pagecachemb * 1048576)
+        # Offline IMDB Dataset
+        self.ingest          = opts.ingest                # Directory of IMDB dumps to index
+        self.imdbData        = opts.imdbdata              # Offline IMDB dataset index
+        imdbdata.configure(opts.imdbdata)
     
     def run(self):
         """ Loop to search and rename all movie files. """
+        try:
+            self._run()
+        finally:
+            if (profiler.enabled): self._reportProfile()
+    
+    def _run(self):
+        if (self.ingest):    return ingest(self.ingest, self.imdbData)
         if (self.list):      return self._processListRequest()
-        elif (self.single):  return self._processSingleRequest()
-        else:                return self._processCompleteDirectory()
+        if (self.applyPlan): return RenamePlan(self.applyPlan).apply()
+        if (self.rollbackPlan): return RenamePlan(self.rollbackPlan).rollback()
+        if (self.plan) and (self.plan.isPartial()):
+            return log.severe("Plan was partially applied, --apply or --rollback it first: %s" % self.plan.path)
+        if (self.downloads): self.downloads.start()
+        if (self.watch):     return self._processWatchRequest()
+        elif (self.resolve): self._processResolveRequest()
+        elif (self.single):  self._processSingleRequest()
+        else:                self._processCompleteDirectory()
+        log.setContext()
+        if (self.plan):      self._savePlan()
+        if (self.downloads): self.downloads.join()
+        hits, misses = imdbpy.stats()
+        log.fine("IMDB cache: %s hits, %s misses", hits, misses)
+        log.fine("IMDB dataset: %s hits, %s misses", imdbdata.hits, imdbdata.misses)
+        if (util.http.cache): log.fine("Page cache: %s hits, %s revalidated, %s misses",
+            util.http.cache.hits, util.http.cache.revalidated, util.http.cache.misses)
+        
+    def _reportProfile(self):
+        """ Write the --profile report to stderr (and the JSON file if requested). """
+        log.flush()
+        sys.stderr.write("%s\n" % '\n'.join(profiler.getReport()))
+        if (self.profileJson):
+            profiler.saveJson(self.profileJson)
+        
+    def _getMovieDirs(self):
+        """ Return the sorted paths of every movie directory in baseDir. """
+        dirPaths = []
+        for dirName in sorted(os.listdir(self.baseDir)):
+            dirPath = "%s/%s" % (self.baseDir, dirName)
+            if (os.path.isdir(dirPath)):
+                dirPaths.append(dirPath)
+        return dirPaths
+        
+    def _scanDirectories(self, dirPaths):
+        """ Yield (dirPath, snapshot) for each path in order. With more than one
+            job the next jobs * SCAN_AHEAD directories are scanned ahead in a
+            pool of worker threads, so snapshots are fresh when they're used.
+        """
+        if (self.jobs == 1):
+            for dirPath in dirPaths:
+                yield dirPath, None
+            return
+        pool = ThreadPool(self.jobs)
+        pending = collections.deque()
+        dirPaths = iter(dirPaths)
+        try:
+            for dirPath in itertools.islice(dirPaths, self.jobs * SCAN_AHEAD):
+                pending.append((dirPath, pool.apply_async(scanDirectory, (dirPath,))))
+            while (pending):
+                dirPath, result = pending.popleft()
+                snapshot = result.get(POOL_TIMEOUT)
+                for nextPath in itertools.islice(dirPaths, 1):
+                    pending.append((nextPath, pool.apply_async(scanDirectory, (nextPath,))))
+                yield dirPath, snapshot
+        finally:
+            pool.terminate()
+        
+    def _mapPool(self, func, tasks):
+        """ Return map(func, tasks), spread over a process pool if jobs > 1. """
+        if (self.jobs == 1) or (len(tasks) <= 1):
+            return map(func, tasks)
+        pool = multiprocessing.Pool(self.jobs)
+        try:
+            chunksize = max(1, len(tasks) / (self.jobs * 4))
+            return pool.map_async(func, tasks, chunksize).get(POOL_TIMEOUT)
+        finally:
+            pool.terminate()
+            
+    def _getIndexRecords(self, dirPaths):
+        """ Return {dirPath: record} from the library index, rescanning stale directories. """
+        threads = ThreadPool(self.jobs) if (self.jobs > 1) else None
+        try:
+            records = self.index.lookup(dirPaths, threads)
+        finally:
+            if (threads): threads.terminate()
+        stale = [dirPath for dirPath in dirPaths if (dirPath not in records)]
+        for dirPath, record in zip(stale, self._mapPool(buildRecord, stale)):
+            self.index.store(dirPath, record)
+            records[dirPath] = record
+        self.index.prune(dirPaths)
+        self.index.commit()
+        return records
         
     def _processListRequest(self):
         """ Process a list Request. """
+        if (self.list not in LIST_FUNCTIONS):
+            log.severe("Unknown list: %s" % self.list)
+            return None
         log.level = -1
         listItems = []
-        for dirName in sorted(os.listdir(self.baseDir)):
-            if (os.path.isdir(dirName)):
-                dirPath = "%s/%s" % (self.baseDir, dirName)
-                movie = Movie(dirPath)
-                if   (self.list == 'novideo'): listItems += movie.getNoVideoList()
-                elif (self.list == 'badnfo'):  listItems += movie.getBadNfoList()
-                elif (self.list == 'nonfo'):   listItems += movie.getMissingNfoList()
-                elif (self.list == 'hassub'):  listItems += movie.getHasSubtitleList()
-                elif (self.list == 'nosub'):   listItems += movie.getNoSubtitleList()
-                elif (self.list == 'suberr'):  listItems += movie.getSubtitleErrorList()
+        dirPaths = self._getMovieDirs()
+        if (self.index) and (self.list not in UNINDEXED_LISTS):
+            records = self._getIndexRecords(dirPaths)
+            results = [records[dirPath]['lists'][self.list] for dirPath in dirPaths]
+        else:
+            results = self._mapPool(_listDirectory, [(dirPath, self.list) for dirPath in dirPaths])
+        for result in results:
+            listItems += result
+        if (self.list == 'dupes'):
+            listItems = self._getDuplicateItems(listItems)
         # Print the Result
         if (listItems) and (self.print0):
             sys.stdout.write("\0".join(listItems))
         elif (listItems):
             print "\n".join(listItems)
     
+    def _getDuplicateItems(self, entries):
+        """ Return the list items for --list dupes: the paths of every video
+            file sharing a fingerprint, each group under a '#' comment line
+            with the size and the IMDB IDs of the NFOs (paths only with -0).
+        """
+        groups = collections.OrderedDict()
+        for filePath, fingerprint, imdbId in entries:
+            groups.setdefault(fingerprint, []).append((filePath, imdbId))
+        listItems = []
+        for fingerprint, group in groups.items():
+            if (len(group) < 2): continue
+            if (not self.print0):
+                imdbIds = sorted(set("tt%s" % imdbId for filePath, imdbId in group if (imdbId)))
+                size = int(fingerprint.split(':')[0])
+                listItems.append("# %.1f MB, IMDB: %s" % (size / float(util.MEGABYTE), ', '.join(imdbIds) or 'unknown'))
+            listItems += [filePath for filePath, imdbId in group]
+        return listItems
+    
     def _processSingleRequest(self):
         """ Process a single directory in baseDir. """
-        for dirName in sorted(os.listdir(self.baseDir)):
-            if (os.path.isdir(dirName)) and (self.single.lower() in dirName.lower()):
-                dirPath = "%s/%s" % (self.baseDir, dirName)
+        for dirPath in self._getMovieDirs():
+            if (self.single.lower() in os.path.basename(dirPath).lower()):
                 self._processMovieDirectory(dirPath)
                 break
     
+    def _processWatchRequest(self):
+        """ Process new directories in baseDir as they finish copying. """
+        watcher = self.watcher = DirectoryWatcher(self.baseDir, self.settle, self.queueSize)
+        watcher.start()
+        log.info("Watching for new directories in: %s" % self.baseDir)
+        try:
+            while (True):
+                try: dirPath = watcher.queue.get(True, POLL_INTERVAL)
+                except Queue.Empty: continue
+                if (not os.path.isdir(dirPath)):
+                    log.warn("Directory no longer exists: %s" % dirPath)
+                    continue
+                try:
+                    self._processMovieDirectory(dirPath)
+                except Exception, e:
+                    log.severe("  Error processing %s: %s" % (dirPath, e))
+                finally:
+                    watcher.doneProcessing(dirPath)
+                    log.flush()
+        finally:
+            watcher.stop()
+    
+    def _processResolveRequest(self):
+        """ Ask every queued choice back to back, then process the answered
+            directories. Choices only reached once an answer is known (the
+            trailer after the IMDB match) are queued again rather than asked
+            mid-run, and the rounds repeat until none are left.
+        """
+        if (not self.decisions.entries):
+            log.info("No queued choices in: %s" % self.decisions.path)
+            return None
+        self.decisions.batch = True
+        while (self.decisions.entries):
+            self.decisions.resolve()
+            for dirPath in self.decisions.getDirPaths():
+                if (not self.decisions.isResolved(dirPath)):
+                    continue
+                if (os.path.isdir(dirPath)):
+                    self._processMovieDirectory(dirPath)
+                    if (not self.decisions.isResolved(dirPath)):
+                        continue    # New choices queued for the next round
+                else:
+                    log.warn("Directory no longer exists: %s" % dirPath)
+                self.decisions.remove(dirPath)
+    
     def _processCompleteDirectory(self):
         """ Process every movie directory in baseDir. """
-        for dirName in sorted(os.listdir(self.baseDir)):
-            if (os.path.isdir(dirName)):
-                if (not self.startAt) or (self.startAt.lower() in dirName.lower()):
-                    dirPath = "%s/%s" % (self.baseDir, dirName)
-                    self._processMovieDirectory(dirPath)
-                    self.startAt = None
+        dirPaths = self._getMovieDirs()
+        if (self.startAt):
+            startAt = self.startAt.lower()
+            matches = [i for i in range(len(dirPaths)) if startAt in os.path.basename(dirPaths[i]).lower()]
+            dirPaths = dirPaths[matches[0]:] if (matches) else []
+            self.startAt = None
+        # Scanning and lookups may run ahead, prompts and actions stay serialized
+        if (self.prefetch):
+            for movie in self._prefetchMovies(dirPaths):
+                self._processMovie(movie)
+        else:
+            for dirPath, snapshot in self._scanDirectories(dirPaths):
+                self._processMovieDirectory(dirPath, snapshot)
+                
+    def _prefetchMovies(self, dirPaths):
+        """ Yield a Movie for each path in order while the next self.prefetch
+            directories are scanned and looked up in background threads.
+        """
+        pool = ThreadPool(self.prefetch)
+        pending = collections.deque()
+        dirPaths = iter(dirPaths)
+        try:
+            for dirPath in itertools.islice(dirPaths, self.prefetch):
+                pending.append(pool.apply_async(self._prefetchMovie, (dirPath,)))
+            while (pending):
+                movie, records = pending.popleft().get(POOL_TIMEOUT)
+                for dirPath in itertools.islice(dirPaths, 1):
+                    pending.append(pool.apply_async(self._prefetchMovie, (dirPath,)))
+                log.replay(records)
+                yield movie
+        finally:
+            pool.terminate()
+            
+    def _prefetchMovie(self, dirPath):
+        """ Build the Movie and run its lookups (runs in the prefetch pool). Returns
+            the Movie and the log messages to show when it is processed.
+        """
+        log.startCapture()
+        try:
+            movie = Movie(dirPath)
+        finally:
+            records = log.stopCapture()
+        log.startCapture()   # Lookups are logged again when the movie is processed
+        try:
+            movie.prefetchVideoInfo(self.forceUpdate, self.foreign, self.lookupTrailer)
+        except Exception, e:
+            if (log.level >= LOG_LEVELS['FINE']):
+                records.append(("  Prefetch failed for %s: %s" % (dirPath, e), LOG_LEVELS['FINE'], COLOR_RESET))
+        finally:
+            log.stopCapture()
+        return movie, records
+            
+    def _savePlan(self):
+        """ Check the collected renames for conflicts and save the plan for review. """
+        conflicts = self.plan.findConflicts()
+        self.plan.save()
+        log.title("Rename Plan")
+        self.plan.logPlan()
+        if (conflicts): log.warn("%s directories have conflicts and will not be renamed" % conflicts)
+        log.info("Review the plan, then rename with: --apply %s" % self.plan.path)
             
-    def _processMovieDirectory(self, dirPath):
+    def _processMovieDirectory(self, dirPath, snapshot=None):
         """ Process the specfied directory path. """
+        with self._stage('scan', dirPath):
+            movie = Movie(dirPath, snapshot)
+        self._processMovie(movie)
+        
+    def _stage(self, name, dirPath):
+        """ Enter the stage for dirPath in the log context, returning its profiler timer. """
+        log.setContext(dirPath, name)
+        return profiler.stage(name, dirPath)
+        
+    def _processMovie(self, movie):
+        """ Look up and perform the actions on the specified Movie. """
         # Only ping the web for info if we need it
-        movie = Movie(dirPath)
-        movie.fetchVideoInfo(self.forceUpdate, self.foreign)
+        dirPath = movie.dirPath
+        movie.decisions = self.decisions
+        with self._stage('lookup', dirPath):
+            movie.fetchVideoInfo(self.forceUpdate, self.foreign)
+        if (self.lookupTrailer) and (not movie.deferred):
+            with self._stage('trailer', dirPath):
+                movie.lookupTrailerUrl(self.foreign)
+        if (movie.deferred):
+            log.info("  Choices queued; actions skipped until --resolve")
+            return None
         # Perform the Actions
-        if (self.lookupTrailer):      movie.lookupTrailerUrl(self.foreign)
-        if (log.level >= verbose):    movie.logClassVars()
-        if (self.logImdb):            movie.logImdbVars()
-        if (self.saveNfo):            movie.saveNfo(self.foreign)
-        if (self.renameFiles):        movie.renameFiles()
-        if (self.renameDir):          movie.renameDirectory()
-        if (self.downloadTrailer):    movie.downloadTrailer()
+        with self._stage('actions', dirPath):
+            savedNfo = None
+            if (log.level >= verbose):    movie.logClassVars()
+            if (self.logImdb):            movie.logImdbVars()
+            if (self.saveNfo):            savedNfo = movie.saveNfo(self.foreign)
+            if (self.plan):               self.plan.add(movie.dirPath, movie.getRenames(self.renameFiles, self.renameDir), [savedNfo])
+            else:
+                if (self.renameFiles):    movie.renameFiles()
+                if (self.renameDir) and (self.watcher):
+                    self.watcher.expectRenames(movie.getRenames(False, True))
+                if (self.renameDir):      movie.renameDirectory()
+            if (self.downloadTrailer):    self.downloads.add(movie)
+        # Anything we changed on disk must be rescanned next time
+        renamed = (self.renameFiles or self.renameDir) and (not self.plan)
+        if (self.index) and (self.saveNfo or renamed or self.downloadTrailer):
+            self.index.discard(dirPath)
+            self.index.commit()
 
         
 #################################
@@ -153,38 +476,90 @@ class HelpFormatter(IndentedHelpFormatter):
 #  Command Line Interface
 #################################
 
+def buildOptionParser():
+    """ Return the OptionParser for the command line. """
+    # Build the OptionParser
+    desc = __doc__
+    version = "%prog version 10.01"
+    parser = OptionParser(description=desc, formatter=HelpFormatter(), version=version)
+    parser.add_option("-b", "--basedir",   help="Base directory to search for files", default=".")
+    parser.add_option("-s", "--single",    help="Only process single movie", default="")
+    parser.add_option(      "--startat",   help="Start at the specified Dir match")
+    parser.add_option("-l", "--log",       help="Log level: INFO, FINE, VERBOSE, FINER", default='INFO')
+    parser.add_option("-v", "--verbose",   help="Same as setting --log=FINER", action='store_true', default=False)
+    parser.add_option(      "--logjson",   help="Also write the log to this file as JSON lines")
+    parser.add_option(      "--profile",   help="Report time per stage, counters and the slowest directories", action='store_true', default=False)
+    parser.add_option(      "--profilejson", help="Also write the profile report to this file as JSON")
+    parser.add_option("-j", "--jobs",      help="Number of parallel directory scan workers", type='int', default=1)
+    parser.add_option(      "--prefetch",  help="Look up the next N directories in the background [0]", type='int', default=0)
+    parser.add_option(      "--index",     help="Library index file to answer unchanged directories from")
+    parser.add_option(      "--rebuildindex", help="Rebuild the library index from scratch", action='store_true', default=False)
+    # List Options
+    lists = OptionGroup(parser, "Display Listing")
+    lists.add_option("--list",             help="Display List: novideo, badnfo, nonfo, hassub, nosub, suberr, subcorrupt, dupes")
+    lists.add_option("--fingerprintcache", help="Video fingerprint cache for dupes, empty to disable [%default]", default=FINGERPRINT_CACHE_PATH)
+    lists.add_option("-0", "--print0",     help="Delimit items by NULL (for xargs)", action='store_true', default=False)
+    parser.add_option_group(lists)
+    # Watch Options
+    watch = OptionGroup(parser, "Watch Mode")
+    watch.add_option("-w", "--watch",      help="Keep running and process new directories as they arrive", action='store_true', default=False)
+    watch.add_option(      "--settle",     help="Seconds a new directory must be unchanged [60]", type='int', default=60)
+    watch.add_option(      "--queuesize",  help="Max settled directories waiting to be processed [100]", type='int', default=100)
+    parser.add_option_group(watch)
+    # Runtime Settings
+    runtime = OptionGroup(parser, "Runtime Options")
+    runtime.add_option("-a", "--aka",      help="Use AKA title (for foreign films)", action='store_true', default=False)
+    runtime.add_option("-f", "--force",    help="Force IMDB update even if a valid NFO file exists", action='store_true', default=False)
+    runtime.add_option("-t", "--trailer",  help="Lookup trailer page from TrailerAddict", action='store_true', default=False)
+    runtime.add_option("-i", "--imdbinfo", help="Display raw IMDB information", action='store_true', default=False)
+    runtime.add_option(      "--timeout",  help="Seconds to wait on web requests [%default]", type='float', default=util.HTTP_TIMEOUT)
+    runtime.add_option(      "--baseurl",  help="Send web requests to this server instead (see standin.py)")
+    runtime.add_option(      "--imdbcache", help="IMDB response cache file [%default]", default=CACHE_PATH)
+    runtime.add_option(      "--imdbttl",  help="Days to keep cached IMDB responses, 0 to disable [%default]", type='float', default=7)
+    runtime.add_option(      "--nfocache", help="Parsed NFO cache file, empty to disable [%default]", default=NFO_CACHE_PATH)
+    runtime.add_option(      "--probecache", help="Video header probe cache file, empty to disable [%default]", default=PROBE_CACHE_PATH)
+    runtime.add_option(      "--pagecache", help="Cache scraped pages in this file (e.g. %s); cached pages are read whole [off]" % PAGE_CACHE_PATH)
+    runtime.add_option(      "--pagefresh", help="Hours to use cached pages before revalidating [%default]", type='float', default=24)
+    runtime.add_option(      "--pagecachemb", help="Max size of the page cache in MB [%default]", type='int', default=64)
+    parser.add_option_group(runtime)
+    # Offline IMDB Dataset
+    dataset = OptionGroup(parser, "Offline IMDB Dataset")
+    dataset.add_option("--imdbdata",       help="Offline IMDB dataset index, used if it exists [%default]", default=DATA_PATH)
+    dataset.add_option("--ingest",         help="Build the index from the title.basics and title.akas dumps in this directory")
+    parser.add_option_group(dataset)
+    # Unattended Runs
+    batch = OptionGroup(parser, "Unattended Runs")
+    batch.add_option(      "--batch",      help="Queue ambiguous choices instead of prompting", action='store_true', default=False)
+    batch.add_option(      "--resolve",    help="Answer queued choices, then process those directories", action='store_true', default=False)
+    batch.add_option(      "--queue",      help="Queued choices file [%default]", default=QUEUE_PATH)
+    parser.add_option_group(batch)
+    # Actions to Perform
+    actions = OptionGroup(parser, "Actions to Perform")
+    actions.add_option("--renamedir",      help="Rename containing directories to IMDB title", action='store_true', default=False)
+    actions.add_option("--renamefiles",    help="Rename video files to IMDB title", action='store_true', default=False)
+    actions.add_option("--savenfo",        help="Create NFO file containing IMDB info", action='store_true', default=False)
+    actions.add_option("--download",       help="Download trailer from TrailerAddict", action='store_true', default=False)
+    parser.add_option_group(actions)
+    # Rename Plan
+    plan = OptionGroup(parser, "Rename Plan")
+    plan.add_option("--plan",              help="Write the --renamefiles/--renamedir renames to this file for review instead of renaming")
+    plan.add_option("--apply",             help="Apply a reviewed plan (resumes an interrupted apply)")
+    plan.add_option("--rollback",          help="Undo the renames an applied plan made")
+    parser.add_option_group(plan)
+    # Download Options
+    downloads = OptionGroup(parser, "Download Options")
+    downloads.add_option("--downloadjobs", help="Concurrent trailer downloads [%default]", type='int', default=DOWNLOAD_WORKERS)
+    downloads.add_option("--perhost",      help="Concurrent downloads per trailer site [%default]", type='int', default=DOWNLOAD_PER_HOST)
+    downloads.add_option("--maxrate",      help="Total download bandwidth in KB/s, 0 for no limit [%default]", type='int', default=0)
+    downloads.add_option("--retries",      help="Attempts per trailer download [%default]", type='int', default=DOWNLOAD_RETRIES)
+    parser.add_option_group(downloads)
+    return parser
+
+
 if (__name__ == "__main__"):
     try:
-        # Build the OptionParser
-        desc = sys.modules['__main__'].__doc__
-        version = "%prog version 10.01"
-        parser = OptionParser(description=desc, formatter=HelpFormatter(), version=version)
-        parser.add_option("-b", "--basedir",   help="Base directory to search for files", default=".")
-        parser.add_option("-s", "--single",    help="Only process single movie", default="")
-        parser.add_option(      "--startat",   help="Start at the specified Dir match")
-        parser.add_option("-l", "--log",       help="Log level: INFO, FINE, VERBOSE, FINER", default='INFO')
-        parser.add_option("-v", "--verbose",   help="Same as setting --log=FINER", action='store_true', default=False)
-        # List Options
-        lists = OptionGroup(parser, "Display Listing")
-        lists.add_option("--list",             help="Display List: novideo, badnfo, nonfo, hassub, nosub, suberr")
-        lists.add_option("-0", "--print0",     help="Delimit items by NULL (for xargs)", action='store_true', default=False)
-        parser.add_option_group(lists)
-        # Runtime Settings
-        runtime = OptionGroup(parser, "Runtime Options")
-        runtime.add_option("-a", "--aka",      help="Use AKA title (for foreign films)", action='store_true', default=False)
-        runtime.add_option("-f", "--force",    help="Force IMDB update even if a valid NFO file exists", action='store_true', default=False)
-        runtime.add_option("-t", "--trailer",  help="Lookup trailer page from TrailerAddict", action='store_true', default=False)
-        runtime.add_option("-i", "--imdbinfo", help="Display raw IMDB information", action='store_true', default=False)
-        parser.add_option_group(runtime)
-        # Actions to Perform
-        actions = OptionGroup(parser, "Actions to Perform")
-        actions.add_option("--renamedir",      help="Rename containing directories to IMDB title", action='store_true', default=False)
-        actions.add_option("--renamefiles",    help="Rename video files to IMDB title", action='store_true', default=False)
-        actions.add_option("--savenfo",        help="Create NFO file containing IMDB info", action='store_true', default=False)
-        actions.add_option("--download",       help="Download trailer from TrailerAddict", action='store_true', default=False)
-        parser.add_option_group(actions)
         # OK, Lets Get Going
-        options, args = parser.parse_args()
+        options, args = buildOptionParser().parse_args()
         MovieCleaner(options).run()
     except KeyboardInterrupt:
         log.severe("\nKeyboard Interrupt: quitting.")
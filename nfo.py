@@ -0,0 +1,130 @@
+"""
+NFO Reader.
+Reads each NFO once and returns an NfoRecord with its fields, IMDB ID,
+validity and parse error. Records are cached in a DiskCache keyed by path,
+mtime and size, so the movie lookup, the IMDB link search and the badnfo list
+share one parse per run and unchanged NFOs aren't parsed again on later runs.
+Scene NFOs that aren't XML come back as invalid records (still carrying any
+IMDB link) instead of raising.
+"""
+import os
+import re
+import codecs
+import sqlite3
+import threading
+import cStringIO
+from elementtree import ElementTree
+from util import log
+from diskcache import DiskCache
+from profiler import profiler
+
+NFO_CACHE_PATH = '~/.videocleaner/nfo.db'              # Default cache location
+NFO_CACHE_SIZE = 50000                                 # Max records before LRU eviction
+CACHE_VERSION  = 2                                     # Bump when NfoRecord changes
+NFO_FIELDS     = ['title', 'year', 'country', 'aka', 'imdbupdate', 'trailerurl']
+NFO_FIELD_PATH = '//movie/%s'                          # Where the fields live in the XML
+IMDB_ID_REGEX  = r'imdb\.com/title/tt(\d+)'            # IMDB link anywhere in the NFO
+NFO_BOMS       = [(codecs.BOM_UTF8, 'utf-8'), (codecs.BOM_UTF16_LE, 'utf-16-le'), (codecs.BOM_UTF16_BE, 'utf-16-be')]
+
+
+class NfoRecord:
+    """ Everything read from a single NFO file. """
+
+    def __init__(self, path):
+        self.path   = path          # Path to the NFO file
+        self.fields = {}            # NFO_FIELDS name -> text (missing fields are None)
+        self.imdbId = None          # First IMDB movieID linked in the file
+        self.valid  = False         # True if the file parsed as XML
+        self.error  = None          # Why the file isn't valid
+
+    def __str__(self):
+        return "<NfoRecord: %s (valid: %s, imdb: %s)>" % (self.path, self.valid, self.imdbId)
+
+
+class NfoReader:
+    """ Parses NFOs into NfoRecords, caching them by path, mtime and size. """
+
+    def __init__(self, cachePath=NFO_CACHE_PATH, maxEntries=NFO_CACHE_SIZE):
+        self.cachePath  = cachePath          # SQLite file (None disables the disk cache)
+        self.maxEntries = maxEntries         # Max records before LRU eviction
+        self._records   = {}                 # Cache key -> NfoRecord read this run
+        self._cache     = None               # DiskCache (opened on first use)
+        self._cachePid  = None               # Process the DiskCache was opened in
+        self._lock      = threading.Lock()
+
+    def configure(self, cachePath=NFO_CACHE_PATH):
+        """ Change the cache file (before first use). None disables the disk cache. """
+        self.cachePath = cachePath or None
+
+    def _getCache(self):
+        """ Return the DiskCache, opening it on first use in this process (lock must be held). """
+        if (self.cachePath) and (self._cachePid != os.getpid()):
+            self._cache, self._cachePid = DiskCache(self.cachePath, None, self.maxEntries), os.getpid()
+        return self._cache
+
+    def read(self, nfoPath, st=None):
+        """ Return the NfoRecord for nfoPath.
+            @param st: os.stat result for nfoPath if already known
+        """
+        try:
+            st = st or os.stat(nfoPath)
+        except OSError, e:
+            record = NfoRecord(nfoPath)
+            record.error = str(e)
+            return record
+        key = "v%s:%s:%s:%s" % (CACHE_VERSION, nfoPath, st.st_mtime, st.st_size)
+        with self._lock:
+            if (key in self._records):
+                profiler.count('nfo.memory.hits')
+                return self._records[key]
+            try:
+                cache = self._getCache()
+                record = cache.get(key) if (cache) else None
+            except (sqlite3.Error, EnvironmentError), e:
+                log.finer("  NFO cache unavailable: %s", e)
+                cache, record = None, None
+        if (record):
+            profiler.count('nfo.cache.hits')
+        else:
+            with profiler.stage('nfo.parse'):
+                record = self._parse(nfoPath)
+            if (cache):
+                try: cache.set(key, record)
+                except sqlite3.Error, e: log.finer("  NFO cache write failed: %s", e)
+        with self._lock:
+            self._records[key] = record
+        return record
+
+    def _parse(self, nfoPath):
+        """ Read and parse the NFO file into a new NfoRecord. """
+        log.finer("  Reading NFO: %s", nfoPath)
+        record = NfoRecord(nfoPath)
+        try:
+            handle = open(nfoPath, 'rb')
+            data = handle.read()
+            handle.close()
+        except IOError, e:
+            record.error = str(e)
+            return record
+        text = data
+        for bom, encoding in NFO_BOMS:
+            if (data.startswith(bom)):
+                text = data[len(bom):].decode(encoding, 'replace').encode('utf-8')
+                break
+        match = re.search(IMDB_ID_REGEX, text)
+        if (match): record.imdbId = match.group(1)
+        if (not text.lstrip().startswith('<')):
+            record.error = "Not an XML file"
+            return record
+        try:
+            tree = ElementTree.parse(cStringIO.StringIO(data))
+        except Exception, e:
+            record.error = str(e)
+            return record
+        for field in NFO_FIELDS:
+            record.fields[field] = tree.findtext(NFO_FIELD_PATH % field)
+        record.valid = True
+        return record
+
+# Shared reader used by Video and Movie
+nfoReader = NfoReader()
@@ -0,0 +1,96 @@
+"""
+Scraped Page Cache.
+Conditional GET cache for the pages util.getHtml() and util.scanHtml() fetch
+(TrailerAddict search and movie pages, fvar.php responses, YouTube searches).
+Bodies are kept in a DiskCache along with their ETag and Last-Modified
+validators. Within the freshness window a page is served straight from disk;
+after that it is revalidated with If-None-Match / If-Modified-Since, so an
+unchanged page costs a 304 instead of a download. The cache is bounded by the
+total size of the stored pages.
+
+Enable it by setting util.http.cache (see moviecleaner --pagecache). It is off
+by default: pages are stored whole, so with the cache on util.scanHtml() can't
+stop reading a page after the last match it needs.
+"""
+import os
+import time
+import sqlite3
+import threading
+from util import log
+from diskcache import DiskCache
+from profiler import profiler
+
+PAGE_CACHE_PATH  = '~/.videocleaner/pages.db'    # Default cache location
+PAGE_FRESH       = 24 * 60 * 60                  # Seconds to serve a page without revalidating
+PAGE_CACHE_BYTES = 64 * 1048576                  # Max total size of the cached pages
+CACHE_VERSION    = 1                             # Bump when the stored entries change
+
+
+class PageCache:
+    """ Conditional GET cache in front of an HttpClient (see module docs). """
+
+    def __init__(self, client, cachePath=PAGE_CACHE_PATH, fresh=PAGE_FRESH, maxBytes=PAGE_CACHE_BYTES):
+        self.client      = client                  # HttpClient pages are fetched with
+        self.cachePath   = cachePath               # SQLite file
+        self.fresh       = fresh                   # Seconds to serve a page without revalidating
+        self.maxBytes    = maxBytes                # Max total size before LRU eviction
+        self.hits        = 0                       # Pages served from disk without a request
+        self.revalidated = 0                       # Pages the server said were unchanged (304)
+        self.misses      = 0                       # Pages downloaded
+        self._cache      = None                    # DiskCache (opened on first use)
+        self._cachePid   = None                    # Process the DiskCache was opened in
+        self._lock       = threading.Lock()
+
+    def __str__(self):
+        return "<PageCache: %s (%s hits, %s revalidated, %s misses)>" % (self.cachePath, self.hits, self.revalidated, self.misses)
+
+    def _getCache(self):
+        """ Return the DiskCache, opening it on first use in this process. """
+        with self._lock:
+            if (self._cachePid != os.getpid()):
+                self._cache, self._cachePid = DiskCache(self.cachePath, None, None, self.maxBytes), os.getpid()
+            return self._cache
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+        profiler.count("pages.%s" % name)
+
+    def get(self, url):
+        """ Return the body for url, from disk while fresh, otherwise
+            revalidated or downloaded (and stored when the response allows it).
+        """
+        key = "v%s:%s" % (CACHE_VERSION, url)
+        try:
+            cache = self._getCache()
+            entry = cache.get(key)
+        except (sqlite3.Error, EnvironmentError), e:
+            log.finer("  Page cache unavailable: %s", e)
+            cache, entry = None, None
+        if (entry) and (entry['checked'] + self.fresh > time.time()):
+            log.finer("  Page cache hit: %s", url)
+            self._count('hits')
+            return entry['body']
+        # Ask the server, sending the validators we have
+        headers = {}
+        if (entry) and (entry['etag']): headers['If-None-Match'] = entry['etag']
+        if (entry) and (entry['lastModified']): headers['If-Modified-Since'] = entry['lastModified']
+        response = self.client.open(url, headers)
+        try:
+            body = response.read()
+        finally:
+            response.close()
+        if (entry) and (response.status == 304):
+            log.finer("  Page unchanged: %s", url)
+            self._count('revalidated')
+            entry['checked'] = time.time()
+        else:
+            self._count('misses')
+            entry = None
+            if (response.status == 200) and ('no-store' not in response.headers.get('cache-control', '')):
+                entry = {'body': body, 'checked': time.time(), 'etag': response.headers.get('etag'),
+                    'lastModified': response.headers.get('last-modified')}
+        if (cache) and (entry):
+            try: cache.set(key, entry)
+            except sqlite3.Error, e: log.finer("  Page cache write failed: %s", e)
+        return entry['body'] if (entry) else body
@@ -3,6 +3,7 @@ Search and Download Trailers from TrailerAddict
 """
 import re
 import util
+from profiler import profiler
 log = util.log
 
 TABASE_URL     = 'http://traileraddict.com{{path}}'
@@ -12,17 +13,24 @@ MOVIE_REGEX    = r'<a href="(/trailer/{{tag}}/.*?)">.*?</a>'
 VIDEONUM_REGEX = r'<param name="movie" value="http://www.traileraddict.com/emb/(\d+)">'
 FLASH_URL      = r'http://www.traileraddict.com/fvar.php?tid={{videonum}}'
 FLASH_REGEX    = r'fileurl=(.+?.flv)&'
+MAX_RESULTS    = 10     # Search results to read before closing the page
 
+# Precompiled patterns (MOVIE_REGEX depends on the movie)
+SEARCH_PATTERN   = re.compile(SEARCH_REGEX)
+VIDEONUM_PATTERN = re.compile(VIDEONUM_REGEX)
+FLASH_PATTERN    = re.compile(FLASH_REGEX)
 
-def search(title):
+
+def search(title, maxResults=MAX_RESULTS):
     """ Search for the specified movie.
         @param title: Title of the movie to search for
+        @param maxResults: Stop reading the search page after this many results
     """
     # Fetch the HTML for the search page
     query = title.replace(" ", "+")
     searchUrl = SEARCH_URL.replace('{{query}}', query)
-    searchHtml = util.getHtml(searchUrl)
-    results = re.findall(SEARCH_REGEX, searchHtml)
+    with profiler.stage('traileraddict.search'):
+        results = [m.groups() for m in util.scanHtml(searchUrl, SEARCH_PATTERN, maxResults)]
     # Parse and return the search results
     searchResults = []
     for result in results:
@@ -39,9 +47,9 @@ def getTrailerUrls(movieUrl):
         @param movieUrl: URL to movie info on TrailerAddict
     """
     tag = movieUrl.split('/')[-1]
-    movieHtml = util.getHtml(movieUrl)   
-    movieRegex = MOVIE_REGEX.replace('{{tag}}', tag)
-    results = re.findall(movieRegex, movieHtml)
+    moviePattern = re.compile(MOVIE_REGEX.replace('{{tag}}', re.escape(tag)))
+    with profiler.stage('traileraddict.trailers'):
+        results = [m.group(1) for m in util.scanHtml(movieUrl, moviePattern)]
     trailerUrls = map(lambda r: TABASE_URL.replace('{{path}}', r), results)
     return list(set(trailerUrls))  # Remove Duplicates
 
@@ -54,14 +62,13 @@ def getMainTrailer(trailerResults):
     return None
 
 
-def downloadTrailer(trailerUrl, filePath):
+def downloadTrailer(trailerUrl, filePath, progress=None):
     """ Download the specified trailer.
         @param trailerUrl: Trailer URL (ex: /trailer/the-terminal/trailer)
         @param filePath: Path to save trailer
+        @param progress: Optional progress function (see util.downloadFile)
     """
-    trailerHtml = util.getHtml(trailerUrl)
-    videoNumbers = re.findall(VIDEONUM_REGEX, trailerHtml)
+    videoNumbers = [m.group(1) for m in util.scanHtml(trailerUrl, VIDEONUM_PATTERN, 1)]
     flashUrl = FLASH_URL.replace('{{videonum}}', videoNumbers[0])
-    flashResponse = util.getHtml(flashUrl)
-    fileUrl = re.findall(FLASH_REGEX, flashResponse)[0]
-    util.downloadFile(fileUrl, filePath)
+    fileUrl = [m.group(1) for m in util.scanHtml(flashUrl, FLASH_PATTERN, 1)][0]
+    util.downloadFile(fileUrl, filePath, progress)
@@ -3,6 +3,7 @@ Search and Download Trailers from YouTube
 """
 import re
 import util
+from profiler import profiler
 log = util.log
 
 SEARCH_URL     = "http://video.google.com/videosearch?q=site%3Ayoutube.com+{{query}}+trailer&emb=0&aq=f"
@@ -10,18 +11,23 @@ SEARCH_REGEX   = r'<div class=rl-title>.*?<a href=(.+?)\s.*?>(.+?)</a>.*?<div cl
 ID_REGEX       = r'\?.*?v=(.+?)(&.*?)*$'
 T_PARAM_REGEX  = r', "t": "([^"]+)"'
 VIDEO_URL      = "http://www.youtube.com/get_video?video_id=%s&t=%s"
+MAX_RESULTS    = 10     # Search results to read before closing the page
 
+# Precompiled patterns (the search page is matched with its lines joined)
+SEARCH_PATTERN  = re.compile(SEARCH_REGEX)
+T_PARAM_PATTERN = re.compile(T_PARAM_REGEX)
 
-def search(title):
+
+def search(title, maxResults=MAX_RESULTS):
     """ Search for the specified movie.
         @param title: Title of the movie to search for
+        @param maxResults: Stop reading the search page after this many results
     """
     # Fetch the HTML for the search page
     query = title.replace(" ", "+")
     searchUrl = SEARCH_URL.replace('{{query}}', query)
-    searchHtml = util.getHtml(searchUrl)
-    searchHtml = searchHtml.replace("\n", "")
-    results = re.findall(SEARCH_REGEX, searchHtml)
+    with profiler.stage('youtube.search'):
+        results = [m.groups() for m in util.scanHtml(searchUrl, SEARCH_PATTERN, maxResults, joinLines=True)]
     # Parse and return the search results
     searchResults = []
     for result in results:
@@ -33,13 +39,13 @@ def search(title):
     return searchResults
 
 
-def downloadTrailer(trailerUrl, filePath):
+def downloadTrailer(trailerUrl, filePath, progress=None):
     """ Download the specified trailer.
         @param trailerUrl: Trailer URL (ex: /trailer/the-terminal/trailer)
         @param filePath: Path to save trailer
+        @param progress: Optional progress function (see util.downloadFile)
     """
-    videoHtml = util.getHtml(trailerUrl)
     videoId = re.findall(ID_REGEX, trailerUrl)[0][0]
-    tParam = re.findall(T_PARAM_REGEX, videoHtml)[0]
+    tParam = [m.group(1) for m in util.scanHtml(trailerUrl, T_PARAM_PATTERN, 1)][0]
     fileUrl = VIDEO_URL % (videoId, tParam)
-    util.downloadFile(fileUrl, filePath)
+    util.downloadFile(fileUrl, filePath, progress)
@@ -0,0 +1,356 @@
+"""
+Video Container Probe.
+Reads the codec, resolution and duration of AVI (RIFF), MKV (EBML) and MP4
+(ISO base media) files from their headers in pure Python, without spawning
+ffprobe. Only the header structures are read: the AVI hdrl list, the MKV
+segment elements before the first cluster and the MP4 moov box (found by
+skipping over mdat), so a probe costs a few small reads whatever the size of
+the file. Results are cached in a DiskCache keyed by path, mtime and size.
+
+Probe Result:
+  {'container': 'mkv', 'codec': 'h264', 'width': 1280, 'height': 720,
+   'resolution': '720p', 'duration': 6120.5}
+  Fields that couldn't be read are None. Unknown formats give {}.
+"""
+import os
+import struct
+import sqlite3
+import threading
+from util import log
+from diskcache import DiskCache
+from profiler import profiler
+
+PROBE_CACHE_PATH = '~/.videocleaner/probe.db'      # Default cache location
+PROBE_CACHE_SIZE = 200000                          # Max results before LRU eviction
+PROBE_MAX_HEADER = 16 * 1048576                    # Largest header structure read into memory
+CACHE_VERSION    = 1                               # Bump when the probe results change
+
+# Codec identifiers to codec tags
+AVI_CODECS  = {'xvid':'xvid', 'divx':'divx', 'dx50':'divx', 'div3':'divx', 'div4':'divx', 'h264':'h264',
+               'x264':'h264', 'avc1':'h264', 'hevc':'hevc', 'hev1':'hevc', 'hvc1':'hevc'}     # Lowercase fourcc
+MKV_CODECS  = {'V_MPEG4/ISO/AVC':'h264', 'V_MPEGH/ISO/HEVC':'hevc', 'V_MPEG4/ISO/ASP':'mpeg4',
+               'V_MPEG2':'mpeg2', 'V_VP9':'vp9', 'V_AV1':'av1'}
+MP4_CODECS  = {'avc1':'h264', 'avc3':'h264', 'hvc1':'hevc', 'hev1':'hevc', 'mp4v':'mpeg4', 'av01':'av1'}
+CODEC_TAGS  = set(AVI_CODECS.values() + MKV_CODECS.values() + MP4_CODECS.values())
+RESOLUTIONS = [(3800, 2100, '2160p'), (1900, 1060, '1080p'), (1260, 700, '720p')]    # (min width, min height, tag)
+
+# MKV element IDs
+EBML_HEADER   = 0x1A45DFA3
+MKV_SEGMENT   = 0x18538067
+MKV_CLUSTER   = 0x1F43B675
+MKV_INFO      = 0x1549A966
+MKV_SCALE     = 0x2AD7B1
+MKV_DURATION  = 0x4489
+MKV_TRACKS    = 0x1654AE6B
+MKV_TRACK     = 0xAE
+MKV_TYPE      = 0x83
+MKV_CODEC     = 0x86
+MKV_PRIVATE   = 0x63A2
+MKV_VIDEO     = 0xE0
+MKV_WIDTH     = 0xB0
+MKV_HEIGHT    = 0xBA
+
+
+def getResolution(width, height):
+    """ Return the resolution tag (720p, 1080p, 2160p) for the frame size, or None for SD. """
+    for minWidth, minHeight, tag in RESOLUTIONS:
+        if (width >= minWidth) or (height >= minHeight):
+            return tag
+    return None
+
+
+def probeFile(path):
+    """ Return the probe result for the video file at path (see module docs). """
+    handle = open(path, 'rb')
+    try:
+        magic = handle.read(12)
+        size = os.fstat(handle.fileno()).st_size
+        if (magic[0:4] == 'RIFF') and (magic[8:12] == 'AVI '): info = _probeAvi(handle)
+        elif (magic[0:4] == struct.pack('>I', EBML_HEADER)): info = _probeMkv(handle, size)
+        elif (magic[4:8] == 'ftyp'): info = _probeMp4(handle, size)
+        else: return {}
+    finally:
+        handle.close()
+    if (info.get('width')) and (info.get('height')):
+        info['resolution'] = getResolution(info['width'], info['height'])
+    for field in ['codec', 'width', 'height', 'resolution', 'duration']:
+        info.setdefault(field, None)
+    return info
+
+
+def _read(handle, size):
+    """ Read exactly size bytes of a header structure. """
+    if (size < 0):
+        raise ValueError("Invalid header size: %s bytes" % size)
+    if (size > PROBE_MAX_HEADER):
+        raise ValueError("Header structure too large: %s bytes" % size)
+    data = handle.read(size)
+    if (len(data) != size):
+        raise ValueError("Truncated header")
+    return data
+
+
+################################
+#  AVI (RIFF)
+################################
+
+def _riffChunks(data, pos, end):
+    """ Yield (fourcc, bodyStart, bodyEnd) for the RIFF chunks in data[pos:end]. """
+    while (pos + 8 <= end):
+        fourcc, size = data[pos:pos+4], struct.unpack('<I', data[pos+4:pos+8])[0]
+        yield fourcc, pos + 8, min(pos + 8 + size, end)
+        pos += 8 + size + (size & 1)
+
+
+def _probeAvi(handle):
+    """ Read the avih main header and the first video stream header from the hdrl list. """
+    info = {'container': 'avi'}
+    chunk = handle.read(12)
+    if (chunk[0:4] != 'LIST') or (chunk[8:12] != 'hdrl'):
+        return info
+    listSize = struct.unpack('<I', chunk[4:8])[0]
+    if (listSize < 4):
+        raise ValueError("Truncated header")
+    data = _read(handle, listSize - 4)
+    microSecs, totalFrames = 0, 0
+    for fourcc, start, end in _riffChunks(data, 0, len(data)):
+        if (fourcc == 'avih'):
+            fields = struct.unpack('<10I', data[start:start+40])
+            microSecs, totalFrames = fields[0], fields[4]
+            info['width'], info['height'] = fields[8], fields[9]
+        elif (fourcc == 'LIST') and (data[start:start+4] == 'strl') and ('codec' not in info):
+            streamType, handler, compression = None, None, None
+            for subFourcc, subStart, subEnd in _riffChunks(data, start + 4, end):
+                if (subFourcc == 'strh'): streamType, handler = data[subStart:subStart+4], data[subStart+4:subStart+8]
+                elif (subFourcc == 'strf'): compression = data[subStart+16:subStart+20]
+            if (streamType == 'vids'):
+                info['codec'] = AVI_CODECS.get((compression or '').lower()) or AVI_CODECS.get((handler or '').lower())
+        elif (fourcc == 'LIST') and (data[start:start+4] == 'odml'):
+            for subFourcc, subStart, subEnd in _riffChunks(data, start + 4, end):
+                if (subFourcc == 'dmlh'): totalFrames = struct.unpack('<I', data[subStart:subStart+4])[0]
+    if (microSecs) and (totalFrames):
+        info['duration'] = round(totalFrames * microSecs / 1000000.0, 1)
+    return info
+
+
+################################
+#  MKV (EBML)
+################################
+
+def _vintLength(firstByte):
+    """ Return the length in bytes of the EBML variable size integer starting with firstByte. """
+    for length in range(1, 9):
+        if (firstByte & (0x80 >> (length - 1))):
+            return length
+    raise ValueError("Invalid EBML integer")
+
+
+def _readElementHeader(handle):
+    """ Read an element header from the file, returning (id, size); size is None if unknown. """
+    data = handle.read(1)
+    if (not data): return None, None
+    idData = data + handle.read(_vintLength(ord(data)) - 1)
+    data = handle.read(1)
+    if (not data): return None, None
+    length = _vintLength(ord(data))
+    sizeData = chr(ord(data) & (0xFF >> length)) + handle.read(length - 1)
+    size = int(sizeData.encode('hex'), 16)
+    if (size == (1 << (7 * length)) - 1): size = None
+    return int(idData.encode('hex'), 16), size
+
+
+def _ebmlElements(data, pos, end):
+    """ Yield (id, bodyStart, bodyEnd) for the EBML elements in data[pos:end]. """
+    while (pos < end):
+        idLength = _vintLength(ord(data[pos]))
+        elementId = int(data[pos:pos+idLength].encode('hex'), 16)
+        pos += idLength
+        length = _vintLength(ord(data[pos]))
+        size = int((chr(ord(data[pos]) & (0xFF >> length)) + data[pos+1:pos+length]).encode('hex'), 16)
+        pos += length
+        yield elementId, pos, min(pos + size, end)
+        pos += size
+
+
+def _ebmlUint(data, start, end):
+    return int(data[start:end].encode('hex') or '0', 16)
+
+
+def _probeMkv(handle, fileSize):
+    """ Read the Info and Tracks elements of the segment, stopping at the first cluster. """
+    info = {'container': 'mkv'}
+    handle.seek(0)
+    elementId, size = _readElementHeader(handle)
+    if (elementId != EBML_HEADER) or (size is None):
+        return info
+    handle.seek(size, 1)
+    elementId, size = _readElementHeader(handle)
+    if (elementId != MKV_SEGMENT):
+        return info
+    segmentEnd = handle.tell() + size if (size is not None) else fileSize
+    scale, duration = 1000000, None
+    while (handle.tell() < segmentEnd) and (('codec' not in info) or (duration is None)):
+        elementId, size = _readElementHeader(handle)
+        if (elementId is None) or (elementId == MKV_CLUSTER) or (size is None):
+            break
+        if (elementId not in (MKV_INFO, MKV_TRACKS)):
+            handle.seek(size, 1)
+            continue
+        data = _read(handle, size)
+        if (elementId == MKV_INFO):
+            for childId, start, end in _ebmlElements(data, 0, len(data)):
+                if (childId == MKV_SCALE): scale = _ebmlUint(data, start, end)
+                elif (childId == MKV_DURATION): duration = struct.unpack('>d' if (end - start == 8) else '>f', data[start:end])[0]
+        else:
+            _readMkvTracks(data, info)
+    if (duration):
+        info['duration'] = round(duration * scale / 1000000000.0, 1)
+    return info
+
+
+def _readMkvTracks(data, info):
+    """ Fill info with the codec and frame size of the first video track. """
+    for trackId, trackStart, trackEnd in _ebmlElements(data, 0, len(data)):
+        if (trackId != MKV_TRACK): continue
+        track = {}
+        for childId, start, end in _ebmlElements(data, trackStart, trackEnd):
+            if (childId == MKV_TYPE): track['type'] = _ebmlUint(data, start, end)
+            elif (childId == MKV_CODEC): track['codec'] = data[start:end].rstrip('\0')
+            elif (childId == MKV_PRIVATE): track['private'] = data[start:end]
+            elif (childId == MKV_VIDEO):
+                for videoId, videoStart, videoEnd in _ebmlElements(data, start, end):
+                    if (videoId == MKV_WIDTH): track['width'] = _ebmlUint(data, videoStart, videoEnd)
+                    elif (videoId == MKV_HEIGHT): track['height'] = _ebmlUint(data, videoStart, videoEnd)
+        if (track.get('type') == 1):
+            info['codec'] = MKV_CODECS.get(track.get('codec'))
+            if (track.get('codec') == 'V_MS/VFW/FOURCC'):
+                info['codec'] = AVI_CODECS.get(track.get('private', '')[16:20].lower())
+            info['width'], info['height'] = track.get('width'), track.get('height')
+            return None
+
+
+################################
+#  MP4 (ISO Base Media)
+################################
+
+def _boxes(data, pos, end):
+    """ Yield (type, bodyStart, bodyEnd) for the boxes in data[pos:end]. """
+    while (pos + 8 <= end):
+        size, boxType = struct.unpack('>I4s', data[pos:pos+8])
+        headerSize = 8
+        if (size == 1):
+            size, headerSize = struct.unpack('>Q', data[pos+8:pos+16])[0], 16
+        elif (size == 0):
+            size = end - pos
+        if (size < headerSize): return
+        yield boxType, pos + headerSize, min(pos + size, end)
+        pos += size
+
+
+def _probeMp4(handle, fileSize):
+    """ Find the moov box (skipping mdat) and read mvhd and the first video trak. """
+    info = {'container': 'mp4'}
+    pos = 0
+    while (pos + 8 <= fileSize):
+        handle.seek(pos)
+        size, boxType = struct.unpack('>I4s', handle.read(8))
+        headerSize = 8
+        if (size == 1):
+            size, headerSize = struct.unpack('>Q', handle.read(8))[0], 16
+        elif (size == 0):
+            size = fileSize - pos
+        if (size < headerSize):
+            break
+        if (boxType == 'moov'):
+            _readMp4Moov(_read(handle, size - headerSize), info)
+            break
+        pos += size
+    return info
+
+
+def _readMp4Moov(data, info):
+    """ Fill info with the duration from mvhd and the codec and size of the first video trak. """
+    for boxType, start, end in _boxes(data, 0, len(data)):
+        if (boxType == 'mvhd'):
+            if (ord(data[start]) == 1): timescale, duration = struct.unpack('>IQ', data[start+20:start+32])
+            else: timescale, duration = struct.unpack('>II', data[start+12:start+20])
+            if (timescale): info['duration'] = round(float(duration) / timescale, 1)
+        elif (boxType == 'trak') and ('codec' not in info):
+            track = {}
+            _readMp4Box(data, start, end, track)
+            if (track.get('handler') == 'vide'):
+                info['codec'] = MP4_CODECS.get(track.get('format'))
+                info['width'], info['height'] = track.get('width'), track.get('height')
+
+
+def _readMp4Box(data, start, end, track):
+    """ Collect the tkhd size, hdlr type and stsd format of a trak into track. """
+    for boxType, boxStart, boxEnd in _boxes(data, start, end):
+        if (boxType == 'tkhd'):
+            width, height = struct.unpack('>II', data[boxEnd-8:boxEnd])
+            track['width'], track['height'] = width >> 16, height >> 16
+        elif (boxType == 'hdlr'):
+            track['handler'] = data[boxStart+8:boxStart+12]
+        elif (boxType == 'stsd'):
+            track['format'] = data[boxStart+12:boxStart+16]
+        elif (boxType in ('mdia', 'minf', 'stbl')):
+            _readMp4Box(data, boxStart, boxEnd, track)
+
+
+################################
+#  Cached Prober
+################################
+
+class Prober:
+    """ Probes video files, caching the results by path, mtime and size. """
+
+    def __init__(self, cachePath=PROBE_CACHE_PATH, maxEntries=PROBE_CACHE_SIZE):
+        self.cachePath  = cachePath          # SQLite file (None disables the cache)
+        self.maxEntries = maxEntries         # Max results before LRU eviction
+        self._cache     = None               # DiskCache (opened on first use)
+        self._cachePid  = None               # Process the DiskCache was opened in
+        self._lock      = threading.Lock()
+
+    def configure(self, cachePath=PROBE_CACHE_PATH):
+        """ Change the cache file (before first use). None disables the cache. """
+        self.cachePath = cachePath or None
+
+    def _getCache(self):
+        """ Return the DiskCache, opening it on first use in this process. """
+        with self._lock:
+            if (self.cachePath) and (self._cachePid != os.getpid()):
+                self._cache, self._cachePid = DiskCache(self.cachePath, None, self.maxEntries), os.getpid()
+            return self._cache
+
+    def probe(self, path, st=None):
+        """ Return the probe result for the video file at path ({} if unknown or unreadable).
+            @param st: os.stat result for path if already known
+        """
+        try:
+            st = st or os.stat(path)
+        except OSError, e:
+            log.fine("  Unable to probe %s: %s", path, e)
+            return {}
+        key = "v%s:%s:%s:%s" % (CACHE_VERSION, path, st.st_mtime, st.st_size)
+        try:
+            cache = self._getCache()
+            info = cache.get(key) if (cache) else None
+        except (sqlite3.Error, EnvironmentError), e:
+            log.finer("  Probe cache unavailable: %s", e)
+            cache, info = None, None
+        if (info is not None):
+            profiler.count('probe.cache.hits')
+            return info
+        try:
+            with profiler.stage('probe'):
+                info = probeFile(path)
+        except (IOError, OSError, ValueError, IndexError, TypeError, struct.error), e:
+            log.fine("  Unable to probe %s: %s", path, e)
+            info = {}
+        if (cache):
+            try: cache.set(key, info)
+            except sqlite3.Error, e: log.finer("  Probe cache write failed: %s", e)
+        return info
+
+# Shared prober used by Video
+prober = Prober()
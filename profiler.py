@@ -0,0 +1,114 @@
+"""
+Run Profiler.
+Wall time and call counts per stage (scanning, NFO parsing, IMDB calls,
+scraping, downloads, renames), counters for bytes transferred and cache hits,
+and the slowest directories. Disabled unless --profile or --profilejson is
+given, in which case stage() and count() cost a dict update each.
+
+Stages nest, so times are inclusive: 'lookup' includes the 'imdb.search' calls
+made during it. Work done in --jobs worker processes is not recorded.
+"""
+import json
+import time
+import threading
+
+PROFILE_TOP_DIRS = 10          # Slowest directories shown in the report
+
+
+class _Stage:
+    """ Context manager timing one pass through a stage. """
+
+    def __init__(self, profiler, name, dirPath):
+        self.profiler = profiler
+        self.name     = name
+        self.dirPath  = dirPath
+
+    def __enter__(self):
+        self.startTime = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.addTime(self.name, time.time() - self.startTime, self.dirPath)
+
+
+class _NullStage:
+    """ Context manager used while profiling is disabled. """
+    def __enter__(self): return self
+    def __exit__(self, *args): pass
+
+
+class Profiler:
+    """ Collects stage timings and counters for the run. """
+
+    def __init__(self):
+        self.enabled   = False
+        self.stages    = {}            # Stage name -> [calls, seconds, max seconds]
+        self.counters  = {}            # Counter name -> value
+        self.dirs      = {}            # dirPath -> {stage name -> seconds}
+        self.startTime = time.time()
+        self._null     = _NullStage()
+        self._lock     = threading.Lock()
+
+    def stage(self, name, dirPath=None):
+        """ Return a context manager timing the stage (for dirPath if given). """
+        if (not self.enabled): return self._null
+        return _Stage(self, name, dirPath)
+
+    def addTime(self, name, seconds, dirPath=None):
+        """ Record one call of the stage taking seconds. """
+        if (not self.enabled): return None
+        with self._lock:
+            stage = self.stages.setdefault(name, [0, 0.0, 0.0])
+            stage[0] += 1
+            stage[1] += seconds
+            stage[2] = max(stage[2], seconds)
+            if (dirPath):
+                dirStages = self.dirs.setdefault(dirPath, {})
+                dirStages[name] = dirStages.get(name, 0.0) + seconds
+
+    def count(self, name, value=1):
+        """ Add value to the counter. """
+        if (not self.enabled): return None
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def getSlowestDirs(self, limit=PROFILE_TOP_DIRS):
+        """ Return [(seconds, dirPath, {stage: seconds})] for the slowest directories. """
+        with self._lock:
+            dirs = [(sum(s.values()), dirPath, dict(s)) for dirPath, s in self.dirs.items()]
+        return sorted(dirs, reverse=True)[0:limit]
+
+    def getReport(self):
+        """ Return the report as lines of text. """
+        lines = ["", "Profile (%.2fs wall time)" % (time.time() - self.startTime)]
+        lines.append("  %-24s %8s %10s %10s %10s" % ('stage', 'calls', 'total s', 'avg ms', 'max ms'))
+        for name, (calls, seconds, maxSeconds) in sorted(self.stages.items(), key=lambda s: -s[1][1]):
+            lines.append("  %-24s %8s %10.3f %10.1f %10.1f" % (name, calls, seconds, seconds / calls * 1000, maxSeconds * 1000))
+        if (self.counters):
+            lines.append("  %-24s %8s" % ('counter', 'value'))
+            for name, value in sorted(self.counters.items()):
+                lines.append("  %-24s %8s" % (name, value))
+        slowest = self.getSlowestDirs()
+        if (slowest):
+            lines.append("  Slowest directories:")
+            for seconds, dirPath, stages in slowest:
+                detail = ', '.join("%s %.2fs" % (n, s) for n, s in sorted(stages.items(), key=lambda s: -s[1]))
+                lines.append("  %8.2fs  %s (%s)" % (seconds, dirPath, detail))
+        return lines
+
+    def saveJson(self, path):
+        """ Write the report to path as JSON. """
+        report = {
+            'wallTime': round(time.time() - self.startTime, 3),
+            'stages': dict((n, {'calls': c, 'seconds': round(s, 4), 'maxSeconds': round(m, 4)})
+                for n, (c, s, m) in self.stages.items()),
+            'counters': self.counters,
+            'slowestDirs': [{'dirPath': d.decode('utf-8', 'replace'), 'seconds': round(s, 4), 'stages': st}
+                for s, d, st in self.getSlowestDirs()],
+        }
+        handle = open(path, 'w')
+        json.dump(report, handle, indent=2)
+        handle.close()
+
+# Shared profiler for the run
+profiler = Profiler()
@@ -0,0 +1,99 @@
+"""
+Metadata and Trailer Providers.
+Registry of the IMDB, TrailerAddict and YouTube backends. Each one stands in
+as a LazyProvider that imports its module (or creates IMDbPY's access object)
+on first use, so runs that never go to the network, like --list, don't pay
+for loading them.
+
+Registered Providers:
+  imdbpy           The imdb (IMDbPY) module
+  imdb             IMDbPY access object for IMDB_BASE_URL (see util.http.rewriteUrl)
+  traileraddict    The parsers.traileraddict module
+  youtube          The parsers.youtube module
+"""
+import sys
+import threading
+import util
+from util import log
+
+IMDB_BASE_URL = 'http://akas.imdb.com/'       # IMDbPY's default site
+
+
+class LazyProvider:
+    """ Stands in for a provider, loading it on first attribute access. """
+
+    def __init__(self, name, load):
+        self._name   = name           # Name the provider is registered as
+        self._load   = load           # Function returning the provider
+        self._target = None           # Loaded provider (None until first use)
+        self._lock   = threading.Lock()
+
+    def __getattr__(self, name):
+        if (name.startswith('__')): raise AttributeError(name)
+        return getattr(self.getTarget(), name)
+
+    def __str__(self):
+        return "<LazyProvider: %s (loaded: %s)>" % (self._name, self.isLoaded())
+
+    def getTarget(self):
+        """ Return the provider, loading it on first use. """
+        if (self._target is None):
+            with self._lock:
+                if (self._target is None):
+                    log.finer("  Loading provider: %s", self._name)
+                    self._target = self._load()
+        return self._target
+
+    def isLoaded(self):
+        """ Return True if the provider has been loaded. """
+        return self._target is not None
+
+    def reset(self):
+        """ Drop the loaded provider so the next use loads it again. """
+        with self._lock:
+            self._target = None
+
+
+################################
+#  Registry
+################################
+
+_providers = {}                   # Name -> LazyProvider
+
+
+def register(name, load):
+    """ Register the provider returned by load() as name, returning its LazyProvider. """
+    _providers[name] = LazyProvider(name, load)
+    return _providers[name]
+
+
+def get(name):
+    """ Return the LazyProvider registered as name. """
+    return _providers[name]
+
+
+def getLoaded():
+    """ Return the sorted names of the providers loaded so far. """
+    return sorted(name for name, provider in _providers.items() if (provider.isLoaded()))
+
+
+def _importModule(moduleName):
+    """ Return a function importing and returning moduleName. """
+    def load():
+        __import__(moduleName)
+        return sys.modules[moduleName]
+    return load
+
+
+def _loadImdb():
+    """ Create the IMDbPY access object, honouring util.http's base URL. """
+    baseUrl = util.http.rewriteUrl(IMDB_BASE_URL)
+    if (baseUrl == IMDB_BASE_URL):
+        return imdbpy.IMDb()
+    return imdbpy.IMDb(imdbURL_base=baseUrl)
+
+
+imdbpy        = register('imdbpy', _importModule('imdb'))
+imdb          = register('imdb', _loadImdb)
+traileraddict = register('traileraddict', _importModule('parsers.traileraddict'))
+youtube       = register('youtube', _importModule('parsers.youtube'))
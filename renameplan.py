@@ -0,0 +1,189 @@
+"""
+Library Rename Planner.
+Collects every rename for the whole library before anything on disk is
+touched, so collisions (two directories mapping to the same newDirName, a
+target that already exists) show up in the plan instead of halfway through a
+run. Directories with a conflict are left out of the plan entirely. The plan
+is saved for review and applied later in one pass, with every completed
+rename written to a journal so an interrupted apply can be resumed or rolled
+back.
+
+Plan File Format (JSON):
+  [{"dirPath": "...", "src": "...", "dst": "...", "conflict": null}, ...]
+  A src of null means dst is a directory to create.
+
+Journal Format (<plan>.journal):
+  One JSON [src, dst] line per completed rename, in the order they were done,
+  then a "complete" line once every rename without a conflict is done.
+"""
+import os
+import json
+import util
+from util import log
+from util import jsonText
+
+JOURNAL_SUFFIX = '.journal'      # Journal file next to the plan
+JOURNAL_COMPLETE = 'complete'    # Last journal line once the whole plan is applied
+
+
+def _path(value):
+    """ Return a path read from JSON as a filesystem string. """
+    if (isinstance(value, unicode)):
+        return value.encode('utf-8')
+    return value
+
+
+class RenamePlan:
+    """ Every rename planned for the library (see module docs). """
+
+    def __init__(self, path, load=True):
+        """ @param load: Read the existing plan at path (False to start a new one) """
+        self.path        = path                       # JSON file the plan is stored in
+        self.journalPath = path + JOURNAL_SUFFIX      # Journal of completed renames
+        self.entries     = []                         # Planned renames (see module docs)
+        if (load) and (os.path.exists(path)):
+            handle = open(path, 'r')
+            self.entries = json.load(handle)
+            handle.close()
+
+    def add(self, dirPath, renames, created=()):
+        """ Add the (src, dst) renames for a directory (see Video.getRenames).
+            @param created: Paths this run just wrote (the saved NFO); renames onto them are left out
+        """
+        for src, dst in renames:
+            if (dst in created):
+                log.fine("  Keeping the new %s over %s", dst, src)
+                continue
+            self.entries.append({'dirPath': jsonText(dirPath), 'src': jsonText(src), 'dst': jsonText(dst), 'conflict': None})
+
+    def findConflicts(self):
+        """ Mark renames whose target is taken, then every other rename in the
+            same directory. Returns the number of directories in conflict.
+        """
+        sources = {}                  # src -> position in the plan
+        targets = {}                  # dst -> first entry moving there
+        for i in range(len(self.entries)):
+            if (self.entries[i]['src'] is not None):
+                sources[self.entries[i]['src']] = i
+        for i in range(len(self.entries)):
+            entry = self.entries[i]
+            entry['conflict'] = None
+            if (entry['src'] is None): continue
+            dst = entry['dst']
+            if (dst in targets):
+                entry['conflict'] = "Same target as %s" % targets[dst]['src']
+                targets[dst]['conflict'] = targets[dst]['conflict'] or "Same target as %s" % entry['src']
+            elif (os.path.lexists(_path(dst))) and (sources.get(dst, i) >= i):
+                entry['conflict'] = "Target already exists"
+            targets.setdefault(dst, entry)
+        conflictDirs = set(e['dirPath'] for e in self.entries if (e['conflict']))
+        for entry in self.entries:
+            if (entry['dirPath'] in conflictDirs) and (not entry['conflict']):
+                entry['conflict'] = "Skipped: conflict in this directory"
+        return len(conflictDirs)
+
+    def save(self):
+        """ Write the plan to disk (atomically), dropping the journal of a
+            fully applied plan it replaces.
+        """
+        if (self.isApplied()):
+            log.fine("  Removing the journal of the applied plan: %s", self.journalPath)
+            os.remove(self.journalPath)
+        tmpPath = "%s.tmp" % self.path
+        handle = open(tmpPath, 'w')
+        json.dump(self.entries, handle, indent=2)
+        handle.close()
+        os.rename(tmpPath, self.path)
+
+    def logPlan(self):
+        """ Log the plan for review, conflicts first. """
+        conflicts = [e for e in self.entries if (e['conflict'])]
+        for entry in conflicts:
+            log.warn("  Conflict: %s" % util.encode(entry['src'] or entry['dst']))
+            log.warn("            %s" % entry['conflict'])
+        for entry in self.entries:
+            if (entry['conflict']): continue
+            if (entry['src'] is None): log.info("  >> Create Dir: %s" % util.encode(entry['dst']))
+            else: log.info("  >> Rename: %s\n         to: %s" % (util.encode(entry['src']), util.encode(entry['dst'])))
+        log.info("Planned %s renames, %s skipped for conflicts: %s" % (len(self.entries) - len(conflicts), len(conflicts), self.path))
+
+    ####################################
+    #  Apply and Roll Back
+    ####################################
+
+    def _readJournalLines(self):
+        """ Return every line of the journal parsed from JSON. """
+        if (not os.path.exists(self.journalPath)): return []
+        handle = open(self.journalPath, 'r')
+        lines = [json.loads(line) for line in handle if (line.strip())]
+        handle.close()
+        return lines
+
+    def _readJournal(self):
+        """ Return the (src, dst) renames already done, in order. """
+        return [tuple(line) for line in self._readJournalLines() if (line != JOURNAL_COMPLETE)]
+
+    def isApplied(self):
+        """ Return True if the journal shows the whole plan was applied. """
+        lines = self._readJournalLines()
+        return bool(lines) and (lines[-1] == JOURNAL_COMPLETE)
+
+    def isPartial(self):
+        """ Return True if the journal shows an apply that has not finished. """
+        return bool(self._readJournal()) and (not self.isApplied())
+
+    def apply(self):
+        """ Perform every rename without a conflict, skipping the ones the
+            journal says are already done (resuming an interrupted apply).
+        """
+        if (self.isApplied()):
+            return log.info("Plan was already applied: %s" % self.path)
+        done = set(self._readJournal())
+        journal = open(self.journalPath, 'a')
+        applied, skipped = 0, 0
+        try:
+            for entry in self.entries:
+                src, dst = entry['src'], entry['dst']
+                if (entry['conflict']) or ((src, dst) in done): continue
+                srcPath, dstPath = _path(src), _path(dst)
+                if (src is None):
+                    if (os.path.exists(dstPath)): continue
+                    log.info("  >> Creating Dir: %s" % dstPath)
+                    os.mkdir(dstPath, 0755)
+                elif (not os.path.lexists(srcPath)) and (os.path.lexists(dstPath)):
+                    log.fine("  Already renamed: %s", srcPath)   # Done before the journal was written
+                elif (os.path.lexists(dstPath)):
+                    log.warn("  Path already exists: %s" % dstPath)
+                    skipped += 1
+                    continue
+                else:
+                    log.info("  >> Renaming: %s" % srcPath)
+                    log.info("           to: %s" % dstPath)
+                    os.rename(srcPath, dstPath)
+                    applied += 1
+                journal.write("%s\n" % json.dumps([src, dst]))
+                journal.flush()
+            if (not skipped):
+                journal.write("%s\n" % json.dumps(JOURNAL_COMPLETE))
+        finally:
+            os.fsync(journal.fileno())
+            journal.close()
+        log.info("Applied %s renames (%s skipped): %s" % (applied, skipped, self.journalPath))
+
+    def rollback(self):
+        """ Undo every rename in the journal, newest first, then remove it. """
+        done = self._readJournal()
+        for src, dst in reversed(done):
+            srcPath, dstPath = _path(src), _path(dst)
+            if (src is None):
+                if (os.path.isdir(dstPath)) and (not os.listdir(dstPath)):
+                    log.info("  >> Removing Dir: %s" % dstPath)
+                    os.rmdir(dstPath)
+            elif (os.path.lexists(dstPath)) and (not os.path.lexists(srcPath)):
+                log.info("  >> Restoring: %s" % srcPath)
+                os.rename(dstPath, srcPath)
+            else:
+                log.warn("  Unable to restore: %s" % srcPath)
+        if (os.path.exists(self.journalPath)):
+            os.remove(self.journalPath)
+        log.info("Rolled back %s renames: %s" % (len(done), self.path))
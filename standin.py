@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Local Stand-in Server for IMDB, TrailerAddict and YouTube.
+
+  Serves recorded responses so the lookup pipeline can be load tested and
+  regression tested on a machine with no network. Point MovieCleaner at it
+  with --baseurl; every request for http://host/path?query is then sent to
+  <baseurl>/host/path?query instead. Latency, errors, dropped connections and
+  throttling can be injected to see how the client behaves under load.
+
+  Recordings Layout
+  -----------------
+    <dir>/<host>/<path>          Body served for the path with any query
+    <dir>/<host>/<path>@<hash>   Body served for one exact query (md5 of the query)
+    <file>.meta                  Optional JSON: {"status": 302, "headers": {...}}
+  Paths ending in / are stored as <path>/index.html. With --record, misses are
+  fetched from the real site and saved under their exact query.
+
+  Example
+  -------
+    python standin.py --record &
+    python moviecleaner.py -b ~/Movies --baseurl http://127.0.0.1:8765 --imdbttl 0 -t
+    python standin.py --latency 300 --jitter 200 --errors 0.05 --throttle 64 &
+"""
+import os
+import md5
+import gzip
+import json
+import time
+import random
+import socket
+import httplib
+import threading
+import cStringIO
+import email.utils
+import SocketServer
+import BaseHTTPServer
+from optparse import OptionParser
+import util
+from util import log
+from util import LOG_LEVELS
+
+RECORD_DIR    = '~/.videocleaner/standin'    # Default recordings location
+STANDIN_PORT  = 8765                         # Default port to listen on
+CHUNK_SIZE    = 8192                         # Bytes per write when throttling
+INDEX_NAME    = 'index.html'                 # File name for paths ending in /
+META_SUFFIX   = '.meta'                      # Sidecar with status and headers
+
+
+################################
+#  Recorded Responses
+################################
+
+class Recordings:
+    """ Responses stored on disk, optionally recording misses from the real sites. """
+
+    def __init__(self, recordDir=RECORD_DIR, record=False):
+        self.recordDir = os.path.abspath(os.path.expanduser(recordDir))
+        self.record    = record           # Fetch and save responses we don't have
+        self._lock     = threading.Lock()
+
+    def _getPaths(self, host, path, query):
+        """ Return (exactPath, anyQueryPath) for the request, or None if it escapes recordDir. """
+        if (path.endswith('/')): path += INDEX_NAME
+        filePath = os.path.normpath("%s/%s/%s" % (self.recordDir, host, path.lstrip('/')))
+        if (not filePath.startswith(self.recordDir + os.sep)):
+            return None
+        return "%s@%s" % (filePath, md5.new(query).hexdigest()), filePath
+
+    def load(self, host, path, query):
+        """ Return (status, headers, body) for the request, or None if not recorded. """
+        paths = self._getPaths(host, path, query)
+        if (not paths): return None
+        for filePath in paths:
+            if (os.path.isfile(filePath)):
+                status, headers = 200, {}
+                if (os.path.exists(filePath + META_SUFFIX)):
+                    meta = json.load(open(filePath + META_SUFFIX))
+                    status, headers = meta.get('status', 200), meta.get('headers', {})
+                if (status == 200):
+                    headers.setdefault('last-modified', email.utils.formatdate(os.path.getmtime(filePath), usegmt=True))
+                return status, headers, open(filePath, 'rb').read()
+        if (self.record):
+            return self._fetch(host, path, query, paths[0])
+        return None
+
+    def _fetch(self, host, path, query, filePath):
+        """ Fetch the request from the real site and save it to filePath. """
+        requestPath = "%s?%s" % (path, query) if (query) else path
+        log.info("  Recording: http://%s%s" % (host, requestPath))
+        conn = httplib.HTTPConnection(host, timeout=util.HTTP_TIMEOUT)
+        try:
+            conn.request('GET', requestPath, headers={'User-Agent': util.MozURLopener.version})
+            response = conn.getresponse()
+            body = response.read()
+        finally:
+            conn.close()
+        headers = {}
+        for name in ('content-type', 'location'):
+            if (response.getheader(name)): headers[name] = response.getheader(name)
+        with self._lock:
+            if (not os.path.exists(os.path.dirname(filePath))):
+                os.makedirs(os.path.dirname(filePath))
+            open(filePath, 'wb').write(body)
+            if (response.status != 200) or (headers):
+                json.dump({'status': response.status, 'headers': headers}, open(filePath + META_SUFFIX, 'w'), indent=2)
+        return response.status, headers, body
+
+
+################################
+#  Stand-in Server
+################################
+
+class StandinHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Hands every GET to StandinServer.serve(). """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.serve(self)
+
+    def log_message(self, format, *args):
+        log.finer("  %s %s", self.address_string(), format % args)
+
+
+class StandinServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Threaded keep-alive server for Recordings with fault injection. """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, recordings, latency=0, jitter=0, errorRate=0, resetRate=0, throttle=None, rateLimit=None):
+        """ @param latency:   Milliseconds to wait before every response
+            @param jitter:    Up to this many extra random milliseconds
+            @param errorRate: Fraction of requests answered with a 503
+            @param resetRate: Fraction of responses cut off half way through
+            @param throttle:  Bytes per second for each response body (None for no limit)
+            @param rateLimit: Requests per second before answering 429 (None for no limit)
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, address, StandinHandler)
+        self.recordings = recordings
+        self.latency    = latency
+        self.jitter     = jitter
+        self.errorRate  = errorRate
+        self.resetRate  = resetRate
+        self.throttle   = throttle
+        self.rateLimit  = rateLimit
+        self.stats      = {}              # Status (or 'reset') -> number of responses
+        self._window    = (0, 0)          # (second, requests in that second) for rateLimit
+        self._lock      = threading.Lock()
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def _isThrottled(self):
+        """ Return True if this request goes over the rateLimit. """
+        if (not self.rateLimit): return False
+        with self._lock:
+            second, requests = self._window
+            now = int(time.time())
+            self._window = (now, requests + 1) if (now == second) else (now, 1)
+            return self._window[1] > self.rateLimit
+
+    def _isNotModified(self, handler, headers):
+        """ Return True if the request's If-None-Match or If-Modified-Since validators still hold. """
+        if (handler.headers.get('if-none-match')):
+            return handler.headers['if-none-match'] == headers['etag']
+        since = email.utils.parsedate_tz(handler.headers.get('if-modified-since', ''))
+        modified = email.utils.parsedate_tz(headers.get('last-modified', ''))
+        return bool(since and modified) and (email.utils.mktime_tz(modified) <= email.utils.mktime_tz(since))
+
+    def serve(self, handler):
+        """ Answer the request: /<host>/<path>?<query>. """
+        path, sep, query = handler.path.partition('?')
+        host, sep, path = path.lstrip('/').partition('/')
+        if (self._isThrottled()):
+            return self._send(handler, 429, {'retry-after': '1'}, 'Too Many Requests\n')
+        if (self.latency) or (self.jitter):
+            time.sleep((self.latency + random.uniform(0, self.jitter)) / 1000.0)
+        if (random.random() < self.errorRate):
+            return self._send(handler, 503, {}, 'Service Unavailable (injected)\n')
+        try:
+            recorded = self.recordings.load(host, '/' + path, query)
+        except (IOError, httplib.HTTPException, socket.error), e:
+            log.warn("  Recording failed for %s: %s" % (handler.path, e))
+            return self._send(handler, 502, {}, "Bad Gateway: %s\n" % e)
+        if (not recorded):
+            log.fine("  Not recorded: %s", handler.path)
+            return self._send(handler, 404, {}, 'Not Recorded\n')
+        status, headers, body = recorded
+        return self._send(handler, status, headers, body)
+
+    def _send(self, handler, status, headers, body):
+        """ Send the response, honouring validators, Range and Accept-Encoding like the real sites. """
+        headers = dict((k.lower(), v) for k, v in headers.items())
+        if (status == 200):
+            headers.setdefault('etag', '"%s"' % md5.new(body).hexdigest())
+        rangeHeader = handler.headers.get('range', '')
+        if (status == 200) and (self._isNotModified(handler, headers)):
+            status, body = 304, ''
+        elif (status == 200) and (rangeHeader.startswith('bytes=')):
+            offset = int(rangeHeader[6:].split('-')[0] or 0)
+            if (offset >= len(body)):
+                headers['content-range'] = "bytes */%s" % len(body)
+                status, body = 416, ''
+            else:
+                headers['content-range'] = "bytes %s-%s/%s" % (offset, len(body)-1, len(body))
+                status, body = 206, body[offset:]
+        elif ('gzip' in handler.headers.get('accept-encoding', '')) and (body):
+            buffer = cStringIO.StringIO()
+            gzipFile = gzip.GzipFile(fileobj=buffer, mode='wb')
+            gzipFile.write(body)
+            gzipFile.close()
+            headers['content-encoding'], body = 'gzip', buffer.getvalue()
+        handler.send_response(status)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header('content-length', str(len(body)))
+        handler.end_headers()
+        if (random.random() < self.resetRate) and (len(body) > 1):
+            self._count('reset')
+            handler.wfile.write(body[0:len(body)/2])
+            handler.wfile.flush()
+            handler.close_connection = 1
+            return None
+        self._count(status)
+        if (not self.throttle):
+            return handler.wfile.write(body)
+        for i in range(0, len(body), CHUNK_SIZE):
+            handler.wfile.write(body[i:i+CHUNK_SIZE])
+            time.sleep(min(CHUNK_SIZE, len(body) - i) / float(self.throttle))
+
+
+def main():
+    parser = OptionParser(description=__doc__.strip())
+    parser.add_option(      "--host",      help="Address to listen on [%default]", default='127.0.0.1')
+    parser.add_option("-p", "--port",      help="Port to listen on [%default]", type='int', default=STANDIN_PORT)
+    parser.add_option("-d", "--dir",       help="Recordings directory [%default]", default=RECORD_DIR)
+    parser.add_option(      "--record",    help="Fetch and save responses that are not recorded yet", action='store_true', default=False)
+    parser.add_option(      "--latency",   help="Milliseconds to wait before every response [%default]", type='int', default=0)
+    parser.add_option(      "--jitter",    help="Up to this many extra random milliseconds [%default]", type='int', default=0)
+    parser.add_option(      "--errors",    help="Fraction of requests answered with a 503 [%default]", type='float', default=0)
+    parser.add_option(      "--resets",    help="Fraction of responses cut off half way [%default]", type='float', default=0)
+    parser.add_option(      "--throttle",  help="KB/s for each response body, 0 for no limit [%default]", type='int', default=0)
+    parser.add_option(      "--ratelimit", help="Requests per second before answering 429, 0 for no limit [%default]", type='int', default=0)
+    parser.add_option("-l", "--log",       help="Log level: INFO, FINE, FINER", default='INFO')
+    opts, args = parser.parse_args()
+    log.level = LOG_LEVELS[opts.log]
+    recordings = Recordings(opts.dir, opts.record)
+    server = StandinServer((opts.host, opts.port), recordings, opts.latency, opts.jitter, opts.errors,
+        opts.resets, opts.throttle * 1024 or None, opts.ratelimit or None)
+    log.info("Serving %s on http://%s:%s/" % (recordings.recordDir, opts.host, opts.port))
+    try:
+        server.serve_forever()
+    finally:
+        log.info("Responses: %s" % ', '.join("%s=%s" % item for item in sorted(server.stats.items())))
+
+
+if (__name__ == "__main__"):
+    try:
+        main()
+    except KeyboardInterrupt:
+        log.severe("\nKeyboard Interrupt: quitting.")
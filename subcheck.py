@@ -0,0 +1,111 @@
+"""
+Subtitle Integrity Checks.
+Finds subtitles that would break during playback: truncated or misnumbered
+SRT files, SRT cues going back in time, and VobSub idx files with bad
+timestamps or filepos offsets that don't point at an MPEG pack in the .sub.
+Files are read a line at a time and .sub files are memory mapped, so only
+the bytes being checked are ever loaded, whatever the size of the file.
+
+Each check returns why the file is corrupt, or None if it looks fine.
+"""
+import os
+import re
+import mmap
+import codecs
+
+SRT_TIME_REGEX = re.compile(r'(\d+):(\d\d):(\d\d)[,.](\d{1,3})\s*-->\s*(\d+):(\d\d):(\d\d)[,.](\d{1,3})')
+IDX_TIME_REGEX = re.compile(r'timestamp:\s*(\d+):(\d\d):(\d\d):(\d{1,3}),\s*filepos:\s*([0-9a-fA-F]+)')
+UTF16_BOMS     = [codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE]     # SRT files to read as UTF-16
+PACK_START     = '\x00\x00\x01\xba'                              # MPEG program stream pack header
+
+
+def _getMillis(hours, minutes, seconds, millis):
+    """ Return the timecode parts as milliseconds. """
+    return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(millis.ljust(3, '0'))
+
+
+def _openSrt(path):
+    """ Open the SRT file for reading a line at a time, honouring a UTF-16 BOM. """
+    handle = open(path, 'rb')
+    bom = handle.read(2)
+    handle.close()
+    if (bom in UTF16_BOMS):
+        return codecs.open(path, 'r', 'utf-16')
+    return open(path, 'rb')
+
+
+def checkSrt(path):
+    """ Check the SRT file: cues numbered 1, 2, 3.., each with a valid timing
+        line, no cue ending before it starts or starting before the previous
+        one, and the last cue complete.
+    """
+    expected, lastStart, state, textLines = 1, -1, 'number', 0
+    handle = _openSrt(path)
+    try:
+        for lineNum, line in enumerate(handle):
+            line = line.strip().lstrip(u'\ufeff' if (isinstance(line, unicode)) else codecs.BOM_UTF8)
+            if (state == 'number'):
+                if (not line): continue
+                if (not line.isdigit()):
+                    return "line %s: expected cue %s, found %r" % (lineNum+1, expected, line[0:40])
+                if (int(line) != expected):
+                    return "line %s: cue %s out of sequence (expected %s)" % (lineNum+1, line, expected)
+                state = 'time'
+            elif (state == 'time'):
+                match = SRT_TIME_REGEX.match(line)
+                if (not match):
+                    return "line %s: bad timing for cue %s: %r" % (lineNum+1, expected, line[0:40])
+                start, end = _getMillis(*match.groups()[0:4]), _getMillis(*match.groups()[4:8])
+                if (end < start):
+                    return "line %s: cue %s ends before it starts" % (lineNum+1, expected)
+                if (start < lastStart):
+                    return "line %s: cue %s starts before cue %s" % (lineNum+1, expected, expected-1)
+                lastStart, state, textLines = start, 'text', 0
+            elif (line):
+                textLines += 1
+            else:
+                expected, state = expected + 1, 'number'
+    finally:
+        handle.close()
+    if (state == 'time') or ((state == 'text') and (not textLines)):
+        return "truncated in cue %s" % expected
+    if (expected == 1) and (state == 'number'):
+        return "no cues"
+    return None
+
+
+def checkIdx(idxPath, subPath):
+    """ Check the VobSub idx file against its .sub: every timestamp well
+        formed and not going back in time within a stream, and every filepos
+        inside the .sub at the start of an MPEG pack.
+    """
+    subSize = os.path.getsize(subPath)
+    subHandle, subMap = None, None
+    lastTime = -1
+    handle = open(idxPath, 'rb')
+    try:
+        for lineNum, line in enumerate(handle):
+            if (line.startswith('id:')):
+                lastTime = -1                   # New language stream, timestamps start over
+                continue
+            if (not line.startswith('timestamp:')):
+                continue
+            match = IDX_TIME_REGEX.match(line)
+            if (not match):
+                return "line %s: bad timestamp: %r" % (lineNum+1, line.strip()[0:60])
+            timestamp, filePos = _getMillis(*match.groups()[0:4]), int(match.group(5), 16)
+            if (timestamp < lastTime):
+                return "line %s: timestamp goes back in time" % (lineNum+1)
+            lastTime = timestamp
+            if (filePos + len(PACK_START) > subSize):
+                return "line %s: filepos %x past the end of the .sub (%s bytes)" % (lineNum+1, filePos, subSize)
+            if (subMap is None):
+                subHandle = open(subPath, 'rb')
+                subMap = mmap.mmap(subHandle.fileno(), 0, access=mmap.ACCESS_READ)
+            if (subMap[filePos:filePos+len(PACK_START)] != PACK_START):
+                return "line %s: filepos %x is not an MPEG pack in the .sub" % (lineNum+1, filePos)
+    finally:
+        handle.close()
+        if (subMap): subMap.close()
+        if (subHandle): subHandle.close()
+    return None
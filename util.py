@@ -1,11 +1,23 @@
 """
 Various Utility Functions.
 """
+import os
 import re
+import atexit
 import sys
+import json
+import zlib
+import base64
+import stat
+import time
 import codecs
+import socket
 import urllib
+import httplib
+import urlparse
+import threading
 from copy import copy
+from profiler import profiler
 from elementtree import ElementTree
 from xml.dom import minidom
 
@@ -28,6 +40,9 @@ LOG_LEVELS = {
     'VERBOSE': 5,
     'FINER': 6,
 }
+LOG_LEVEL_NAMES    = dict((v, k) for k, v in LOG_LEVELS.items())
+LOG_BUFFER_SIZE    = 65536       # Bytes of output held back when buffered
+LOG_FLUSH_INTERVAL = 1           # Max seconds output is held back when buffered
 
 
 ################################
@@ -39,23 +54,365 @@ class MozURLopener(urllib.FancyURLopener):
 urllib._urlopener = MozURLopener()
 
 
+################################
+#  Pooled HTTP Client
+################################
+
+HTTP_TIMEOUT       = 30          # Seconds to wait on connect or read
+HTTP_POOL_SIZE     = 4           # Idle keep-alive connections kept per host
+HTTP_MAX_REDIRECTS = 5           # Redirects to follow before giving up
+HTTP_CHUNK_SIZE    = 65536       # Bytes per read when streaming
+HTML_CHUNK_SIZE    = 16384       # Bytes per read when scanning HTML (see scanHtml)
+HTML_MATCH_SIZE    = 4096        # Longest match scanHtml finds the same as re.finditer
+MEGABYTE           = 1048576     # 1 megabyte in bytes
+PARTIAL_SUFFIX     = '.part'     # Suffix of downloads in progress
+DOWNLOAD_ATTEMPTS  = 3           # Times to resume a download that broke off
+PROGRESS_INTERVAL  = 10          # Seconds between download progress messages
+
+
+class HttpError(IOError):
+    """ Raised for HTTP error responses where a body is useless (downloads). """
+    pass
+
+
+class HttpResponse:
+    """ Response returned by HttpClient.open(). read() returns decoded data
+        (gzip and deflate are undone) and close() hands the connection back
+        to the pool when the body was read to the end.
+    """
+    def __init__(self, client, poolKey, conn, response, url):
+        self.url       = url                              # Final URL (after redirects)
+        self.status    = response.status                  # HTTP status code
+        self.headers   = dict(response.getheaders())      # Lowercase header names
+        self._client   = client
+        self._poolKey  = poolKey
+        self._conn     = conn
+        self._response = response
+        self._decoder  = None
+        encoding = self.headers.get('content-encoding', '').lower()
+        if (encoding == 'gzip'): self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif (encoding == 'deflate'): self._decoder = _DeflateDecoder()
+        
+    def read(self, size=None):
+        """ Read size bytes of the body (all of it if None) and return them
+            decoded. Only returns '' at the end of the body.
+        """
+        while (True):
+            raw = self._response.read(size) if (size) else self._response.read()
+            if (not self._decoder):
+                return raw
+            data = self._decoder.decompress(raw)
+            if (not size) or (not raw):
+                return data + self._decoder.flush()
+            if (data):
+                return data
+        
+    def close(self):
+        """ Close the response, keeping the connection alive if possible. """
+        if (not self._conn): return None
+        reusable = self._response.isclosed() and (not self._response.will_close)
+        self._client._release(self._poolKey, self._conn, reusable)
+        self._conn = None
+
+
+class _DeflateDecoder:
+    """ Deflate decoder accepting both zlib wrapped and raw streams. """
+    def __init__(self):
+        self._decoder = None
+        
+    def decompress(self, data):
+        if (not self._decoder) and (data):
+            try:
+                self._decoder = zlib.decompressobj()
+                return self._decoder.decompress(data)
+            except zlib.error:
+                self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._decoder.decompress(data) if (self._decoder) else data
+        
+    def flush(self):
+        return self._decoder.flush() if (self._decoder) else ''
+
+
+class HttpClient:
+    """ HTTP client that keeps idle keep-alive connections per host. Like
+        urllib, it honours the http_proxy, https_proxy and no_proxy settings:
+        plain HTTP requests share the connections to the proxy, HTTPS requests
+        are tunnelled through it with CONNECT.
+    """
+    
+    def __init__(self, timeout=HTTP_TIMEOUT, poolSize=HTTP_POOL_SIZE):
+        self.timeout  = timeout          # Seconds to wait on connect or read
+        self.poolSize = poolSize         # Idle connections kept per host
+        self.baseUrl  = None             # Send every request here instead (see rewriteUrl)
+        self.cache    = None             # PageCache for getHtml() and scanHtml() (see pagecache.py)
+        self.proxies  = urllib.getproxies()  # Scheme -> proxy URL
+        self._pool    = {}               # (scheme, host, tunnel host) -> [idle connections]
+        self._lock    = threading.Lock()
+        
+    def setBaseUrl(self, baseUrl):
+        """ Send every request to baseUrl (ex: a local standin.py server) instead
+            of the real hosts. None goes back to the real hosts.
+        """
+        self.baseUrl = baseUrl.rstrip('/') if (baseUrl) else None
+        self.close()
+        
+    def rewriteUrl(self, url):
+        """ Return the URL requests for url are sent to. With a base URL set,
+            http://host/path?query becomes <baseUrl>/host/path?query.
+        """
+        if (not self.baseUrl): return url
+        base = urlparse.urlsplit(self.baseUrl)
+        parts = urlparse.urlsplit(url)
+        if (parts.netloc == base.netloc): return url
+        return urlparse.urlunsplit((base.scheme, base.netloc, "%s/%s%s" % (base.path, parts.netloc, parts.path or '/'), parts.query, ''))
+        
+    def get(self, url, headers=None):
+        """ Return the decoded body of the specified URL. """
+        response = self.open(url, headers)
+        try:
+            return response.read()
+        finally:
+            response.close()
+            
+    def open(self, url, headers=None, compress=True):
+        """ Open the URL and return an HttpResponse, following redirects.
+            @param headers:  Extra request headers
+            @param compress: Ask for a gzip/deflate encoded body
+        """
+        requestHeaders = {'User-Agent': MozURLopener.version}
+        if (compress): requestHeaders['Accept-Encoding'] = 'gzip, deflate'
+        requestHeaders.update(headers or {})
+        for i in range(HTTP_MAX_REDIRECTS + 1):
+            response = self._request(url, requestHeaders)
+            location = response.headers.get('location')
+            if (response.status not in (301, 302, 303, 307)) or (not location):
+                return response
+            response.read()
+            response.close()
+            url = urlparse.urljoin(url, location)
+            log.finer("  Redirected to: %s", url)
+        raise HttpError("Too many redirects: %s" % url)
+        
+    def _getProxy(self, parts):
+        """ Return the split proxy URL to use for the split request URL, or None. """
+        proxy = self.proxies.get(parts.scheme)
+        if (not proxy) or (urllib.proxy_bypass(parts.hostname or '')):
+            return None
+        if ('://' not in proxy): proxy = "http://%s" % proxy
+        return urlparse.urlsplit(proxy)
+        
+    def _proxyHeaders(self, proxy):
+        """ Return the Proxy-Authorization header for credentials in the proxy URL. """
+        if (not proxy.username): return {}
+        credentials = "%s:%s" % (urllib.unquote(proxy.username), urllib.unquote(proxy.password or ''))
+        return {'Proxy-Authorization': "Basic %s" % base64.b64encode(credentials)}
+        
+    def _route(self, url, headers):
+        """ Return (poolKey, path, headers) to send the GET for url with. The
+            poolKey (scheme, host, tunnel host) says where to connect: the
+            origin, the proxy (path is then the absolute URL), or the proxy
+            with a CONNECT tunnel to the origin for HTTPS.
+        """
+        parts = urlparse.urlsplit(url)
+        path = parts.path or '/'
+        if (parts.query): path += '?' + parts.query
+        proxy = self._getProxy(parts)
+        if (not proxy):
+            return (parts.scheme, parts.netloc, None), path, headers
+        proxyHost = proxy.netloc.rpartition('@')[2]
+        if (parts.scheme == 'https'):
+            return ('https', proxyHost, parts.netloc), path, headers
+        headers = dict(headers, **self._proxyHeaders(proxy))
+        return (proxy.scheme, proxyHost, None), urlparse.urlunsplit(parts[0:4] + ('',)), headers
+        
+    def _request(self, url, headers):
+        """ Send a GET request on a pooled connection, retrying once on a stale one. """
+        poolKey, path, headers = self._route(self.rewriteUrl(url), headers)
+        for attempt in range(2):
+            conn, reused = self._acquire(poolKey)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                return HttpResponse(self, poolKey, conn, response, url)
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                if (not reused) or (attempt): raise
+                log.finer("  Stale keep-alive connection to %s: %s", poolKey[1], e)
+                
+    def _acquire(self, poolKey):
+        """ Return (connection, reused) for the host, reusing an idle one if possible. """
+        with self._lock:
+            idle = self._pool.get(poolKey)
+            if (idle): return idle.pop(), True
+        scheme, netloc, tunnel = poolKey
+        profiler.count('http.connections')
+        if (scheme != 'https'): return httplib.HTTPConnection(netloc, timeout=self.timeout), False
+        conn = httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        if (tunnel):
+            proxy = self._getProxy(urlparse.urlsplit("https://%s/" % tunnel))
+            conn.set_tunnel(tunnel, headers=self._proxyHeaders(proxy))
+        return conn, False
+        
+    def _release(self, poolKey, conn, reusable):
+        """ Return the connection to the pool, or close it. """
+        with self._lock:
+            idle = self._pool.setdefault(poolKey, [])
+            if (reusable) and (len(idle) < self.poolSize):
+                idle.append(conn)
+                return None
+        conn.close()
+        
+    def close(self):
+        """ Close every idle connection. """
+        with self._lock:
+            for idle in self._pool.values():
+                for conn in idle: conn.close()
+            self._pool = {}
+
+# Shared client used by getHtml() and downloadFile()
+http = HttpClient()
+
+
 ################################
 #  Basic Utility Functions
 ################################
 
 def getHtml(url):
     """ Return the HTML for the specified URL. """
-    log.finer("  Opening URL: %s" % url)
-    handle = MozURLopener().open(url)
-    html = handle.read()
-    handle.close()
+    log.finer("  Opening URL: %s", url)
+    with profiler.stage('http.get'):
+        html = http.cache.get(url) if (http.cache) else http.get(url)
+    profiler.count('http.bytes', len(html))
     return html
 
 
-def downloadFile(url, filePath):
-    """ Download the specified URL to the local filePath. """
-    log.finer("  Opening URL: %s to %s" % (url, filePath))
-    MozURLopener().retrieve(url, filePath)
+def scanHtml(url, pattern, maxMatches=None, joinLines=False):
+    """ Yield the matches of the compiled pattern in the HTML for the URL,
+        reading the response a chunk at a time. Reading stops (and the
+        connection is closed) after maxMatches, so pages are only downloaded
+        up to the last field needed. A match is only yielded once it ends
+        HTML_MATCH_SIZE bytes before the data read so far, so it can't be cut
+        short by a chunk boundary. With a page cache the whole page is fetched
+        (or served from the cache) and scanned instead.
+        @param joinLines: Remove newlines from the page before matching
+    """
+    if (http.cache):
+        html = getHtml(url)
+        if (joinLines): html = html.replace("\n", "")
+        for i, match in enumerate(pattern.finditer(html)):
+            if (i == maxMatches): return
+            yield match
+        return
+    log.finer("  Scanning URL: %s", url)
+    startTime = time.time()
+    response = http.open(url)
+    html, numBytes, numMatches, done = '', 0, 0, False
+    try:
+        while (not done):
+            data = response.read(HTML_CHUNK_SIZE)
+            numBytes += len(data)
+            html += data.replace("\n", "") if (joinLines) else data
+            done = (not data)
+            safeEnd = len(html) if (done) else len(html) - HTML_MATCH_SIZE
+            keepFrom = 0
+            for match in pattern.finditer(html):
+                if (match.end() > safeEnd):
+                    keepFrom = match.start()
+                    break
+                yield match
+                numMatches += 1
+                keepFrom = match.end()
+                if (numMatches == maxMatches): return
+            else:
+                keepFrom = max(keepFrom, safeEnd)
+            html = html[keepFrom:]
+    finally:
+        response.close()
+        profiler.addTime('http.scan', time.time() - startTime)
+        profiler.count('http.bytes', numBytes)
+
+
+def downloadFile(url, filePath, progress=None):
+    """ Download the specified URL to the local filePath. The data is written to
+        filePath.part, resumed with a Range request if that already exists, and
+        only renamed to filePath once its size matches the Content-Length.
+        @param progress: Optional function(bytesDone, bytesTotal, chunkBytes)
+                         called after every chunk (bytesTotal may be None)
+    """
+    log.finer("  Opening URL: %s to %s", url, filePath)
+    partPath = filePath + PARTIAL_SUFFIX
+    startTime = time.time()
+    startSize = os.path.getsize(partPath) if (os.path.exists(partPath)) else 0
+    with profiler.stage('download'):
+        for attempt in range(DOWNLOAD_ATTEMPTS):
+            try:
+                doneBytes, totalBytes = _downloadPart(url, partPath, progress)
+                break
+            except (httplib.HTTPException, socket.error), e:
+                if (attempt == DOWNLOAD_ATTEMPTS-1): raise
+                log.warn("  Download interrupted (%s), resuming: %s" % (e, url))
+    profiler.count('download.bytes', doneBytes - startSize)
+    if (totalBytes is not None) and (doneBytes != totalBytes):
+        raise HttpError("Incomplete download (%s of %s bytes): %s" % (doneBytes, totalBytes, url))
+    os.rename(partPath, filePath)
+    elapsed = max(time.time() - startTime, 0.001)
+    log.fine("  Downloaded %.1f MB at %.1f KB/s", doneBytes / float(MEGABYTE), (doneBytes - startSize) / 1024.0 / elapsed)
+
+
+def _downloadPart(url, partPath, progress=None):
+    """ Append the rest of url to partPath, return (bytesDone, bytesTotal). """
+    offset = os.path.getsize(partPath) if (os.path.exists(partPath)) else 0
+    headers = {'Range': 'bytes=%s-' % offset} if (offset) else {}
+    response = http.open(url, headers, compress=False)
+    try:
+        totalBytes = None
+        if (response.status == 416) and (offset):
+            if (_getRangeTotal(response.headers) == offset):
+                return offset, offset     # Nothing left to fetch
+            # The partial file doesn't match the remote one; start over
+            log.warn("  Discarding partial download (%s bytes): %s" % (offset, partPath))
+            response.close()
+            os.remove(partPath)
+            return _downloadPart(url, partPath, progress)
+        if (response.status >= 400):
+            raise HttpError("HTTP %s: %s" % (response.status, url))
+        if (response.status == 206):
+            totalBytes = _getRangeTotal(response.headers)
+            mode = 'ab'
+        else:
+            offset, mode = 0, 'wb'     # Server ignored the Range; start over
+            if (response.headers.get('content-length')):
+                totalBytes = int(response.headers['content-length'])
+        if (offset): log.info("  Resuming download at %.1f MB" % (offset / float(MEGABYTE)))
+        handle = open(partPath, mode)
+        try:
+            doneBytes = offset
+            lastLog = time.time()
+            data = response.read(HTTP_CHUNK_SIZE)
+            while (data):
+                handle.write(data)
+                doneBytes += len(data)
+                if (progress): progress(doneBytes, totalBytes, len(data))
+                if (time.time() - lastLog >= PROGRESS_INTERVAL):
+                    lastLog = time.time()
+                    totalStr = "%.1f" % (totalBytes / float(MEGABYTE)) if (totalBytes) else "?"
+                    log.verbose("  Downloaded %.1f of %s MB", doneBytes / float(MEGABYTE), totalStr)
+                data = response.read(HTTP_CHUNK_SIZE)
+        finally:
+            handle.close()
+        if (totalBytes is not None) and (doneBytes < totalBytes):
+            raise httplib.IncompleteRead("%s bytes" % doneBytes, totalBytes - doneBytes)
+        return doneBytes, totalBytes
+    finally:
+        response.close()
+
+
+def _getRangeTotal(headers):
+    """ Return the total size from a Content-Range header (bytes 0-9/10), or None. """
+    contentRange = headers.get('content-range', '')
+    if ('/' in contentRange) and (contentRange.split('/')[-1].isdigit()):
+        return int(contentRange.split('/')[-1])
+    return None
 
 
 def replaceChars(inStr, chars):
@@ -97,6 +454,12 @@ def removePrefixWords(str, words):
             break
     return newStr
 
+def jsonText(value):
+    """ Return value as unicode so it can be written to JSON. """
+    if (isinstance(value, str)):
+        return value.decode('utf-8', 'replace')
+    return value
+
 def promptUser(choices, choiceStr, question=None, maxToShow=20):
     """ Get a response from the user.
         @param choices:     List of choices to display
@@ -104,6 +467,13 @@ def promptUser(choices, choiceStr, question=None, maxToShow=20):
         @param question:    Question to ask the user
     """
     # Display choices to the user
+    log.flush()
+    with profiler.stage('prompt'):
+        return _promptUser(choices, choiceStr, question, maxToShow)
+
+
+def _promptUser(choices, choiceStr, question, maxToShow):
+    """ Display the choices and read the answer (see promptUser). """
     print ""
     validinput = ['']
     for i in range(len(choices)):
@@ -131,6 +501,61 @@ def promptUser(choices, choiceStr, question=None, maxToShow=20):
     return selection
 
 
+################################
+#  Directory Snapshot
+################################
+
+class DirSnapshot:
+    """ Listing of a directory taken once and shared by everything that needs it.
+        Entries are only stat'd the first time their size or type is requested,
+        and sub directories are listed lazily the first time they are asked for.
+    """
+    def __init__(self, dirPath):
+        self.dirPath  = dirPath                 # Directory this snapshot describes
+        self.names    = os.listdir(dirPath)     # Entry names (unsorted, as listed)
+        profiler.count('fs.listdir')
+        self._nameSet = set(self.names)         # Fast membership checks
+        self._stats   = {}                      # Cached os.stat results by name
+        self._subdirs = {}                      # Cached DirSnapshots by name
+        
+    def path(self, name):
+        """ Return the full path to the specified entry. """
+        return "%s/%s" % (self.dirPath, name)
+        
+    def exists(self, name):
+        """ Return True if the entry exists in this directory. """
+        return name in self._nameSet
+        
+    def stat(self, name):
+        """ Return the (cached) os.stat result for the entry or None. """
+        if (name not in self._stats):
+            profiler.count('fs.stat')
+            try: self._stats[name] = os.stat(self.path(name))
+            except OSError: self._stats[name] = None
+        return self._stats[name]
+        
+    def getSize(self, name):
+        """ Return the size of the entry in bytes (0 if it can't be read). """
+        st = self.stat(name)
+        return st.st_size if (st) else 0
+        
+    def isDir(self, name):
+        """ Return True if the entry is a directory. """
+        st = self.stat(name)
+        return bool(st) and stat.S_ISDIR(st.st_mode)
+        
+    def subdir(self, name):
+        """ Return a DirSnapshot for the sub directory, or None if it doesn't exist.
+            An empty name returns this snapshot.
+        """
+        if (not name): return self
+        if (name not in self._subdirs):
+            self._subdirs[name] = None
+            if (self.exists(name)) and (self.isDir(name)):
+                self._subdirs[name] = DirSnapshot(self.path(name))
+        return self._subdirs[name]
+
+
 ################################
 #  ElementTree Helpers
 ################################
@@ -141,7 +566,7 @@ def encode(inStr):
         Python Ref: http://docs.python.org/library/codecs.html
     """
     if (isinstance(inStr, basestring)):
-        return inStr.encode(sys.stdout.encoding, 'xmlcharrefreplace')
+        return inStr.encode(sys.stdout.encoding or 'utf-8', 'xmlcharrefreplace')
     return inStr
 
 
@@ -160,31 +585,130 @@ def escape(text):
 #  Generic Logger Class
 ################################
 
+class JsonLogSink:
+    """ Writes every logged message as a line of JSON (see Logger.sink):
+        {"time", "level", "message", "dir", "stage", "elapsed"}
+    """
+    def __init__(self, path):
+        self.path   = os.path.expanduser(path)
+        self.handle = open(self.path, 'a')
+        
+    def write(self, message, level, dirPath, stage, elapsed):
+        record = {
+            'time': round(time.time(), 3),
+            'level': LOG_LEVEL_NAMES.get(level, level),
+            'message': jsonText(message).strip(),
+            'dir': jsonText(dirPath),
+            'stage': stage,
+            'elapsed': round(elapsed, 3) if (elapsed is not None) else None,
+        }
+        self.handle.write("%s\n" % json.dumps(record))
+        
+    def flush(self):
+        self.handle.flush()
+        
+    def close(self):
+        self.handle.close()
+
+
 class Logger:
-    """ Generic Logger Class """
+    """ Generic Logger Class. Messages may be given as a format string and
+        args (log.fine("  Found: %s", path)) so they are only formatted when
+        the level is logged.
+    """
     def __init__(self):
-        self.level = 3
+        self.level       = 3
+        self.buffered    = False              # Hold output back (see LOG_BUFFER_SIZE)
+        self.sink        = None               # Optional JsonLogSink
+        self._local      = threading.local()  # Per thread capture buffer and context
+        self._buffer     = []                 # Output held back while buffered
+        self._bufferSize = 0
+        self._lastFlush  = time.time()
+        self._timer      = None               # Flushes held back output if nothing else is logged
+        self._lock       = threading.Lock()
             
-    def _print(self, message, level, color):
-        """ Log the message to stdout. """
+    def _print(self, message, level, color, args=()):
+        """ Log the message to stdout (or the capture buffer of this thread). """
         if (self.level >= level):
-            sys.stdout.write(color)
-            try: sys.stdout.write("%s\n" % message)
-            except: sys.stdout.write(encode("%s\n" % message))
-            sys.stdout.write(COLOR_RESET)
-            sys.stdout.flush()
+            if (args): message = message % args
+            capture = getattr(self._local, 'capture', None)
+            if (capture is not None):
+                capture.append((message, level, color))
+                return message
+            self._write(message, level, color)
             return message
+            
+    def _write(self, message, level, color):
+        """ Write the message to stdout (and the sink), buffering if enabled. """
+        if (isinstance(message, unicode)): message = encode(message)
+        line = "%s%s\n%s" % (color, message, COLOR_RESET)
+        with self._lock:
+            if (self.sink):
+                dirPath, stage, started = getattr(self._local, 'context', (None, None, None))
+                self.sink.write(message, level, dirPath, stage, time.time() - started if (started) else None)
+            if (not self.buffered):
+                sys.stdout.write(line)
+                sys.stdout.flush()
+                return None
+            self._buffer.append(line)
+            self._bufferSize += len(line)
+            if (self._bufferSize >= LOG_BUFFER_SIZE) or (time.time() - self._lastFlush >= LOG_FLUSH_INTERVAL):
+                self._flush()
+            elif (not self._timer):
+                # Don't hold output back through a long download or lookup
+                self._timer = threading.Timer(LOG_FLUSH_INTERVAL, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+                
+    def flush(self):
+        """ Write out anything held back (call before prompting the user). """
+        with self._lock:
+            self._flush()
+            
+    def _flush(self):
+        """ Write out the buffer (lock must be held). """
+        if (self._buffer):
+            sys.stdout.write(''.join(self._buffer))
+            sys.stdout.flush()
+            self._buffer, self._bufferSize = [], 0
+        if (self.sink): self.sink.flush()
+        if (self._timer): self._timer.cancel()
+        self._lastFlush, self._timer = time.time(), None
+        
+    def setContext(self, dirPath=None, stage=None):
+        """ Tag the messages this thread logs next with the directory and stage
+            (for the JSON sink). The elapsed time restarts with each directory.
+        """
+        context = getattr(self._local, 'context', (None, None, None))
+        started = context[2] if (dirPath == context[0]) else time.time()
+        self._local.context = (dirPath, stage, started if (dirPath) else None)
+        
+    def startCapture(self):
+        """ Hold back messages logged by this thread until stopCapture(). """
+        self._local.capture = []
+        
+    def stopCapture(self):
+        """ Stop capturing and return the held back messages for replay(). """
+        capture = getattr(self._local, 'capture', None) or []
+        self._local.capture = None
+        return capture
+        
+    def replay(self, records):
+        """ Write messages returned by stopCapture(). """
+        for message, level, color in records:
+            self._write(message, level, color)
     
-    def severe(self, message):   return self._print(message, LOG_LEVELS['SEVERE'],  COLOR_RED)
-    def warn(self, message):     return self._print(message, LOG_LEVELS['WARN'],    COLOR_YELLOW)
-    def title(self, message):    return self._print(message, LOG_LEVELS['TITLE'],   COLOR_BLUE)
-    def info(self, message):     return self._print(message, LOG_LEVELS['INFO'],    COLOR_RESET)
-    def fine(self, message):     return self._print(message, LOG_LEVELS['FINE'],    COLOR_RESET)
-    def verbose(self, message):  return self._print(message, LOG_LEVELS['VERBOSE'], COLOR_PURPLE)
-    def finer(self, message):    return self._print(message, LOG_LEVELS['FINER'],   COLOR_RESET)
+    def severe(self, message, *args):   return self._print(message, LOG_LEVELS['SEVERE'],  COLOR_RED, args)
+    def warn(self, message, *args):     return self._print(message, LOG_LEVELS['WARN'],    COLOR_YELLOW, args)
+    def title(self, message, *args):    return self._print(message, LOG_LEVELS['TITLE'],   COLOR_BLUE, args)
+    def info(self, message, *args):     return self._print(message, LOG_LEVELS['INFO'],    COLOR_RESET, args)
+    def fine(self, message, *args):     return self._print(message, LOG_LEVELS['FINE'],    COLOR_RESET, args)
+    def verbose(self, message, *args):  return self._print(message, LOG_LEVELS['VERBOSE'], COLOR_PURPLE, args)
+    def finer(self, message, *args):    return self._print(message, LOG_LEVELS['FINER'],   COLOR_RESET, args)
 
 # Create the Singleton Logger
 global log
 if (not globals().get('log')):
     log = Logger()
+    atexit.register(log.flush)
     
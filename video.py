@@ -7,7 +7,13 @@ import os
 import re
 import util
 from util import log
-from elementtree import ElementTree
+from nfo import nfoReader
+from profiler import profiler
+from subcheck import checkSrt
+from subcheck import checkIdx
+from fingerprint import fingerprinter
+from probe import prober
+from probe import CODEC_TAGS
 
 VIDEO_TAGS        = ['xvid', 'divx', 'bdrip', 'hdrip', 'dvdrip', 'dvdscr', 'dvd', 'r5', 'scr', 'repack', 'ac3']
 REPLACE_CHARS     = {'&':'and', "'":'', '?':'', ':':' -', ',':'', '!':''}
@@ -19,14 +25,60 @@ SAMPLE_STRING     = 'samp'                                # String to catch samp
 MEGABYTE          = 1048576                               # 1 megabyte in bytes
 MIN_VIDEO_MB      = 100 * MEGABYTE                        # Min size of valid videos (bytes)
 
+# List name to list function
+LIST_FUNCTIONS = {
+    'novideo':    'getNoVideoList',
+    'badnfo':     'getBadNfoList',
+    'nonfo':      'getMissingNfoList',
+    'hassub':     'getHasSubtitleList',
+    'nosub':      'getNoSubtitleList',
+    'suberr':     'getSubtitleErrorList',
+    'subcorrupt': 'getSubtitleCorruptList',
+    'dupes':      'getFingerprintList',
+}
+UNINDEXED_LISTS = ['subcorrupt', 'dupes']     # Lists that read file contents, never stored in the library index
+
+# Attribute computed on first use (probing opens every video file) to the function computing it
+LAZY_ATTRS = {
+    'videoInfo': '_getVideoInfo',
+    'videoTags': '_getVideoTags',
+}
+
+
+def normalizeTitle(title):
+    """ Return the title as compared by Video._weakMatch() (lowercase, no
+        punctuation or leading stop words).
+    """
+    title = title.lower()
+    title = util.replaceChars(title, REPLACE_CHARS)
+    title = util.removePrefixWords(title, STOP_WORDS)
+    if (title.endswith('the')): title = title[0:-3]
+    return title.strip()
+
+
+def scanDirectory(dirPath):
+    """ Return a DirSnapshot of dirPath with everything Video needs already
+        stat'd and listed. Used to scan directories ahead in worker threads.
+    """
+    snapshot = util.DirSnapshot(dirPath)
+    for fileName in snapshot.names:
+        if (fileName.lower().endswith(tuple(VIDEO_EXTENSIONS))):
+            snapshot.stat(fileName)
+    for path in SUBTITLE_DIRS:
+        snapshot.subdir(path)
+    return snapshot
+
 
 class Video:
     """ Represents a video or TV series on Disk. """
+    INDEX_ATTRS = ['curFileNames', 'curNfoName', 'subsFound', 'curTitle', 'curYear', 'extention',
+        'subtitles', 'title', 'year', 'country', 'aka']
     
-    def __init__(self, dirPath):
+    def __init__(self, dirPath, snapshot=None):
         log.title("Processing Directory: %s" % dirPath)
         # Local files and directories
         self.dirPath        = dirPath                    # Directory containing Videos
+        self.snapshot       = snapshot or util.DirSnapshot(dirPath)  # Cached dir listing
         self.curDirName     = os.path.basename(dirPath)  # Current DirName (video title)
         self.curFileNames   = self._getVideoFiles()      # Current AVI FileNames
         self.curNfoName     = self._getNfoFile()         # Current NFO FileName
@@ -35,10 +87,11 @@ class Video:
         self.curTitle       = self._getCurrentTitle()    # Video title pulled from dirName
         self.curYear        = self._getCurrentYear()     # Video year pulled from dirName
         self.extention      = self._getExtention()       # File extention (.avi, .mkv, .iso, etc)
-        self.videoTags      = self._getVideoTags()       # Bits of info like xvid, r5, etc
+        # videoInfo (codec, resolution and duration by FileName) and videoTags
+        # (bits of info like xvid, r5, 720p, etc) are computed on first use.
         self.subtitles      = self._getSubtitles()       # Subtitle files for video
         # New info after parsing NFO or Web
-        self.nfoInfo        = None                       # ElementTree built from curNfoName
+        self.nfoInfo        = None                       # NfoRecord for curNfoName (if valid)
         self.title          = None                       # New Title for the video
         self.year           = None                       # New Year for the video
         self.country        = None                       # New Country for the video
@@ -52,6 +105,14 @@ class Video:
         """ String representation of this object. """
         return "<Video: %s (%s)>" % (self.curTitle, self.curYear)
         
+    def __getattr__(self, name):
+        """ Compute and keep the LAZY_ATTRS the first time they are read. """
+        if (name not in LAZY_ATTRS):
+            raise AttributeError(name)
+        value = getattr(self, LAZY_ATTRS[name])()
+        setattr(self, name, value)
+        return value
+        
     ####################################
     #  Required abstract functions
     ####################################
@@ -67,14 +128,13 @@ class Video:
     def _getVideoFiles(self):
         """ Return the AVI files that make up this video. """
         videoFiles = []
-        for fileName in os.listdir(self.dirPath):
-            filePath = "%s/%s" % (self.dirPath, fileName)
-            test1 = SAMPLE_STRING not in fileName.lower()
-            test2 = os.path.getsize(filePath) >= MIN_VIDEO_MB
-            for ext in VIDEO_EXTENSIONS:
-                test3 = fileName.lower().endswith(ext)
-                if (test1 and test2 and test3):
-                    videoFiles.append(fileName)
+        for fileName in self.snapshot.names:
+            fileNameLCase = fileName.lower()
+            test1 = SAMPLE_STRING not in fileNameLCase
+            test2 = fileNameLCase.endswith(tuple(VIDEO_EXTENSIONS))
+            # Only stat the files that could be videos
+            if (test1 and test2) and (self.snapshot.getSize(fileName) >= MIN_VIDEO_MB):
+                videoFiles.append(fileName)
         if (not videoFiles):
             log.warn("  No video files found for: %s" % self.dirPath)
         return sorted(videoFiles)
@@ -83,15 +143,15 @@ class Video:
         """ Return subtitle files for this video. """
         subtitles = []
         for path in SUBTITLE_DIRS:
-            dirPath = "%s/%s" % (self.dirPath, path)
-            if (os.path.exists(dirPath)):
-                for fileName in os.listdir(dirPath):
+            subdir = self.snapshot.subdir(path)
+            if (subdir):
+                for fileName in subdir.names:
                     if (fileName.endswith('.srt')):
                         self.subsFound = True
                         subtitles.append("%s/%s" % (path, fileName))
                     elif (fileName.endswith('.idx')):
                         self.subsFound = True
-                        if (self._idxSubtitlesOK(dirPath, fileName)):
+                        if (self._idxSubtitlesOK(subdir, fileName)):
                             subtitles.append("%s/%s" % (path, fileName))
                     elif (fileName.endswith('.sub')):
                         self.subsFound = True
@@ -101,18 +161,18 @@ class Video:
             return None
         return sorted(subtitles)
         
-    def _idxSubtitlesOK(self, dirPath, fileName):
+    def _idxSubtitlesOK(self, subdir, fileName):
         """ Return subtitles if the idx, sub names match up, otherwise []. """
-        subPath = "%s/%s.sub" % (dirPath, fileName[0:-4])
-        idxPath = "%s/%s.idx" % (dirPath, fileName[0:-4])
-        if (not os.path.exists(subPath) or not os.path.exists(idxPath)):
-            log.warn("  Subtitle Error: %s/%s" % (dirPath, fileName))
+        subName = "%s.sub" % fileName[0:-4]
+        idxName = "%s.idx" % fileName[0:-4]
+        if (not subdir.exists(subName) or not subdir.exists(idxName)):
+            log.warn("  Subtitle Error: %s" % subdir.path(fileName))
             return False
         return True
         
     def _getNfoFile(self):
         """ Return the first NFO file in the video directory. """
-        for fileName in os.listdir(self.dirPath):
+        for fileName in self.snapshot.names:
             fileNameLCase = fileName.lower()
             if (fileNameLCase.endswith('.nfo')):
                 return fileName
@@ -143,49 +203,62 @@ class Video:
             extention = self.curFileNames[0].split('.')[-1]
         return extention
     
+    def _getVideoInfo(self):
+        """ Return the container probe result for each video file (see probe.py). """
+        videoInfo = {}
+        for fileName in self.curFileNames:
+            videoInfo[fileName] = prober.probe(self.snapshot.path(fileName), self.snapshot.stat(fileName))
+        return videoInfo
+        
     def _getVideoTags(self):
-        """ Return the rip information. """
+        """ Return the rip information: VIDEO_TAGS found as words in the file
+            names, then the codec (unless the names give one) and resolution
+            probed from the files.
+        """
         videoTags = set()
         for fileName in self.curFileNames:
-            fileName = fileName.lower()
-            for infoStr in VIDEO_TAGS:
-                if (infoStr in fileName):
-                    videoTags.add(infoStr)
-                    fileName = fileName.replace(infoStr, '')
-        return list(videoTags)
+            words = re.split(r'[^a-z0-9]+', fileName.lower())
+            videoTags.update(infoStr for infoStr in VIDEO_TAGS if (infoStr in words))
+        videoTags = list(videoTags)
+        for fileName in sorted(self.curFileNames):
+            info = self.videoInfo.get(fileName) or {}
+            if (info.get('codec')) and (not CODEC_TAGS.intersection(videoTags)):
+                videoTags.append(info['codec'])
+            if (info.get('resolution')) and (info['resolution'] not in videoTags):
+                videoTags.append(info['resolution'])
+        return videoTags
+    
+    def _getNfoRecord(self, fileName):
+        """ Return the (cached) NfoRecord for the NFO file in the video directory. """
+        return nfoReader.read(self.snapshot.path(fileName), self.snapshot.stat(fileName))
     
     def _getNfoInfo(self):
-        """ Return ElementTree object if NFO file exists. """
+        """ Return the NfoRecord if a valid NFO file exists. """
         if (self.curNfoName):
-            try:
-                nfoPath = "%s/%s" % (self.dirPath, self.curNfoName)
-                return ElementTree.parse(nfoPath)
-            except Exception, e:
-                log.warn("  Invalid NFO file: %s; %s" % (nfoPath, e))
+            record = self._getNfoRecord(self.curNfoName)
+            if (record.valid): return record
+            log.warn("  Invalid NFO file: %s; %s" % (record.path, record.error))
         return None
     
     def _weakMatch(self, title1, title2):
         """ Return TRUE if the two titles match after some string manipulation. """
-        # Manipulate Title 1
-        title1 = title1.lower()
-        title1 = util.replaceChars(title1, REPLACE_CHARS)
-        title1 = util.removePrefixWords(title1, STOP_WORDS)
-        if (title1.endswith('the')): title1 = title1[0:-3]
-        title1 = title1.strip()
-        # Manipulate Title 2
-        title2 = title2.lower()
-        title2 = util.replaceChars(title2, REPLACE_CHARS)
-        title2 = util.removePrefixWords(title2, STOP_WORDS)
-        if (title2.endswith('the')): title2 = title2[0:-3]
-        title2 = title2.strip()
-        # Return the Comparison
         #log.info("Checking match '%s' and '%s'" % (title1, title2))
-        return title1 == title2
+        return normalizeTitle(title1) == normalizeTitle(title2)
     
     ####################################
     #  List Functions
     ####################################
     
+    def getIndexRecord(self):
+        """ Return everything computed for this video as a dict for the library index. """
+        record = {'attrs':{}, 'lists':{}}
+        for attr in self.INDEX_ATTRS:
+            record['attrs'][attr] = getattr(self, attr)
+        for listName, funcName in LIST_FUNCTIONS.iteritems():
+            if (listName not in UNINDEXED_LISTS):
+                record['lists'][listName] = getattr(self, funcName)()
+        return record
+    
     def getNoVideoList(self):
         """ Return list entry if this directory is missing video files. """
         if (not self.curFileNames):
@@ -195,15 +268,10 @@ class Video:
     def getBadNfoList(self):
         """ Return list entries for any invalid nfos in video dir. """
         nfolist = []
-        for fileName in os.listdir(self.dirPath):
+        for fileName in self.snapshot.names:
             fileNameLCase = fileName.lower()
-            if (fileNameLCase.endswith('.nfo')):
-                nfoPath = "%s/%s" % (self.dirPath, fileName)
-                try:
-                    info = ElementTree.parse(nfoPath)
-                    #assert info.findtext("//movie/title") != "None"
-                except Exception, e:
-                    nfolist.append(nfoPath)
+            if (fileNameLCase.endswith('.nfo')) and (not self._getNfoRecord(fileName).valid):
+                nfolist.append("%s/%s" % (self.dirPath, fileName))
         return nfolist
                     
     def getMissingNfoList(self):
@@ -231,6 +299,40 @@ class Video:
         if (not self.subtitles and self.subsFound):
             return [self.dirPath]
         return []
+        
+    def getSubtitleCorruptList(self):
+        """ Return list entries for each srt or idx file that fails the
+            integrity checks in subcheck.py (reads the files).
+        """
+        corrupt = []
+        for path in SUBTITLE_DIRS:
+            subdir = self.snapshot.subdir(path)
+            if (not subdir): continue
+            for fileName in sorted(subdir.names):
+                subName = "%s.sub" % fileName[0:-4]
+                try:
+                    if (fileName.endswith('.srt')): error = checkSrt(subdir.path(fileName))
+                    elif (fileName.endswith('.idx')) and (subdir.exists(subName)): error = checkIdx(subdir.path(fileName), subdir.path(subName))
+                    else: continue
+                except (IOError, OSError, ValueError), e:
+                    error = str(e)
+                if (error):
+                    log.fine("  Corrupt subtitle %s: %s", subdir.path(fileName), error)
+                    corrupt.append(subdir.path(fileName))
+        return corrupt
+        
+    def getFingerprintList(self):
+        """ Return (filePath, fingerprint, imdbId) entries for each video file.
+            Grouped across directories by moviecleaner to list duplicates.
+        """
+        imdbId = self._getNfoRecord(self.curNfoName).imdbId if (self.curNfoName) else None
+        entries = []
+        for fileName in self.curFileNames:
+            filePath = self.snapshot.path(fileName)
+            fingerprint = fingerprinter.get(filePath, self.snapshot.stat(fileName))
+            if (fingerprint):
+                entries.append((filePath, fingerprint, imdbId))
+        return entries
     
     ####################################
     #  Update New Dir & FileName
@@ -285,59 +387,82 @@ class Video:
     #  Actions to Perform
     ####################################
     
-    def renameFiles(self, skipImdb=False):
-        """ Rename the Video files. """
-        # Make sure we have new FileNames
-        if (not self.newFileNames) or (skipImdb):
-            log.info("  IMDB Information not available: Skipping renameFiles.")
-            return None
+    def getRenames(self, renameFiles=True, renameDir=True):
+        """ Return the (src, dst) paths renameFiles() and renameDirectory() would
+            rename, in the order they would do it. A src of None means dst is a
+            directory to create. Nothing on disk is changed.
+        """
+        renames = []
+        if (renameFiles) and (self.newFileNames):
+            renames += self._getFileRenames()
+        if (renameDir) and (self.newDirName):
+            renames.append((self.dirPath, self._getNewDirPath()))
+        return [(src, dst) for src, dst in renames if (src != dst)]
+        
+    def _getFileRenames(self):
+        """ Return the (src, dst) paths for the video, NFO and subtitle files. """
+        renames = []
         # Rename the Video Files
         for i in range(len(self.newFileNames)):
             curFilePath = "%s/%s" % (self.dirPath, self.curFileNames[i])
             newFilePath = "%s/%s" % (self.dirPath, self.newFileNames[i])
-            self._rename(curFilePath, newFilePath)
+            renames.append((curFilePath, newFilePath))
         # Other files need the same filenames
-        self._renameNfo()
-        self._renameSubtitles()
-        
-    def _renameNfo(self):
-        """ Rename the NFO to files. """
         if (self.curNfoName):
             curNfoPath = "%s/%s" % (self.dirPath, self.curNfoName)
             newNfoPath = "%s/%s.nfo" % (self.dirPath, self.newFilePrefix)
-            self._rename(curNfoPath, newNfoPath)
+            renames.append((curNfoPath, newNfoPath))
+        renames += self._getSubtitleRenames()
+        return renames
     
-    def _renameSubtitles(self):
-        """ Rename the Subtitle files. """
-        includeCount = len(self.curFileNames) >= 2
+    def _getSubtitleRenames(self):
+        """ Return the (src, dst) paths for the Subtitle files. """
+        renames = []
         if (self.subtitles):
+            # Make sure the subtitle directory exists
+            newSubDirPath = "%s/subtitles" % (self.dirPath)
+            if (not self.snapshot.isDir('subtitles')):
+                renames.append((None, newSubDirPath))
             for i in range(len(self.subtitles)):
                 subPath = self.subtitles[i]
                 newFilePrefix = self.newFileNames[i][0:-4]
-                # Make sure the subtitle directory exists
-                newSubDirPath = "%s/subtitles" % (self.dirPath)
-                if (not os.path.exists(newSubDirPath)):
-                    log.info("  >> Creating Dir: %s" % newSubDirPath)
-                    os.mkdir(newSubDirPath, 0755)
                 # Rename SRT Files
                 if (subPath.lower().endswith('.srt')):
                     curSrtPath = "%s/%s" % (self.dirPath, subPath)
                     newSrtPath = "%s/%s.srt" % (newSubDirPath, newFilePrefix)
-                    self._rename(curSrtPath, newSrtPath)
+                    renames.append((curSrtPath, newSrtPath))
                 # Rename IDX, SUB Files
                 elif (subPath.lower().endswith('.idx')):
                     curIdxPath = "%s/%s" % (self.dirPath, subPath)
                     curSubPath = "%s.sub" % (curIdxPath[0:-4])
                     newIdxPath = "%s/%s.idx" % (newSubDirPath, newFilePrefix)
                     newSubPath = "%s/%s.sub" % (newSubDirPath, newFilePrefix)
-                    self._rename(curIdxPath, newIdxPath)
-                    self._rename(curSubPath, newSubPath)
+                    renames.append((curIdxPath, newIdxPath))
+                    renames.append((curSubPath, newSubPath))
+        return renames
+        
+    def _getNewDirPath(self):
+        """ Return the path the directory is renamed to. """
+        return "%s/%s" % (self.dirPath[0:self.dirPath.rfind('/')], self.newDirName)
+    
+    def renameFiles(self, skipImdb=False):
+        """ Rename the Video files. """
+        # Make sure we have new FileNames
+        if (not self.newFileNames) or (skipImdb):
+            log.info("  IMDB Information not available: Skipping renameFiles.")
+            return None
+        for src, dst in self._getFileRenames():
+            if (src is None) and (not os.path.exists(dst)):
+                log.info("  >> Creating Dir: %s" % dst)
+                os.mkdir(dst, 0755)
+            elif (src is not None):
+                self._rename(src, dst)
                     
     def renameDirectory(self):
         if (self.newDirName):
-            curDirPath = self.dirPath
-            newDirPath = "%s/%s" % (curDirPath[0:curDirPath.rfind('/')], self.newDirName)
-            self._rename(curDirPath, newDirPath)
+            newDirPath = self._getNewDirPath()
+            if (self._rename(self.dirPath, newDirPath)):
+                self.dirPath = newDirPath    # Later actions (downloads) use the new path
             
     def _rename(self, src, dst):
         """ Rename the specified file. """
@@ -347,5 +472,7 @@ class Video:
                 return None
             log.info("  >> Renaming: %s" % src)
             log.info("           to: %s" % dst)
-            os.rename(src, dst)
+            with profiler.stage('rename'):
+                os.rename(src, dst)
+            return True
             
\ No newline at end of file
@@ -0,0 +1,275 @@
+"""
+Watch baseDir for new movie directories.
+New directories are reported once they stop changing for a settle period, so
+partial copies are not processed. Uses inotify on Linux (through ctypes) and
+falls back to polling everywhere else.
+"""
+import os
+import time
+import errno
+import Queue
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from util import log
+
+# Inotify Constants (linux/inotify.h)
+IN_MODIFY        = 0x00000002
+IN_ATTRIB        = 0x00000004
+IN_CLOSE_WRITE   = 0x00000008
+IN_MOVED_FROM    = 0x00000040
+IN_MOVED_TO      = 0x00000080
+IN_CREATE        = 0x00000100
+IN_DELETE        = 0x00000200
+IN_DELETE_SELF   = 0x00000400
+IN_MOVE_SELF     = 0x00000800
+IN_Q_OVERFLOW    = 0x00004000
+IN_IGNORED       = 0x00008000
+IN_ISDIR         = 0x40000000
+IN_NONBLOCK      = 0x00000800
+IN_CLOEXEC       = 0x00080000
+EVENT_HEADER     = struct.Struct('iIII')      # wd, mask, cookie, len
+
+BASE_MASK        = IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+MOVIE_MASK       = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+POLL_INTERVAL    = 5                           # Seconds between checks (and polls without inotify)
+
+
+class Inotify:
+    """ Minimal ctypes wrapper around the Linux inotify API. """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._addWatch = libc.inotify_add_watch
+        self._rmWatch = libc.inotify_rm_watch
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if (self.fd < 0):
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def addWatch(self, path, mask):
+        """ Watch the specified path, return the watch descriptor. """
+        wd = self._addWatch(self.fd, path, mask)
+        if (wd < 0):
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed: %s" % path)
+        return wd
+
+    def rmWatch(self, wd):
+        """ Stop watching the specified watch descriptor. """
+        self._rmWatch(self.fd, wd)
+
+    def read(self, timeout):
+        """ Return a list of (wd, mask, cookie, name) events, waiting up to timeout seconds. """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if (not readable):
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError, e:
+            if (e.errno == errno.EAGAIN): return []
+            raise
+        events = []
+        offset = 0
+        while (offset < len(data)):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset+length].rstrip('\0')
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirectoryWatcher(threading.Thread):
+    """ Background thread putting settled new directories of baseDir on a bounded queue. """
+
+    def __init__(self, baseDir, settle=60, maxQueue=100):
+        threading.Thread.__init__(self)
+        self.daemon    = True
+        self.baseDir   = baseDir                  # Directory to watch for new movie dirs
+        self.settle    = settle                   # Seconds a dir must be unchanged before processing
+        self.queue     = Queue.Queue(maxQueue)    # Settled directories ready to be processed
+        self._pending  = {}                       # dirPath -> time of last change
+        self._watches  = {}                       # wd -> dirPath of the movie directory
+        self._watchPaths = {}                     # wd -> path actually watched
+        self._renames  = {}                       # New dirPath -> old dirPath of our own renameDirectory()s
+        self._cookies  = set()                    # Rename cookies of our own renameDirectory()s
+        self._lock     = threading.Lock()
+        self._stopped  = threading.Event()
+        try:
+            self.inotify = Inotify()
+        except (OSError, AttributeError), e:
+            log.warn("inotify not available (%s); polling every %ss" % (e, POLL_INTERVAL))
+            self.inotify = None
+        self._known = set(self._listDirs())       # Directories in baseDir as last seen
+
+    def _listDirs(self):
+        """ Return the directory paths in baseDir. """
+        dirPaths = []
+        for dirName in os.listdir(self.baseDir):
+            dirPath = "%s/%s" % (self.baseDir, dirName)
+            if (os.path.isdir(dirPath)):
+                dirPaths.append(dirPath)
+        return dirPaths
+
+    ####################################
+    #  Consumer Interface
+    ####################################
+
+    def expectRenames(self, renames):
+        """ Record the (src, dst) directory renames we are about to make, so
+            only those dst paths are not seen as new directories.
+        """
+        with self._lock:
+            for src, dst in renames:
+                self._renames[dst] = src
+
+    def doneProcessing(self, dirPath):
+        """ Forget the expected renames of dirPath that didn't happen. """
+        with self._lock:
+            for dst, src in self._renames.items():
+                if (src == dirPath) and (os.path.isdir(src)):
+                    del self._renames[dst]
+
+    def stop(self):
+        self._stopped.set()
+
+    ####################################
+    #  Watching
+    ####################################
+
+    def run(self):
+        """ Watch until stopped, queueing directories once they settle. """
+        if (self.inotify):
+            self.baseWd = self.inotify.addWatch(self.baseDir, BASE_MASK)
+            self._rescan()                          # Created before the watch was added
+        while (not self._stopped.is_set()):
+            if (self.inotify):
+                for event in self.inotify.read(POLL_INTERVAL):
+                    self._handleEvent(*event)
+            else:
+                self._stopped.wait(POLL_INTERVAL)
+                self._poll()
+            self._queueSettled()
+
+    def _touch(self, dirPath):
+        """ Record a change in dirPath, restarting its settle period. """
+        if (dirPath not in self._pending):
+            log.fine("Watching new directory: %s", dirPath)
+        self._pending[dirPath] = time.time()
+
+    def _watchTree(self, dirPath, top=None):
+        """ Add watches for the movie directory (or its sub directory top) and everything below it. """
+        for root, dirNames, fileNames in os.walk(top or dirPath):
+            try:
+                wd = self.inotify.addWatch(root, MOVIE_MASK)
+                self._watches[wd] = dirPath
+                self._watchPaths[wd] = root
+            except OSError, e:
+                log.warn("Unable to watch %s: %s" % (root, e))
+
+    def _unwatch(self, dirPath):
+        """ Remove every watch belonging to the movie directory. """
+        for wd, path in self._watches.items():
+            if (path == dirPath):
+                self.inotify.rmWatch(wd)
+                del self._watches[wd]
+                del self._watchPaths[wd]
+
+    def _subdirPath(self, wd, name):
+        """ Return the path of entry name inside the directory watched by wd. """
+        return "%s/%s" % (self._watchPaths[wd], name)
+
+    def _rescan(self):
+        """ Inotify mode: pick up directories whose events we never saw (before
+            the base watch was added, or dropped when the event queue overflowed).
+        """
+        for dirPath in self._scanNew():
+            self._touch(dirPath)
+            self._watchTree(dirPath)
+        for dirPath in self._pending.keys():
+            if (dirPath not in self._known):
+                self._goneAway(dirPath)
+
+    def _goneAway(self, dirPath):
+        """ Stop watching a pending directory that was deleted or moved out. """
+        log.fine("Directory went away: %s", dirPath)
+        self._unwatch(dirPath)
+        del self._pending[dirPath]
+
+    def _handleEvent(self, wd, mask, cookie, name):
+        """ Update the pending directories for a single inotify event. """
+        if (mask & IN_Q_OVERFLOW):
+            for dirPath in self._pending: self._touch(dirPath)
+            self._rescan()
+        elif (wd == self.baseWd) and (mask & IN_ISDIR):
+            dirPath = "%s/%s" % (self.baseDir, name)
+            if (mask & (IN_CREATE | IN_MOVED_TO)): self._known.add(dirPath)
+            else: self._known.discard(dirPath)
+            with self._lock:
+                if (mask & IN_MOVED_FROM) and (dirPath in self._renames.values()):
+                    self._cookies.add(cookie)
+                    return None
+                if (mask & IN_MOVED_TO) and (cookie in self._cookies) and (dirPath in self._renames):
+                    self._cookies.discard(cookie)  # Our own renameDirectory()
+                    del self._renames[dirPath]
+                    return None
+            if (mask & (IN_CREATE | IN_MOVED_TO)):
+                self._touch(dirPath)
+                self._watchTree(dirPath)
+            elif (mask & (IN_DELETE | IN_MOVED_FROM)) and (dirPath in self._pending):
+                self._goneAway(dirPath)
+        elif (wd in self._watches) and (not mask & IN_IGNORED):
+            dirPath = self._watches[wd]
+            if (dirPath in self._pending):
+                self._touch(dirPath)
+            if (mask & IN_ISDIR) and (mask & (IN_CREATE | IN_MOVED_TO)):
+                self._watchTree(dirPath, self._subdirPath(wd, name))
+
+    def _scanNew(self):
+        """ List baseDir, return the directories that are new since the last
+            scan (not counting our own renames), and forget the ones that went away.
+        """
+        newDirs = []
+        current = set(self._listDirs())
+        for dirPath in current - self._known:
+            with self._lock:
+                oldPath = self._renames.pop(dirPath, None)
+            if (not oldPath):
+                newDirs.append(dirPath)    # Else our own renameDirectory()
+        self._known = current
+        return newDirs
+
+    def _poll(self):
+        """ Polling fallback: detect new directories and changes by stat'ing them. """
+        for dirPath in self._scanNew():
+            self._touch(dirPath)
+        for dirPath in self._pending.keys():
+            if (dirPath not in self._known):
+                self._goneAway(dirPath)
+                continue
+            latest = 0
+            for root, dirNames, fileNames in os.walk(dirPath):
+                for name in [''] + fileNames:
+                    try: latest = max(latest, os.stat(os.path.join(root, name)).st_mtime)
+                    except OSError: pass
+            if (latest > self._pending[dirPath]):
+                self._touch(dirPath)
+
+    def _queueSettled(self):
+        """ Move directories that stopped changing to the work queue (while there is room). """
+        now = time.time()
+        for dirPath, lastChange in sorted(self._pending.items(), key=lambda p: p[1]):
+            if (now - lastChange < self.settle):
+                continue
+            try:
+                self.queue.put_nowait(dirPath)
+            except Queue.Full:
+                break   # Leave the rest pending until the consumer catches up
+            log.fine("Directory settled: %s", dirPath)
+            del self._pending[dirPath]
+            if (self.inotify):
+                self._unwatch(dirPath)